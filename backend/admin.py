@@ -1,3 +1,28 @@
 from django.contrib import admin
 
+from backend import models
+
 # Register your models here.
+
+@admin.register(models.KitRetentionPolicy)
+class KitRetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ('kit', 'raw_days', 'minute_days', 'hour_days', 'day_days')
+
+@admin.register(models.RetentionRun)
+class RetentionRunAdmin(admin.ModelAdmin):
+    list_display = ('started', 'finished', 'state', 'current_table', 'progress', 'measurements_removed', 'rollups_removed')
+    readonly_fields = list_display
+
+@admin.register(models.KitDeletionJob)
+class KitDeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('kit_name', 'action', 'state', 'created', 'finished', 'measurements_deleted', 'measurements_total')
+    readonly_fields = list_display + ('kit', 'max_measurement_id')
+
+@admin.register(models.MeasurementArchiveBlock)
+class MeasurementArchiveBlockAdmin(admin.ModelAdmin):
+    list_display = ('kit', 'peripheral', 'quantity_type', 'start', 'end', 'count')
+    readonly_fields = list_display + ('physical_quantity', 'physical_unit', 'path')
+
+@admin.register(models.UnregisteredQuantityType)
+class UnregisteredQuantityTypeAdmin(admin.ModelAdmin):
+    list_display = ('physical_quantity', 'physical_unit')
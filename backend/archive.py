@@ -0,0 +1,448 @@
+"""
+Module defining the cold-storage archive of old measurements.
+
+Old measurements are rarely read, but make up most of the measurement table.
+The archiver (see `archive`, and the `archive_measurements` management
+command, which is meant to be run periodically) moves measurements older
+than `AFTER_DAYS` days out of the database, into blocks of `BLOCK_DAYS` days
+per peripheral device quantity type, configured by the
+`MEASUREMENT_ARCHIVE` setting, e.g.:
+
+    MEASUREMENT_ARCHIVE = {
+        'DIRECTORY': '/var/lib/astroplant/archive',
+        'AFTER_DAYS': 365,
+        'BLOCK_DAYS': 30,
+    }
+
+Each block is a `backend.models.MeasurementArchiveBlock`, pointing to a
+directory holding one NumPy `.npy` file per column: the date-times (as
+microseconds since the epoch), the values, and the experiment ids (0 for
+none). The files are memory-mapped when read, such that only the pages
+holding the requested time range are loaded. They are not compressed, as
+compressed files cannot be memory-mapped; the columns are still far smaller
+than the rows and indexes they replace.
+
+Reads of `backend.models.Kit.recent_measurements`, the measurement API and
+the kit download include archived measurements. Archived measurements are
+unsaved `backend.models.Measurement` instances, without a primary key.
+
+Measurements without a quantity type are not archived. Measurements stored
+in an archived time range later on (e.g. by backfilling) are merged into the
+block by the next run of the archiver. Rollups are kept, and are no longer
+rebuilt for archived time ranges (see `backend.rollups.rebuild`).
+"""
+
+import datetime
+import heapq
+import os
+import shutil
+import uuid
+
+import numpy
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+import backend.models
+
+#: The default configuration
+DEFAULT_CONFIGURATION = {
+    'DIRECTORY': None,
+    'AFTER_DAYS': None,
+    'BLOCK_DAYS': 30,
+}
+
+#: The columns of a block, and their types
+COLUMNS = (
+    ('date_time', numpy.int64),
+    ('value', numpy.float64),
+    ('experiment_id', numpy.int64),
+)
+
+#: The number of archived measurements removed from the database at once
+CHUNK_SIZE = 5000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_configuration():
+    """
+    Get the archive configuration of the deployment.
+    """
+    configuration = dict(DEFAULT_CONFIGURATION, **getattr(settings, 'MEASUREMENT_ARCHIVE', {}))
+    if configuration['DIRECTORY'] is None:
+        configuration['DIRECTORY'] = os.path.join(settings.BASE_DIR, 'archive')
+    return configuration
+
+
+def to_microseconds(date_time):
+    """
+    Get the number of microseconds since the epoch of a date-time. Naive
+    date-times are taken to be in UTC.
+    """
+    if timezone.is_naive(date_time):
+        date_time = timezone.make_aware(date_time, datetime.timezone.utc)
+    return (date_time - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_microseconds(microseconds):
+    """
+    Get the date-time of a number of microseconds since the epoch.
+    """
+    return _EPOCH + datetime.timedelta(microseconds=int(microseconds))
+
+
+def block_start(date_time, block_days):
+    """
+    Get the start of the block holding a date-time.
+    """
+    length = block_days * 86400 * 1000000
+    microseconds = to_microseconds(date_time)
+    return from_microseconds(microseconds - microseconds % length)
+
+
+def archived_until(kit = None):
+    """
+    Get the end of the most recent archived time range.
+
+    :param kit: The kit (or kit id), or None for the most recent time range of
+    all kits.
+    :return: The time, or None if nothing has been archived.
+    """
+    blocks = backend.models.MeasurementArchiveBlock.objects.all()
+    if kit is not None:
+        blocks = blocks.filter(kit = kit)
+    return blocks.aggregate(end = Max('end'))['end']
+
+
+### Reading ###
+
+def load(block):
+    """
+    Memory-map the columns of a block.
+
+    :return: A dictionary of column names to read-only arrays.
+    """
+    directory = os.path.join(get_configuration()['DIRECTORY'], block.path)
+    return {
+        name: numpy.load(os.path.join(directory, '%s.npy' % name), mmap_mode='r')
+        for (name, _) in COLUMNS
+    }
+
+
+def read(block, since = None, until = None, limit = None):
+    """
+    Read the measurements of a block in a time range.
+
+    :param since: The start of the time range, or None.
+    :param until: The (exclusive) end of the time range, or None.
+    :param limit: The maximum number of (earliest) measurements to read, or
+    None for all.
+    :return: A list of unsaved measurements, ordered by time.
+    """
+    columns = load(block)
+    date_times = columns['date_time']
+
+    first = numpy.searchsorted(date_times, to_microseconds(since)) if since is not None else 0
+    last = numpy.searchsorted(date_times, to_microseconds(until)) if until is not None else len(date_times)
+    if limit is not None:
+        last = min(last, first + limit)
+
+    return [
+        backend.models.Measurement(
+            kit_id = block.kit_id,
+            peripheral_id = block.peripheral_id,
+            quantity_type_id = block.quantity_type_id,
+            experiment_id = int(experiment_id) or None,
+            date_time = from_microseconds(date_time),
+            value = float(value),
+            physical_quantity = block.physical_quantity,
+            physical_unit = block.physical_unit,
+        )
+        for (date_time, value, experiment_id) in zip(
+            date_times[first:last].tolist(),
+            columns['value'][first:last].tolist(),
+            columns['experiment_id'][first:last].tolist(),
+        )
+    ]
+
+
+def series(kit, peripheral, quantity_type, since = None, until = None, last = None):
+    """
+    Get the archived measurements of a peripheral device's quantity type.
+
+    :param since: The start of the time range, or None.
+    :param until: The (exclusive) end of the time range, or None.
+    :param last: The maximum number of (most recent) measurements to get, or
+    None for all.
+    :return: A list of unsaved measurements, ordered by time.
+    """
+    blocks = backend.models.MeasurementArchiveBlock.objects.filter(
+        kit = kit,
+        peripheral = peripheral,
+        quantity_type = quantity_type,
+    )
+    if since is not None:
+        blocks = blocks.filter(end__gt = since)
+    if until is not None:
+        blocks = blocks.filter(start__lt = until)
+
+    if last is None:
+        return [measurement for block in blocks for measurement in read(block, since, until)]
+
+    measurements = []
+    for block in blocks.order_by('-start'):
+        if len(measurements) >= last:
+            break
+        measurements = read(block, since, until) + measurements
+    return measurements[-last:] if last else []
+
+
+def page(blocks, after = None, limit = 100, since = None, until = None):
+    """
+    Get a page of the archived measurements of blocks, ordered by date-time,
+    then by kit, peripheral device and quantity type id.
+
+    Blocks are read in order of their start, and only as far as the page
+    reaches, such that the cost of a page does not depend on its position.
+
+    :param blocks: A queryset of blocks.
+    :param after: The key (see `page_key`) of the measurement to start after,
+    or None to start at the first measurement.
+    :param limit: The maximum number of measurements of the page.
+    :param since: The start of the time range, or None.
+    :param until: The (exclusive) end of the time range, or None.
+    :return: A list of unsaved measurements.
+    """
+    if after is not None:
+        blocks = blocks.filter(end__gt = after[0])
+    if since is not None:
+        blocks = blocks.filter(end__gt = since)
+    if until is not None:
+        blocks = blocks.filter(start__lt = until)
+    blocks = blocks.order_by('start', 'kit', 'peripheral', 'quantity_type').iterator()
+
+    def read_after(block):
+        start = since
+        if after is not None:
+            # Date-times within a block are unique; measurements at the
+            # date-time of `after` follow it if their series does
+            start_after = after[0]
+            if (block.kit_id, block.peripheral_id, block.quantity_type_id) <= tuple(after[1:]):
+                start_after += datetime.timedelta(microseconds=1)
+            start = start_after if start is None else max(start, start_after)
+        return read(block, start, until, limit)
+
+    heap = []
+    measurements = []
+    pending = next(blocks, None)
+    while len(measurements) < limit:
+        # Add the blocks starting before the next measurement
+        while pending is not None and (not heap or pending.start <= heap[0][0]):
+            for measurement in read_after(pending):
+                heapq.heappush(heap, page_key(measurement) + (measurement,))
+            pending = next(blocks, None)
+
+        if not heap:
+            break
+        measurements.append(heapq.heappop(heap)[-1])
+
+    return measurements
+
+
+def page_key(measurement):
+    """
+    Get the key by which archived measurements are paged (see `page`).
+    """
+    return (measurement.date_time, measurement.kit_id, measurement.peripheral_id, measurement.quantity_type_id)
+
+
+def measurements(kits):
+    """
+    Iterate over all archived measurements of kits, by peripheral device
+    quantity type, ordered by time.
+
+    :param kits: A kit, or a queryset of kits.
+    """
+    blocks = backend.models.MeasurementArchiveBlock.objects.all()
+    if isinstance(kits, backend.models.Kit):
+        blocks = blocks.filter(kit = kits)
+    else:
+        blocks = blocks.filter(kit__in = kits)
+
+    yield from read_blocks(blocks)
+
+
+def read_blocks(blocks, since = None, until = None):
+    """
+    Iterate over the archived measurements of blocks in a time range, by
+    peripheral device quantity type, ordered by time. One block is read at a
+    time.
+
+    :param blocks: A queryset of blocks.
+    :param since: The start of the time range, or None.
+    :param until: The (exclusive) end of the time range, or None.
+    """
+    if since is not None:
+        blocks = blocks.filter(end__gt = since)
+    if until is not None:
+        blocks = blocks.filter(start__lt = until)
+
+    for block in blocks.order_by('kit', 'peripheral', 'quantity_type', 'start').iterator():
+        yield from read(block, since, until)
+
+
+def values(kits):
+    """
+    Iterate over all archived measurements of kits as dictionaries, like
+    `QuerySet.values()`.
+    """
+    fields = [field.attname for field in backend.models.Measurement._meta.concrete_fields]
+    for measurement in measurements(kits):
+        yield {field: getattr(measurement, field) for field in fields}
+
+
+### Archiving ###
+
+def archive(now = None):
+    """
+    Move measurements older than the configured number of days into archive
+    blocks.
+
+    :return: The number of measurements archived.
+    """
+    configuration = get_configuration()
+    if configuration['AFTER_DAYS'] is None:
+        return 0
+
+    now = now or timezone.now()
+    cutoff = block_start(now - datetime.timedelta(days=configuration['AFTER_DAYS']), configuration['BLOCK_DAYS'])
+    length = datetime.timedelta(days=configuration['BLOCK_DAYS'])
+
+    old = backend.models.Measurement.objects.exclude(quantity_type = None).filter(date_time__lt = cutoff)
+
+    archived = 0
+    for (kit_id, peripheral_id, quantity_type_id) in old.values_list('kit_id', 'peripheral_id', 'quantity_type_id').distinct().order_by():
+        series_old = old.filter(kit_id = kit_id, peripheral_id = peripheral_id, quantity_type_id = quantity_type_id)
+        while True:
+            first = series_old.aggregate(first = Min('date_time'))['first']
+            if first is None:
+                break
+
+            start = block_start(first, configuration['BLOCK_DAYS'])
+            archived += archive_block(kit_id, peripheral_id, quantity_type_id, start, start + length)
+
+    return archived
+
+
+def archive_block(kit_id, peripheral_id, quantity_type_id, start, end):
+    """
+    Move the measurements of a peripheral device's quantity type in a time
+    range into its archive block, merging them with the block's archived
+    measurements. Of measurements with the same date-time, the archived one
+    is kept.
+
+    The block's files are rewritten to a new directory, which replaces the
+    old directory once the measurements have been removed from the database.
+
+    :return: The number of measurements archived.
+    """
+    rows = list(backend.models.Measurement.objects.filter(
+        kit_id = kit_id,
+        peripheral_id = peripheral_id,
+        quantity_type_id = quantity_type_id,
+        date_time__gte = start,
+        date_time__lt = end,
+    ).order_by('date_time').values_list('pk', 'date_time', 'value', 'experiment_id', 'physical_quantity', 'physical_unit'))
+    if not rows:
+        return 0
+
+    columns = {
+        'date_time': numpy.array([to_microseconds(row[1]) for row in rows], dtype=numpy.int64),
+        'value': numpy.array([row[2] for row in rows], dtype=numpy.float64),
+        'experiment_id': numpy.array([row[3] or 0 for row in rows], dtype=numpy.int64),
+    }
+
+    block = backend.models.MeasurementArchiveBlock.objects.filter(
+        kit_id = kit_id,
+        peripheral_id = peripheral_id,
+        quantity_type_id = quantity_type_id,
+        start = start,
+    ).first()
+
+    (physical_quantity, physical_unit) = rows[0][4:6]
+    if physical_quantity is None:
+        # A compact measurement (see `backend.models.Measurement`)
+        (physical_quantity, physical_unit) = backend.models.QuantityType.objects.physical_quantity_and_unit(quantity_type_id)
+
+    if block is None:
+        block = backend.models.MeasurementArchiveBlock(
+            kit_id = kit_id,
+            peripheral_id = peripheral_id,
+            quantity_type_id = quantity_type_id,
+            start = start,
+            end = end,
+            physical_quantity = physical_quantity,
+            physical_unit = physical_unit,
+        )
+    else:
+        archived = load(block)
+        columns = {name: numpy.concatenate((archived[name], columns[name])) for (name, _) in COLUMNS}
+
+        # A stable sort keeps archived measurements before new measurements
+        # with the same date-time
+        order = numpy.argsort(columns['date_time'], kind='mergesort')
+        columns = {name: column[order] for (name, column) in columns.items()}
+        keep = numpy.ones(len(order), dtype=bool)
+        keep[1:] = columns['date_time'][1:] != columns['date_time'][:-1]
+        columns = {name: column[keep] for (name, column) in columns.items()}
+
+    old_path = block.path
+    block.path = write(kit_id, peripheral_id, quantity_type_id, start, columns)
+    block.count = len(columns['date_time'])
+
+    try:
+        with transaction.atomic():
+            block.save()
+
+            pks = [row[0] for row in rows]
+            for offset in range(0, len(pks), CHUNK_SIZE):
+                backend.models.Measurement.objects.filter(pk__in = pks[offset:offset + CHUNK_SIZE])._raw_delete(block._state.db)
+
+            if old_path:
+                transaction.on_commit(lambda: remove(old_path))
+    except Exception:
+        remove(block.path)
+        raise
+
+    return len(rows)
+
+
+def write(kit_id, peripheral_id, quantity_type_id, start, columns):
+    """
+    Write the columns of a block to a new directory.
+
+    :return: The path of the directory, relative to the archive directory.
+    """
+    path = os.path.join(
+        str(kit_id),
+        "%s-%s-%s-%s" % (peripheral_id, quantity_type_id, start.strftime('%Y%m%d'), uuid.uuid4().hex[:12]),
+    )
+    directory = os.path.join(get_configuration()['DIRECTORY'], path)
+    os.makedirs(directory)
+
+    for (name, dtype) in COLUMNS:
+        numpy.save(os.path.join(directory, '%s.npy' % name), numpy.ascontiguousarray(columns[name], dtype=dtype))
+
+    return path
+
+
+def remove(path):
+    """
+    Remove the files of a block.
+
+    :param path: The path of the block's directory, relative to the archive
+    directory.
+    """
+    shutil.rmtree(os.path.join(get_configuration()['DIRECTORY'], path), ignore_errors=True)
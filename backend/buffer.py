@@ -0,0 +1,339 @@
+"""
+Module defining the process-wide write-behind buffer for measurements.
+
+Measurements to be stored are added to the buffer by the ingest paths, and
+are written by a background thread with a single bulk insert per `MAX_ROWS`
+rows or per `MAX_DELAY` milliseconds, whichever comes first. This coalesces
+the many small inserts of individual kits into few transactions.
+
+The buffer is configured by the `MEASUREMENT_BUFFER` setting, e.g.:
+
+    MEASUREMENT_BUFFER = {
+        'MAX_ROWS': 500,
+        'MAX_DELAY': 1000,
+        'MAX_PENDING': 10000,
+    }
+
+`MAX_PENDING` caps the number of rows held in memory. Adding measurements to
+a buffer at its cap blocks until the background thread has written enough
+rows. Pending rows are written when the process exits. Should the
+background thread stop, it is started again when measurements are added.
+
+Measurements are idempotent (see `backend.models.Measurement`). Measurements
+whose idempotency key is pending or was recently written by the buffer are
+dropped when they are added, such that the ingest paths can report them as
+duplicates without querying the database. Older duplicates are skipped by
+the database when the buffer is written.
+
+Note that when serving through uWSGI, Python threads have to be enabled
+(`enable-threads`) for the background thread to run.
+"""
+
+import atexit
+import collections
+import concurrent.futures
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+import backend.rollups
+
+#: The default configuration of the buffer
+DEFAULT_CONFIGURATION = {
+    'MAX_ROWS': 500,
+    'MAX_DELAY': 1000,
+    'MAX_PENDING': 10000,
+}
+
+
+class MeasurementBuffer(object):
+    """
+    A write-behind buffer for measurements.
+    """
+
+    #: A batch of measurements added to the buffer at once
+    Batch = collections.namedtuple('Batch', ['time_added', 'measurements', 'future'])
+
+    def __init__(self, max_rows, max_delay, max_pending):
+        """
+        :param max_rows: The number of rows after which the buffer is flushed.
+        :param max_delay: The time in seconds after which the buffer is flushed.
+        :param max_pending: The maximum number of rows held by the buffer.
+        """
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, max_rows)
+
+        self._lock = threading.Lock()
+        self._flush_needed = threading.Condition(self._lock)
+        self._space_available = threading.Condition(self._lock)
+
+        self._pending = collections.deque()
+        self._pending_rows = 0
+
+        # Idempotency keys of measurements pending or recently written
+        self._known_keys = collections.OrderedDict()
+        self.max_known_keys = 2 * self.max_pending
+        self._thread = None
+        self._closed = False
+
+        self._counters = {
+            'flushes': 0,
+            'rows_flushed': 0,
+            'rows_failed': 0,
+            'rows_duplicate': 0,
+            'last_flush_size': 0,
+            'max_flush_size': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+            'total_flush_latency': 0.0,
+        }
+
+    def add(self, measurements):
+        """
+        Add measurements to be stored. Blocks while the buffer is at its cap.
+        Measurements whose idempotency key is pending or was recently written
+        are dropped.
+
+        :param measurements: A list of unsaved measurements.
+        :return: A tuple of a `concurrent.futures.Future` that is resolved once
+        the measurements have been written, and a list of the measurements
+        dropped as duplicates.
+        """
+        future = concurrent.futures.Future()
+        if not measurements:
+            future.set_result(None)
+            return (future, [])
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The measurement buffer is closed")
+
+            while self._pending_rows > 0 and self._pending_rows + len(measurements) > self.max_pending:
+                # The background thread is checked on while waiting, in case
+                # it stopped
+                self._start_thread()
+                self._space_available.wait(self.max_delay)
+
+            unique = []
+            duplicates = []
+            for measurement in measurements:
+                key = measurement.idempotency_key()
+                if key is None:
+                    unique.append(measurement)
+                elif key in self._known_keys:
+                    duplicates.append(measurement)
+                else:
+                    self._known_keys[key] = True
+                    unique.append(measurement)
+
+            while len(self._known_keys) > self.max_known_keys:
+                self._known_keys.popitem(last=False)
+
+            self._counters['rows_duplicate'] += len(duplicates)
+            measurements = unique
+            if not measurements:
+                future.set_result(None)
+                return (future, duplicates)
+
+            self._pending.append(self.Batch(time.monotonic(), list(measurements), future))
+            self._pending_rows += len(measurements)
+
+            self._start_thread()
+
+            if self._pending_rows >= self.max_rows:
+                self._flush_needed.notify()
+
+        return (future, duplicates)
+
+    def flush(self):
+        """
+        Write all pending measurements in the calling thread.
+        """
+        with self._lock:
+            batches = self._take(self._pending_rows)
+
+        self._write(batches)
+
+    def close(self):
+        """
+        Stop the background thread after it has written all pending
+        measurements. Measurements can no longer be added afterwards.
+        """
+        with self._lock:
+            self._closed = True
+            self._flush_needed.notify()
+            thread = self._thread
+
+        if thread is not None:
+            thread.join()
+
+        # Write anything left, in case the background thread failed
+        self.flush()
+
+    def counters(self):
+        """
+        Get a dictionary of the buffer's counters, holding the number of
+        flushes, the number of rows written, failed and dropped as duplicates,
+        the sizes of the last and largest flush, and the last, largest and
+        mean flush latency in seconds.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['pending_rows'] = self._pending_rows
+
+        counters['mean_flush_size'] = counters['rows_flushed'] / counters['flushes'] if counters['flushes'] else 0.0
+        counters['mean_flush_latency'] = counters['total_flush_latency'] / counters['flushes'] if counters['flushes'] else 0.0
+        return counters
+
+    def _take(self, rows):
+        """
+        Take whole batches from the buffer up to at least the given number
+        of rows (or all of them). Must be called while holding the lock.
+        """
+        batches = []
+        taken = 0
+        while self._pending and taken < rows:
+            batch = self._pending.popleft()
+            batches.append(batch)
+            taken += len(batch.measurements)
+
+        self._pending_rows -= taken
+        self._space_available.notify_all()
+        return batches
+
+    def _start_thread(self):
+        """
+        Start the background thread, unless it is running. Must be called
+        while holding the lock.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='measurement-buffer', daemon=True)
+            self._thread.start()
+
+    def _flush_due(self):
+        """
+        Test whether the buffer should be flushed. Must be called while
+        holding the lock.
+        """
+        return self._pending_rows >= self.max_rows or (
+            self._pending and time.monotonic() - self._pending[0].time_added >= self.max_delay
+        )
+
+    def _run(self):
+        """
+        Run the background thread writing the buffer.
+        """
+        while True:
+            with self._lock:
+                while not self._closed and not self._flush_due():
+                    if self._pending:
+                        timeout = self.max_delay - (time.monotonic() - self._pending[0].time_added)
+                    else:
+                        timeout = None
+                    self._flush_needed.wait(timeout)
+
+                if self._closed and not self._pending:
+                    return
+
+                batches = self._take(self.max_rows)
+
+            try:
+                # The background thread holds its own database connection;
+                # make sure it is usable before writing
+                close_old_connections()
+                self._write(batches)
+            except Exception as exception:
+                # The thread keeps running; the batches are failed
+                self._fail(batches, exception)
+                print("Measurement buffer: exception on writing measurements")
+                print(exception)
+
+    def _write(self, batches):
+        """
+        Write batches of measurements, using a single bulk insert per
+        `max_rows` rows. If that fails, the batches are written separately,
+        such that a single invalid batch does not prevent others from being
+        stored. Measurements that have already been stored are skipped, and
+        the rollups are updated (see `backend.rollups`).
+        """
+        if not batches:
+            return
+
+        measurements = [measurement for batch in batches for measurement in batch.measurements]
+
+        start = time.perf_counter()
+
+        failed = []
+        inserted = 0
+        try:
+            inserted = backend.rollups.insert_measurements(measurements, batch_size=self.max_rows)
+            for batch in batches:
+                batch.future.set_result(None)
+        except Exception:
+            for batch in batches:
+                try:
+                    inserted += backend.rollups.insert_measurements(batch.measurements)
+                    batch.future.set_result(None)
+                except Exception as exception:
+                    failed.extend(batch.measurements)
+                    batch.future.set_exception(exception)
+                    print("Measurement buffer: exception on storing measurements")
+                    print(exception)
+
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            # Measurements that were not stored may be published again
+            for measurement in failed:
+                self._known_keys.pop(measurement.idempotency_key(), None)
+
+            self._counters['flushes'] += 1
+            self._counters['rows_flushed'] += inserted
+            self._counters['rows_failed'] += len(failed)
+            self._counters['rows_duplicate'] += len(measurements) - len(failed) - inserted
+            self._counters['last_flush_size'] = len(measurements)
+            self._counters['max_flush_size'] = max(self._counters['max_flush_size'], len(measurements))
+            self._counters['last_flush_latency'] = latency
+            self._counters['max_flush_latency'] = max(self._counters['max_flush_latency'], latency)
+            self._counters['total_flush_latency'] += latency
+
+    def _fail(self, batches, exception):
+        """
+        Fail the batches that have not been written.
+        """
+        failed = [batch for batch in batches if not batch.future.done()]
+        for batch in failed:
+            batch.future.set_exception(exception)
+
+        with self._lock:
+            for batch in failed:
+                for measurement in batch.measurements:
+                    self._known_keys.pop(measurement.idempotency_key(), None)
+                self._counters['rows_failed'] += len(batch.measurements)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_measurement_buffer():
+    """
+    Get the process-wide measurement buffer, creating it on first use. The
+    buffer is closed (and thereby flushed) when the process exits.
+    """
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None:
+            configuration = dict(DEFAULT_CONFIGURATION, **getattr(settings, 'MEASUREMENT_BUFFER', {}))
+            _buffer = MeasurementBuffer(
+                max_rows = configuration['MAX_ROWS'],
+                max_delay = configuration['MAX_DELAY'] / 1000.0,
+                max_pending = configuration['MAX_PENDING'],
+            )
+            atexit.register(_buffer.close)
+
+    return _buffer
@@ -0,0 +1,87 @@
+"""
+Module defining the conversion of stored measurements to and from compact
+rows, which do not hold their physical quantity and unit strings (see
+`backend.models.Measurement`).
+
+Measurements are converted in batches of `BATCH_SIZE` consecutive primary
+keys, each in its own transaction. The conversion takes the app registry to
+get the models from, such that it can be run by migrations as well.
+"""
+
+from django.db import transaction
+from django.db.models import Max, Min, Q
+
+#: The number of consecutive primary keys converted at once
+BATCH_SIZE = 5000
+
+
+def convert(apps, compact, batch_size = BATCH_SIZE):
+    """
+    Set the unregistered quantity types of stored measurements without a
+    quantity type, and remove (or fill in) the physical quantity and unit
+    strings of stored measurements.
+
+    :param apps: The app registry.
+    :param compact: Whether to remove the strings, rather than fill them in.
+    :return: The number of measurements changed.
+    """
+    Measurement = apps.get_model('backend', 'Measurement')
+    QuantityType = apps.get_model('backend', 'QuantityType')
+    UnregisteredQuantityType = apps.get_model('backend', 'UnregisteredQuantityType')
+
+    bounds = Measurement.objects.aggregate(first = Min('pk'), last = Max('pk'))
+    if bounds['first'] is None:
+        return 0
+
+    unregistered_pks = {
+        (physical_quantity, physical_unit): pk
+        for (pk, physical_quantity, physical_unit) in UnregisteredQuantityType.objects.values_list('pk', 'physical_quantity', 'physical_unit')
+    }
+
+    changed = 0
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        with transaction.atomic():
+            batch = Measurement.objects.filter(pk__gte = start, pk__lt = start + batch_size)
+
+            pks_by_pair = {}
+            for (pk, physical_quantity, physical_unit) in batch.filter(
+                quantity_type = None,
+                unregistered_quantity_type = None,
+            ).exclude(physical_quantity = None).exclude(physical_unit = None).values_list('pk', 'physical_quantity', 'physical_unit'):
+                pks_by_pair.setdefault((physical_quantity, physical_unit), []).append(pk)
+
+            for (pair, pks) in pks_by_pair.items():
+                if pair not in unregistered_pks:
+                    (unregistered_quantity_type, _) = UnregisteredQuantityType.objects.get_or_create(
+                        physical_quantity = pair[0],
+                        physical_unit = pair[1],
+                    )
+                    unregistered_pks[pair] = unregistered_quantity_type.pk
+                changed += batch.filter(pk__in = pks).update(unregistered_quantity_type_id = unregistered_pks[pair])
+
+            if compact:
+                changed += batch.filter(
+                    Q(quantity_type__isnull = False) | Q(unregistered_quantity_type__isnull = False)
+                ).exclude(physical_quantity = None).update(physical_quantity = None, physical_unit = None)
+            else:
+                changed += _expand(batch, 'quantity_type_id', QuantityType)
+                changed += _expand(batch, 'unregistered_quantity_type_id', UnregisteredQuantityType)
+
+    return changed
+
+
+def _expand(batch, field, model):
+    """
+    Fill in the physical quantity and unit strings of compact measurements
+    from the model referenced by a field.
+    """
+    compact = batch.filter(physical_quantity = None).exclude(**{field: None})
+
+    changed = 0
+    for pk in compact.order_by().values_list(field, flat=True).distinct():
+        instance = model.objects.get(pk = pk)
+        changed += compact.filter(**{field: pk}).update(
+            physical_quantity = instance.physical_quantity,
+            physical_unit = instance.physical_unit,
+        )
+    return changed
@@ -0,0 +1,119 @@
+"""
+Module defining the versioned, rendered configurations of kits.
+
+Kits poll their configuration (see `backend.models.Kit.generate_config`).
+Rather than generating it for every poll, the configuration is rendered once
+and stored as a `backend.models.KitConfiguration`, along with a hash of its
+contents, which the API serves as the configuration's ETag: a poll of an
+unchanged configuration takes a single indexed lookup, and is answered with
+304 Not Modified if the kit passes the ETag it has in `If-None-Match`.
+
+Whenever any input of a kit's configuration changes (the kit, its peripheral
+devices and their configurations, or their definitions and quantity types),
+the signal receivers in `backend.signals` bump the configuration's version
+and clear the rendered configuration (see `invalidate`), such that it is
+rendered again by the next poll.
+"""
+
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+import backend.models
+
+
+def render(config):
+    """
+    Render a configuration as canonical JSON.
+
+    :return: A tuple of the JSON and its hash.
+    """
+    rendered = json.dumps(config, sort_keys=True, separators=(',', ':'))
+    return (rendered, hashlib.sha1(rendered.encode('utf-8')).hexdigest())
+
+
+def get(kits):
+    """
+    Get the rendered configurations of kits, rendering the configurations
+    that have changed since they were last rendered.
+
+    :param kits: A queryset of kits.
+    :return: A list of `backend.models.KitConfiguration`, in the order of the
+    kits.
+    """
+    return list(of_kits(kits.select_related('configuration')))
+
+
+def of_kits(kits):
+    """
+    Iterate over the rendered configurations of kits, rendering the
+    configurations that have changed since they were last rendered.
+
+    :param kits: An iterable of kits, selected along with their
+    configurations (see `get`).
+    """
+    for kit in kits:
+        try:
+            configuration = kit.configuration
+        except backend.models.KitConfiguration.DoesNotExist:
+            configuration = None
+
+        if configuration is None or configuration.config is None:
+            configuration = update(kit, configuration)
+        yield configuration
+
+
+def update(kit, configuration = None):
+    """
+    Render the configuration of a kit, and store it unless its inputs
+    changed in the meantime.
+
+    A kit without a stored configuration first gets one without a rendered
+    configuration, such that changes made while rendering bump its version
+    (see `invalidate`) and the rendered configuration is not stored.
+
+    :param configuration: The kit's stored configuration, if any.
+    :return: The `backend.models.KitConfiguration`.
+    """
+    if configuration is None:
+        try:
+            with transaction.atomic():
+                configuration = backend.models.KitConfiguration.objects.create(kit = kit)
+        except IntegrityError:
+            # Stored concurrently
+            configuration = backend.models.KitConfiguration.objects.get(kit = kit)
+
+    # The version is read before rendering
+    (config, digest) = render(kit.generate_config())
+
+    configuration.config = config
+    configuration.hash = digest
+    backend.models.KitConfiguration.objects.filter(
+        kit = kit,
+        version = configuration.version,
+    ).update(config = config, hash = digest)
+    return configuration
+
+
+def invalidate(kits):
+    """
+    Bump the configuration versions of kits, and clear their rendered
+    configurations.
+
+    :param kits: An iterable of kit ids, or a queryset of kits.
+    """
+    backend.models.KitConfiguration.objects.filter(kit__in = kits).update(
+        version = F('version') + 1,
+        config = None,
+    )
+
+
+def etag(configurations):
+    """
+    Get the ETag of one or more configurations.
+    """
+    if len(configurations) == 1:
+        return '"%s"' % configurations[0].hash
+    return '"%s"' % hashlib.sha1(':'.join(configuration.hash for configuration in configurations).encode('ascii')).hexdigest()
@@ -0,0 +1,88 @@
+"""
+Module defining the conflation of REAL_TIME measurements sent to subscribers.
+
+REAL_TIME measurements are only of interest while they are current. Instead
+of sending every REAL_TIME measurement to a subscriber, only the newest
+pending measurement of each series (peripheral device and quantity type) is
+kept, and the pending measurements are sent at most once per interval. The
+memory held for a subscriber is thereby bounded by the number of series of
+the kit, and the rate at which frames are sent by the interval, regardless
+of how fast kits produce measurements or how slow the subscriber is.
+
+The interval is configured in milliseconds by the
+`REAL_TIME_SUBSCRIPTION_INTERVAL` setting. An interval of 0 disables
+conflation. REDUCED measurements are never conflated.
+"""
+
+import collections
+import time
+
+from django.conf import settings
+
+#: The default interval in milliseconds
+DEFAULT_REAL_TIME_SUBSCRIPTION_INTERVAL = 250
+
+
+def get_interval():
+    """
+    Get the configured conflation interval in seconds, or None if conflation
+    is disabled.
+    """
+    interval = getattr(settings, 'REAL_TIME_SUBSCRIPTION_INTERVAL', DEFAULT_REAL_TIME_SUBSCRIPTION_INTERVAL)
+    if not interval:
+        return None
+    return interval / 1000.0
+
+
+class Conflator(object):
+    """
+    Holds the newest pending measurement event of each series for a
+    subscriber. The conflator does not send anything itself; the consumer
+    flushes it when told to.
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: The minimum time in seconds between flushes.
+        """
+        self.interval = interval
+
+        self._pending = collections.OrderedDict()
+        self._last_flush = None
+        self._flush_scheduled = False
+
+    def add(self, series, event):
+        """
+        Add a measurement event, replacing the pending event of the same
+        series.
+
+        :param series: The series of the event, a hashable.
+        :param event: The measurement channel event.
+        :return: The delay in seconds after which the conflator should be
+        flushed, 0 if it should be flushed immediately, or None if a flush has
+        already been scheduled.
+        """
+        self._pending.pop(series, None)
+        self._pending[series] = event
+
+        if self._flush_scheduled:
+            return None
+
+        self._flush_scheduled = True
+
+        if self._last_flush is None:
+            return 0
+        return max(0, self.interval - (time.monotonic() - self._last_flush))
+
+    def take(self):
+        """
+        Take all pending events, in the order they were last updated.
+        """
+        events = list(self._pending.values())
+        self._pending.clear()
+        self._last_flush = time.monotonic()
+        self._flush_scheduled = False
+        return events
+
+    def __len__(self):
+        return len(self._pending)
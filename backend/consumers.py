@@ -1,11 +1,36 @@
 import channels
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+import asyncio
 import json
+import urllib.parse
 
 import backend.models
 import backend.serializers
 import backend.auth
+import backend.conflation
+import backend.configuration
+import backend.ingest
+import backend.signals
+import backend.wire
+from backend.executor import database_sync_to_async
+
+def kit_config_payload(kit):
+    """
+    Get the payload of a message holding the configuration of a kit (see
+    `backend.configuration`).
+
+    :return: The payload, or None if the kit no longer exists (or is
+    deleted, but not removed yet).
+    """
+    configurations = backend.configuration.get(backend.models.Kit.kits.filter(pk=kit.pk))
+    if not configurations:
+        return None
+    return {
+        'version': configurations[0].version,
+        'hash': configurations[0].hash,
+        'config': json.loads(configurations[0].config),
+    }
 
 class MeasurementSubscribeConsumer(WebsocketConsumer):
     """
@@ -23,7 +48,10 @@ class MeasurementSubscribeConsumer(WebsocketConsumer):
             # Reject channel
             return
 
-        self.kit = backend.models.Kit.objects.get(username=self.scope['url_route']['kwargs']['kit_name'])
+        self.kit = backend.models.Kit.kits.get(username=self.scope['url_route']['kwargs']['kit_name'])
+        self.binary = wants_binary(self.scope)
+        self.conflator = create_conflator()
+        self.flush_timer = None
         
         if self.user.has_perm('backend.subscribe_to_kit_measurements_websocket', self.kit):
             async_to_sync(self.channel_layer.group_add)(
@@ -34,6 +62,9 @@ class MeasurementSubscribeConsumer(WebsocketConsumer):
             self.accept()
 
     def disconnect(self, close_code):
+        if self.flush_timer is not None:
+            async_to_sync(self.cancel_flush)()
+
         # Leave group
         async_to_sync(self.channel_layer.group_discard)(
             "kit-measurements-%s" % self.kit.username,
@@ -44,15 +75,70 @@ class MeasurementSubscribeConsumer(WebsocketConsumer):
         """
         Called when a measurement channel event is received
         from the kit whose measuremnents the channel is subscribed to.
+        REAL_TIME measurements are conflated (see `backend.conflation`).
+
+        :param event: The measurement channel event, holding the pre-encoded
+        frames (see `backend.ingest.measurement_event`).
+        """
+        if self.conflator is None or event['measurement_type'] != "REAL_TIME":
+            self.send_events([event])
+            return
+
+        delay = self.conflator.add(tuple(event['series']), event)
+        if delay == 0:
+            self.send_events(self.conflator.take())
+        elif delay is not None:
+            self.flush_timer = async_to_sync(self.schedule_flush)(delay)
+
+    async def schedule_flush(self, delay):
+        """
+        Schedule a flush in the consumer's event loop. The flush is sent
+        through the channel layer, such that it is handled in the consumer's
+        thread like any other event.
+
+        :return: The `asyncio.TimerHandle` of the flush.
+        """
+        return asyncio.get_event_loop().call_later(
+            delay,
+            lambda: asyncio.ensure_future(self.channel_layer.send(self.channel_name, {'type': 'measurement.flush'}))
+        )
+
+    async def cancel_flush(self):
+        """
+        Cancel the scheduled flush, in the consumer's event loop.
+        """
+        self.flush_timer.cancel()
+
+    def measurement_flush(self, event):
+        """
+        Called when the pending REAL_TIME measurements are to be sent.
+        """
+        self.flush_timer = None
+        self.send_events(self.conflator.take())
 
-        :param event: The measurement channel event.
+    def send_events(self, events):
         """
-        self.send(json.dumps(event['message']))
+        Send the frames of measurement channel events. Binary frames are
+        joined into a single frame.
+        """
+        if not events:
+            return
+
+        if self.binary:
+            self.send(bytes_data=backend.wire.join_measurements([event['bytes'] for event in events]))
+        else:
+            for event in events:
+                self.send(event['text'])
 
 class KitConsumer(WebsocketConsumer):
     """
     A kit consumer. Any authenticated kit can open this channel.
     The channel can be used to, for example, publish measurements.
+
+    Changes of the kit's configuration are pushed to the kit on the `config`
+    stream, with a payload holding the configuration's version, hash and
+    the configuration itself. The kit can request its configuration on the
+    same stream.
     """
     def connect(self):
         if not 'user' in self.scope:
@@ -62,15 +148,75 @@ class KitConsumer(WebsocketConsumer):
         # User must be a Kit.
         if isinstance(self.scope['user'], backend.models.Kit):
             self.kit = self.scope['user']
+            self.resolver = backend.ingest.MeasurementResolver(self.kit)
+
+            # The hash of the configuration last sent to the kit
+            self.config_hash = None
+
+            async_to_sync(self.channel_layer.group_add)(
+                backend.signals.kit_resolution_group(self.kit.username),
+                self.channel_name
+            )
+            async_to_sync(self.channel_layer.group_add)(
+                backend.signals.kit_config_group(self.kit.pk),
+                self.channel_name
+            )
+
             self.accept()
 
-    def receive(self, text_data):
+    def disconnect(self, close_code):
+        if not hasattr(self, 'kit'):
+            return
+
+        # Leave groups
+        async_to_sync(self.channel_layer.group_discard)(
+            backend.signals.kit_resolution_group(self.kit.username),
+            self.channel_name
+        )
+        async_to_sync(self.channel_layer.group_discard)(
+            backend.signals.kit_config_group(self.kit.pk),
+            self.channel_name
+        )
+
+    def kit_config_changed(self, event):
+        """
+        Called when the configuration of the kit has changed. The new
+        configuration is pushed to the kit, unless it is the configuration
+        last sent to the kit.
+
+        :param event: The change channel event.
+        """
+        payload = kit_config_payload(self.kit)
+        if payload is None or payload['hash'] == self.config_hash:
+            return
+
+        self.config_hash = payload['hash']
+        self.send(json.dumps({
+            'stream': 'config',
+            'payload': payload
+        }))
+
+    def kit_resolution_invalidate(self, event):
+        """
+        Called when the peripheral devices, peripheral device definitions or
+        quantity types of the kit have changed.
+
+        :param event: The invalidation channel event.
+        """
+        self.resolver.invalidate()
+
+    def receive(self, text_data=None, bytes_data=None):
         """
         :param text_data: The received data. Expected to be a json encoded string,
         with keys 'stream' indicating the functionality to be used, 'nonce' indicating
         some unique data that should be returned as-is in a reply from the server, and
         optionally 'payload', data that is sent to the desired functionality.
+        :param bytes_data: The received data of a binary frame, see `backend.wire`.
         """
+        if bytes_data is not None:
+            self.receive_binary(bytes_data)
+            return
+
         content = json.loads(text_data)
 
         stream = content['stream']
@@ -85,6 +231,34 @@ class KitConsumer(WebsocketConsumer):
 
         if stream == "publish-measurement":
             self.publish_measurement(payload, send_reply)
+        elif stream == "publish-measurements":
+            self.publish_measurements(payload, send_reply)
+        elif stream == "config":
+            self.send_config(send_reply)
+
+    def send_config(self, send_reply):
+        """
+        Reply with the configuration of the kit. If the kit no longer exists,
+        an error is sent in reply and the connection is closed.
+        """
+        payload = kit_config_payload(self.kit)
+        if payload is None:
+            send_reply({"error": "The kit no longer exists."})
+            self.close()
+            return
+
+        self.config_hash = payload['hash']
+        send_reply(payload)
+
+    def broadcast_measurement(self, measurement_type, measurement):
+        """
+        Send a measurement to all channels listening on the
+        `kit-measurements-%s` group.
+        """
+        async_to_sync(self.channel_layer.group_send)(
+            "kit-measurements-%s" % self.kit.username,
+            backend.ingest.measurement_event(measurement_type, measurement)
+        )
 
     def publish_measurement(self, content, send_reply):
         """
@@ -94,45 +268,414 @@ class KitConsumer(WebsocketConsumer):
         """
         
         try:
-            # Fetch measurement message type
-            measurement_type = content['measurement_type']
+            (measurement_type, measurement) = backend.ingest.deserialize_measurement(self.resolver, content)
+
+            # Store reduced measurements
+            (future, [duplicate]) = backend.ingest.store_measurements([(measurement_type, measurement)])
+
+            if not duplicate:
+                self.broadcast_measurement(measurement_type, measurement)
+            send_reply({"success": "published", "duplicates": int(duplicate)})
+        except Exception as exception:
+            send_reply({"error": "You must provide a valid measurement.'."})
+            print("Websocket: exception on publishing measurement")
+            print(exception)
+
+    def publish_measurements(self, content, send_reply):
+        """
+        Publish a batch of measurements. The payload is expected to hold a key
+        'measurements' with a list of measurement messages, each formatted as
+        the payload of `publish-measurement`.
+
+        All valid measurements of type REDUCED are added to the measurement
+        buffer at once, and all valid measurements are sent to all channels listening
+        on the `kit-measurements-%s` group. A single reply is sent, holding
+        a list of results in the same order as the measurements.
+        """
+        try:
+            contents = content['measurements']
+            if not isinstance(contents, list):
+                raise ValueError("'measurements' must be a list")
+        except Exception as exception:
+            send_reply({"error": "You must provide a list of measurements."})
+            print("Websocket: exception on publishing measurements")
+            print(exception)
+            return
 
-            # Deserialize measurement
-            measurement_serializer = backend.serializers.MeasurementSerializer(data=content['measurement'])
-            measurement_serializer.is_valid(raise_exception = True)
+        (published, results) = backend.ingest.deserialize_measurements(self.resolver, contents)
+
+        try:
+            (future, duplicates) = backend.ingest.store_measurements(published)
+        except Exception as exception:
+            send_reply({"error": "The measurements could not be stored."})
+            print("Websocket: exception on storing measurements")
+            print(exception)
+            return
 
-            measurement = backend.models.Measurement(**measurement_serializer.validated_data)
+        for ((measurement_type, measurement), duplicate) in zip(published, duplicates):
+            if not duplicate:
+                self.broadcast_measurement(measurement_type, measurement)
 
-            # Add the kit to the measurement
-            measurement.kit = self.kit
+        send_reply({"results": results, "duplicates": sum(duplicates)})
 
-            # Get the peripheral device object by its name (if it's associated with this kit)
-            peripheral = self.kit.peripherals.filter(name=content['measurement']['peripheral']).get()
+    def receive_binary(self, data):
+        """
+        Handle a binary frame. Only `backend.wire.PUBLISH` frames are supported;
+        valid measurements are published as by `publish_measurements`, and a
+        `backend.wire.PUBLISH_REPLY` frame is sent in reply.
+        """
+        try:
+            (opcode, nonce, count) = backend.wire.decode_header(data)
+        except backend.wire.FrameError as exception:
+            print("Websocket: malformed binary frame")
+            print(exception)
+            return
 
-            # Add peripheral to the measurement object
-            measurement.peripheral = peripheral
+        try:
+            (nonce, records) = backend.wire.decode_measurements(data, opcode=backend.wire.PUBLISH)
+            (published, statuses) = backend.ingest.deserialize_records(self.resolver, records)
+            (future, duplicates) = backend.ingest.store_measurements(published)
+        except Exception as exception:
+            self.send(bytes_data=backend.wire.encode_publish_reply(nonce, [backend.wire.STATUS_ERROR] * count))
+            print("Websocket: exception on publishing binary frame")
+            print(exception)
+            return
 
-            # Get the registered measurement type by the physical quantity and physical unit if it exists
-            quantity_types_qs = peripheral.peripheral_definition.quantity_types.filter(physical_quantity = measurement.physical_quantity, physical_unit = measurement.physical_unit)
-            if quantity_types_qs:
-                quantity_type = quantity_types_qs.first()
-                measurement.quantity_type = quantity_type
+        backend.ingest.mark_duplicate_records(statuses, duplicates)
+        for ((measurement_type, measurement), duplicate) in zip(published, duplicates):
+            if not duplicate:
+                self.broadcast_measurement(measurement_type, measurement)
 
-            if measurement_type == "REDUCED":
-                # Store reduced measurements
-                measurement.save()
+        self.send(bytes_data=backend.wire.encode_publish_reply(nonce, statuses))
 
-            output_serializer = backend.serializers.MeasurementOutputSerializer(measurement)
-            message = {'measurement_type': measurement_type, 'measurement': output_serializer.data}
-            async_to_sync(self.channel_layer.group_send)(
+
+class AsyncMeasurementSubscribeConsumer(AsyncWebsocketConsumer):
+    """
+    Asynchronous version of `MeasurementSubscribeConsumer`. Database access is
+    performed in the bounded thread pool of `backend.executor`, such that
+    an open connection costs only a coroutine.
+    """
+    async def connect(self):
+        if not 'user' in self.scope:
+            # Reject channel
+            return
+
+        self.user = self.scope['user']
+
+        if not 'kit_name' in self.scope['url_route']['kwargs']:
+            # Reject channel
+            return
+
+        kit = await database_sync_to_async(backend.models.Kit.kits.safe_get_by_username)(self.scope['url_route']['kwargs']['kit_name'])
+        if not kit:
+            # Reject channel
+            return
+
+        if await database_sync_to_async(self.user.has_perm)('backend.subscribe_to_kit_measurements_websocket', kit):
+            self.kit = kit
+            self.binary = wants_binary(self.scope)
+            self.conflator = create_conflator()
+            self.flush_timer = None
+
+            await self.channel_layer.group_add(
                 "kit-measurements-%s" % self.kit.username,
-                {
-                    'type': 'measurement',
-                    'message': message
-                }
+                self.channel_name
+            )
+
+            await self.accept()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'kit'):
+            return
+
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+
+        # Leave group
+        await self.channel_layer.group_discard(
+            "kit-measurements-%s" % self.kit.username,
+            self.channel_name
+        )
+
+    async def measurement(self, event):
+        """
+        Called when a measurement channel event is received
+        from the kit whose measuremnents the channel is subscribed to.
+        REAL_TIME measurements are conflated (see `backend.conflation`).
+
+        :param event: The measurement channel event, holding the pre-encoded
+        frames (see `backend.ingest.measurement_event`).
+        """
+        if self.conflator is None or event['measurement_type'] != "REAL_TIME":
+            await self.send_events([event])
+            return
+
+        delay = self.conflator.add(tuple(event['series']), event)
+        if delay == 0:
+            await self.send_events(self.conflator.take())
+        elif delay is not None:
+            self.flush_timer = asyncio.get_event_loop().call_later(
+                delay,
+                lambda: asyncio.ensure_future(self.measurement_flush(None))
+            )
+
+    async def measurement_flush(self, event):
+        """
+        Called when the pending REAL_TIME measurements are to be sent.
+        """
+        self.flush_timer = None
+        await self.send_events(self.conflator.take())
+
+    async def send_events(self, events):
+        """
+        Send the frames of measurement channel events. See
+        `MeasurementSubscribeConsumer.send_events`.
+        """
+        if not events:
+            return
+
+        if self.binary:
+            await self.send(bytes_data=backend.wire.join_measurements([event['bytes'] for event in events]))
+        else:
+            for event in events:
+                await self.send(event['text'])
+
+
+class AsyncKitConsumer(AsyncWebsocketConsumer):
+    """
+    Asynchronous version of `KitConsumer`. Database access is performed in the
+    bounded thread pool of `backend.executor`, such that an open connection
+    costs only a coroutine. Measurements of which the peripheral devices
+    are cached by the kit's measurement resolver are deserialized without
+    leaving the event loop.
+    """
+    async def connect(self):
+        if not 'user' in self.scope:
+            # Reject channel
+            return
+
+        # User must be a Kit.
+        if isinstance(self.scope['user'], backend.models.Kit):
+            self.kit = self.scope['user']
+            self.resolver = backend.ingest.MeasurementResolver(self.kit)
+
+            # The hash of the configuration last sent to the kit
+            self.config_hash = None
+
+            await self.channel_layer.group_add(
+                backend.signals.kit_resolution_group(self.kit.username),
+                self.channel_name
             )
-            send_reply({"success": "published"})
+            await self.channel_layer.group_add(
+                backend.signals.kit_config_group(self.kit.pk),
+                self.channel_name
+            )
+
+            await self.accept()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'kit'):
+            return
+
+        # Leave groups
+        await self.channel_layer.group_discard(
+            backend.signals.kit_resolution_group(self.kit.username),
+            self.channel_name
+        )
+        await self.channel_layer.group_discard(
+            backend.signals.kit_config_group(self.kit.pk),
+            self.channel_name
+        )
+
+    async def kit_config_changed(self, event):
+        """
+        Called when the configuration of the kit has changed. See
+        `KitConsumer.kit_config_changed`.
+
+        :param event: The change channel event.
+        """
+        payload = await database_sync_to_async(kit_config_payload)(self.kit)
+        if payload is None or payload['hash'] == self.config_hash:
+            return
+
+        self.config_hash = payload['hash']
+        await self.send(json.dumps({
+            'stream': 'config',
+            'payload': payload
+        }))
+
+    async def kit_resolution_invalidate(self, event):
+        """
+        Called when the peripheral devices, peripheral device definitions or
+        quantity types of the kit have changed.
+
+        :param event: The invalidation channel event.
+        """
+        self.resolver.invalidate()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        :param text_data: The received data. See `KitConsumer.receive`.
+        :param bytes_data: The received data of a binary frame, see `backend.wire`.
+        """
+        if bytes_data is not None:
+            await self.receive_binary(bytes_data)
+            return
+
+        content = json.loads(text_data)
+
+        stream = content['stream']
+        nonce = content['nonce']
+        payload = content['payload'] if 'payload' in content else {}
+
+        send_reply = lambda msg: self.send(json.dumps({
+            'stream': stream,
+            'reply-nonce': nonce,
+            'payload': msg
+        }))
+
+        if stream == "publish-measurement":
+            await self.publish_measurement(payload, send_reply)
+        elif stream == "publish-measurements":
+            await self.publish_measurements(payload, send_reply)
+        elif stream == "config":
+            await self.send_config(send_reply)
+
+    async def send_config(self, send_reply):
+        """
+        Reply with the configuration of the kit. See
+        `KitConsumer.send_config`.
+        """
+        payload = await database_sync_to_async(kit_config_payload)(self.kit)
+        if payload is None:
+            await send_reply({"error": "The kit no longer exists."})
+            await self.close()
+            return
+
+        self.config_hash = payload['hash']
+        await send_reply(payload)
+
+    async def ensure_resolver_loaded(self, contents):
+        """
+        Load the measurement resolver's cache in the database thread pool, if
+        it is required to resolve the given measurement messages.
+        """
+        peripheral_names = backend.ingest.peripheral_names(contents)
+        if self.resolver.needs_load(peripheral_names):
+            await database_sync_to_async(self.resolver.load)(peripheral_names)
+
+    async def broadcast_measurement(self, measurement_type, measurement):
+        """
+        Send a measurement to all channels listening on the
+        `kit-measurements-%s` group.
+        """
+        await self.channel_layer.group_send(
+            "kit-measurements-%s" % self.kit.username,
+            backend.ingest.measurement_event(measurement_type, measurement)
+        )
+
+    async def publish_measurement(self, content, send_reply):
+        """
+        Publish a measurement. See `KitConsumer.publish_measurement`.
+        """
+        try:
+            await self.ensure_resolver_loaded([content])
+            (measurement_type, measurement) = backend.ingest.deserialize_measurement(self.resolver, content)
+
+            # Store reduced measurements, and update the latest measurements;
+            # adding to the buffer may block
+            (future, [duplicate]) = await database_sync_to_async(backend.ingest.store_measurements)([(measurement_type, measurement)])
+
+            if not duplicate:
+                await self.broadcast_measurement(measurement_type, measurement)
+            await send_reply({"success": "published", "duplicates": int(duplicate)})
         except Exception as exception:
-            send_reply({"error": "You must provide a valid measurement.'."})
+            await send_reply({"error": "You must provide a valid measurement.'."})
             print("Websocket: exception on publishing measurement")
             print(exception)
+
+    async def publish_measurements(self, content, send_reply):
+        """
+        Publish a batch of measurements. See `KitConsumer.publish_measurements`.
+        """
+        try:
+            contents = content['measurements']
+            if not isinstance(contents, list):
+                raise ValueError("'measurements' must be a list")
+        except Exception as exception:
+            await send_reply({"error": "You must provide a list of measurements."})
+            print("Websocket: exception on publishing measurements")
+            print(exception)
+            return
+
+        await self.ensure_resolver_loaded(contents)
+        (published, results) = backend.ingest.deserialize_measurements(self.resolver, contents)
+
+        try:
+            (future, duplicates) = await database_sync_to_async(backend.ingest.store_measurements)(published)
+        except Exception as exception:
+            await send_reply({"error": "The measurements could not be stored."})
+            print("Websocket: exception on storing measurements")
+            print(exception)
+            return
+
+        for ((measurement_type, measurement), duplicate) in zip(published, duplicates):
+            if not duplicate:
+                await self.broadcast_measurement(measurement_type, measurement)
+
+        await send_reply({"results": results, "duplicates": sum(duplicates)})
+
+    async def receive_binary(self, data):
+        """
+        Handle a binary frame. See `KitConsumer.receive_binary`.
+        """
+        try:
+            (opcode, nonce, count) = backend.wire.decode_header(data)
+        except backend.wire.FrameError as exception:
+            print("Websocket: malformed binary frame")
+            print(exception)
+            return
+
+        try:
+            (nonce, records) = backend.wire.decode_measurements(data, opcode=backend.wire.PUBLISH)
+
+            peripheral_ids = set(record[1] for record in records)
+            if self.resolver.needs_load(peripheral_ids = peripheral_ids):
+                await database_sync_to_async(self.resolver.load)(peripheral_ids = peripheral_ids)
+
+            (published, statuses) = backend.ingest.deserialize_records(self.resolver, records)
+            (future, duplicates) = await database_sync_to_async(backend.ingest.store_measurements)(published)
+        except Exception as exception:
+            await self.send(bytes_data=backend.wire.encode_publish_reply(nonce, [backend.wire.STATUS_ERROR] * count))
+            print("Websocket: exception on publishing binary frame")
+            print(exception)
+            return
+
+        backend.ingest.mark_duplicate_records(statuses, duplicates)
+        for ((measurement_type, measurement), duplicate) in zip(published, duplicates):
+            if not duplicate:
+                await self.broadcast_measurement(measurement_type, measurement)
+
+        await self.send(bytes_data=backend.wire.encode_publish_reply(nonce, statuses))
+
+
+def create_conflator():
+    """
+    Create the conflator of REAL_TIME measurements of a subscriber, or None if
+    conflation is disabled.
+    """
+    interval = backend.conflation.get_interval()
+    if interval is None:
+        return None
+    return backend.conflation.Conflator(interval)
+
+
+def wants_binary(scope):
+    """
+    Test whether a subscriber opted in to receive binary frames, by passing
+    `format=binary` in the query string.
+    """
+    query_string = scope.get('query_string', b'')
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('utf-8')
+    return urllib.parse.parse_qs(query_string).get('format') == ['binary']
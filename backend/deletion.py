@@ -0,0 +1,198 @@
+"""
+Module defining the background removal of kits and their measurements.
+
+Removing a kit's measurement history can take long and would hold locks on
+large parts of the measurement table if done in a single statement. Instead,
+removals are recorded as a `backend.models.KitDeletionJob`, and run by a
+process-wide background thread, in chunks of at most `CHUNK_SIZE` rows (see
+`backend.retention`), each in its own short transaction, with a pause of
+`CHUNK_DELAY` milliseconds in between. Chunks are removed with a single
+`DELETE` statement, without loading the rows or sending signals.
+
+A kit to be removed is marked as deleted right away: it is hidden (see
+`backend.models.KitManager`) and can no longer authenticate. It is removed
+from the database once its measurements have been removed.
+
+Jobs interrupted by a restart of the process are resumed by the next job
+scheduled, or by the `run_deletion_jobs` management command.
+
+Note that when serving through uWSGI, Python threads have to be enabled
+(`enable-threads`) for the background thread to run.
+"""
+
+import threading
+import time
+
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+import backend.latest
+import backend.models
+import backend.retention
+
+
+def schedule_measurement_removal(kit):
+    """
+    Schedule the removal of all measurements (and rollups) of a kit stored up
+    to now.
+
+    :return: The `backend.models.KitDeletionJob`.
+    """
+    job = backend.models.KitDeletionJob.objects.create(
+        kit = kit,
+        kit_name = kit.name,
+        action = backend.models.KitDeletionJob.REMOVE_MEASUREMENTS,
+        max_measurement_id = kit.measurements.aggregate(last = Max('pk'))['last'],
+    )
+    start()
+    return job
+
+
+def schedule_kit_removal(kit):
+    """
+    Mark a kit as deleted, and schedule its removal.
+
+    :return: The `backend.models.KitDeletionJob`.
+    """
+    with transaction.atomic():
+        kit.deleted = True
+        kit.is_active = False
+        kit.save(update_fields = ['deleted', 'is_active'])
+
+        job = backend.models.KitDeletionJob.objects.create(
+            kit = kit,
+            kit_name = kit.name,
+            action = backend.models.KitDeletionJob.REMOVE_KIT,
+        )
+    start()
+    return job
+
+
+_thread = None
+_thread_lock = threading.Lock()
+_pending = threading.Event()
+
+
+def start():
+    """
+    Run the pending jobs in the process-wide background thread, starting it
+    on first use.
+    """
+    global _thread
+
+    with _thread_lock:
+        _pending.set()
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run_forever, name='kit-deletion', daemon=True)
+            _thread.start()
+
+
+def _run_forever():
+    while True:
+        _pending.wait()
+        _pending.clear()
+
+        # The background thread holds its own database connection; make
+        # sure it is usable
+        close_old_connections()
+        try:
+            run_pending()
+        except Exception as e:
+            print("Error running kit deletion jobs: %s" % e)
+
+
+def run_pending():
+    """
+    Run all pending (or interrupted) jobs in the calling thread, oldest first.
+
+    :return: The number of jobs run.
+    """
+    count = 0
+    while True:
+        job = backend.models.KitDeletionJob.objects.filter(
+            state__in = (backend.models.KitDeletionJob.PENDING, backend.models.KitDeletionJob.RUNNING),
+        ).order_by('created', 'pk').first()
+        if job is None:
+            return count
+
+        run(job)
+        count += 1
+
+
+def run(job):
+    """
+    Run a job in the calling thread.
+    """
+    configuration = backend.retention.get_configuration()
+    chunk_size = configuration['CHUNK_SIZE']
+    chunk_delay = configuration['CHUNK_DELAY'] / 1000.0
+
+    job.state = backend.models.KitDeletionJob.RUNNING
+    job.save()
+
+    try:
+        if job.kit_id is not None:
+            measurements = backend.models.Measurement.objects.filter(kit_id = job.kit_id)
+            if job.action == backend.models.KitDeletionJob.REMOVE_MEASUREMENTS:
+                measurements = measurements.filter(pk__lte = job.max_measurement_id or 0)
+
+            blocks = backend.models.MeasurementArchiveBlock.objects.filter(kit_id = job.kit_id)
+            if job.measurements_total is None:
+                job.measurements_total = measurements.count() + sum(blocks.values_list('count', flat=True))
+                job.save()
+
+            def on_chunk(removed):
+                job.measurements_deleted += removed
+                job.save(update_fields = ['measurements_deleted'])
+
+            delete_in_chunks(measurements, chunk_size, chunk_delay, on_chunk)
+
+            # Archived measurements are removed a block at a time
+            for block in blocks:
+                block.delete()
+                on_chunk(block.count)
+
+            delete_in_chunks(backend.models.MeasurementRollup.objects.filter(kit_id = job.kit_id), chunk_size, chunk_delay)
+            backend.latest.forget(job.kit_id)
+
+            if job.action == backend.models.KitDeletionJob.REMOVE_KIT:
+                # Removes what is left (peripheral devices, and measurements
+                # stored while the job was running)
+                backend.models.Kit.objects.get(pk = job.kit_id).delete()
+                job.kit = None
+
+        job.state = backend.models.KitDeletionJob.FINISHED
+    except Exception as e:
+        print("Error running kit deletion job %s: %s" % (job.pk, e))
+        job.state = backend.models.KitDeletionJob.FAILED
+    finally:
+        job.finished = timezone.now()
+        job.save()
+
+
+def delete_in_chunks(queryset, chunk_size, chunk_delay, on_chunk = None):
+    """
+    Remove the rows of a queryset in chunks, each with a single `DELETE`
+    statement in its own transaction. Cascades and signals are skipped, so
+    the rows must not be referenced by other rows.
+
+    :param on_chunk: Function called after each chunk with the number of rows
+    removed in the chunk.
+    :return: The number of rows removed.
+    """
+    removed = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return removed
+
+        with transaction.atomic():
+            chunk_removed = queryset.model.objects.filter(pk__in = pks)._raw_delete(queryset.db)
+        removed += chunk_removed
+
+        if on_chunk is not None:
+            on_chunk(chunk_removed)
+
+        if chunk_delay and len(pks) == chunk_size:
+            time.sleep(chunk_delay)
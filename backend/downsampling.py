@@ -0,0 +1,122 @@
+"""
+Module defining the downsampling of measurement series for charts.
+
+Series are downsampled to a budget of points by selecting measurements, such
+that the selected measurements are real measurements of the series:
+
+- `lttb` (largest-triangle-three-buckets) selects, per bucket of consecutive
+  measurements, the measurement forming the largest triangle with the
+  measurement selected in the previous bucket and the average of the next
+  bucket. It preserves the visual shape of the series.
+- `min_max` selects the minimum and maximum measurement per bucket of time
+  (e.g. per pixel column of a chart). It preserves all peaks.
+
+The computations are vectorized with NumPy; LTTB only loops over the buckets.
+"""
+
+import numpy
+
+
+def lttb(times, values, points):
+    """
+    Select points by largest-triangle-three-buckets.
+
+    :param times: An array of the times of the series, ascending.
+    :param values: An array of the values of the series.
+    :param points: The number of points to select.
+    :return: An array of the indices of the selected points, ascending.
+    """
+    count = len(values)
+    if points >= count:
+        return numpy.arange(count)
+    if points < 3:
+        return numpy.array([0, count - 1][:max(points, 0)], dtype=int)
+
+    # The first and last point are always selected; the points in between
+    # are divided over `points - 2` buckets
+    edges = numpy.linspace(1, count - 1, points - 1).astype(int)
+
+    # The averages of all buckets at once
+    cumulative_times = numpy.concatenate(([0.0], numpy.cumsum(times)))
+    cumulative_values = numpy.concatenate(([0.0], numpy.cumsum(values)))
+    sizes = edges[1:] - edges[:-1]
+    average_times = (cumulative_times[edges[1:]] - cumulative_times[edges[:-1]]) / sizes
+    average_values = (cumulative_values[edges[1:]] - cumulative_values[edges[:-1]]) / sizes
+
+    # The last bucket is followed by the last point
+    average_times = numpy.append(average_times[1:], times[count - 1])
+    average_values = numpy.append(average_values[1:], values[count - 1])
+
+    selected = numpy.empty(points, dtype=int)
+    selected[0] = 0
+    selected[-1] = count - 1
+
+    previous = 0
+    for bucket in range(points - 2):
+        (start, end) = (edges[bucket], edges[bucket + 1])
+        areas = numpy.abs(
+            (times[previous] - average_times[bucket]) * (values[start:end] - values[previous])
+            - (times[previous] - times[start:end]) * (average_values[bucket] - values[previous])
+        )
+        previous = start + int(numpy.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def min_max(times, values, points):
+    """
+    Select the minimum and maximum point of buckets of equal time.
+
+    :param times: An array of the times of the series, ascending.
+    :param values: An array of the values of the series.
+    :param points: The maximum number of points to select; the time range
+    is divided into `points // 2` buckets.
+    :return: An array of the indices of the selected points, ascending.
+    """
+    count = len(values)
+    buckets = points // 2
+    if points >= count:
+        return numpy.arange(count)
+    if buckets < 1:
+        return numpy.arange(0)
+
+    span = times[-1] - times[0]
+    if span <= 0:
+        bucket_of = numpy.zeros(count, dtype=int)
+    else:
+        bucket_of = numpy.minimum(((times - times[0]) / span * buckets).astype(int), buckets - 1)
+
+    # Sort by bucket, then by value: the first point of each bucket is its
+    # minimum, and the last its maximum
+    order = numpy.lexsort((values, bucket_of))
+    sorted_buckets = bucket_of[order]
+    firsts = numpy.flatnonzero(numpy.diff(sorted_buckets, prepend=-1))
+    lasts = numpy.append(firsts[1:] - 1, count - 1)
+
+    return numpy.unique(numpy.concatenate((order[firsts], order[lasts])))
+
+
+#: The downsampling methods by name
+METHODS = {
+    'lttb': lttb,
+    'min_max': min_max,
+}
+
+
+def downsample(measurements, points, method = 'lttb'):
+    """
+    Downsample a series of measurements.
+
+    :param measurements: A list of measurements, ordered by time.
+    :param points: The budget of points.
+    :param method: The name of the downsampling method (see `METHODS`).
+    :return: A list of the selected measurements, ordered by time.
+    """
+    if len(measurements) <= points:
+        return measurements
+
+    times = numpy.array([measurement.date_time.timestamp() for measurement in measurements], dtype=numpy.float64)
+    values = numpy.array([measurement.value for measurement in measurements], dtype=numpy.float64)
+
+    return [measurements[index] for index in METHODS[method](times, values, points)]
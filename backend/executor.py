@@ -0,0 +1,59 @@
+"""
+Module defining the bounded thread pool asynchronous consumers use to access
+the database.
+
+Asynchronous consumers cost only a coroutine while they are idle. Work that
+touches the ORM is blocking, and is run in a thread pool of a fixed size
+(configured by the `DATABASE_EXECUTOR_THREADS` setting), such that the number
+of threads (and database connections) does not grow with the number of
+connections.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from django.conf import settings
+from channels.db import DatabaseSyncToAsync
+
+#: The default number of threads in the pool
+DEFAULT_DATABASE_EXECUTOR_THREADS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the thread pool used to access the database, creating it on first use.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = getattr(settings, 'DATABASE_EXECUTOR_THREADS', DEFAULT_DATABASE_EXECUTOR_THREADS),
+                thread_name_prefix = 'database',
+            )
+
+    return _executor
+
+
+class BoundedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    `channels.db.DatabaseSyncToAsync` version that runs in the bounded database
+    thread pool, instead of in the event loop's default executor.
+    """
+
+    async def __call__(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(
+            get_executor(),
+            functools.partial(self.thread_handler, loop, *args, **kwargs),
+        )
+        return await future
+
+
+# The class is TitleCased, but we want to encourage use as a callable/decorator
+database_sync_to_async = BoundedDatabaseSyncToAsync
@@ -0,0 +1,479 @@
+"""
+Module defining helpers to ingest measurements published by kits.
+"""
+
+import json
+import math
+
+from django.db.models import Prefetch
+from rest_framework import exceptions
+
+import backend.buffer
+import backend.latest
+import backend.models
+import backend.rollups
+import backend.serializers
+import backend.wire
+
+
+class MeasurementResolver(object):
+    """
+    Resolves the peripheral device names and physical quantities and units
+    of a kit's measurements to peripheral device and quantity type ids, and
+    vice versa.
+
+    The peripheral devices and quantity types of the kit are loaded once and
+    cached, such that resolving measurements does not cost any queries. The
+    cache has to be invalidated (see `invalidate`) when the peripheral devices,
+    peripheral device definitions or quantity types of the kit change.
+    """
+
+    def __init__(self, kit):
+        self.kit = kit
+        self._peripherals = None
+        self._peripheral_ids = None
+
+    def invalidate(self):
+        """
+        Invalidate the cache. It will be reloaded on the next resolution.
+        """
+        self._peripherals = None
+        self._peripheral_ids = None
+
+    def needs_load(self, peripheral_names = (), peripheral_ids = ()):
+        """
+        Test whether the cache has to be (re)loaded to resolve measurements of
+        the given peripheral devices.
+
+        :param peripheral_names: An iterable of peripheral device names.
+        :param peripheral_ids: An iterable of peripheral device ids.
+        """
+        return (
+            self._peripherals is None
+            or any(name not in self._peripherals for name in peripheral_names)
+            or any(peripheral_id not in self._peripheral_ids for peripheral_id in peripheral_ids)
+        )
+
+    def load(self, peripheral_names = (), peripheral_ids = ()):
+        """
+        (Re)load the cache.
+
+        :param peripheral_names: An iterable of peripheral device names that
+        are to be resolved. Names that cannot be resolved are cached as such,
+        until the cache is invalidated.
+        :param peripheral_ids: An iterable of peripheral device ids that are
+        to be resolved, cached like the names.
+        """
+        (peripherals, peripheral_ids_) = self._load()
+        for name in peripheral_names:
+            peripherals.setdefault(name, None)
+        for peripheral_id in peripheral_ids:
+            peripheral_ids_.setdefault(peripheral_id, None)
+        (self._peripherals, self._peripheral_ids) = (peripherals, peripheral_ids_)
+
+    def _load(self):
+        """
+        Load the peripheral devices and quantity types of the kit.
+
+        :return: A tuple of two dictionaries. The first maps peripheral device
+        names to tuples of peripheral device ids and dictionaries of (physical
+        quantity, physical unit) pairs to quantity type ids. Peripheral device
+        names that are not unique within the kit map to None, as they cannot
+        be resolved. The second maps peripheral device ids to dictionaries of
+        quantity type ids to (physical quantity, physical unit) pairs.
+        """
+        peripherals = {}
+        peripheral_ids = {}
+
+        peripherals_qs = self.kit.peripherals.select_related('peripheral_definition').prefetch_related(
+            Prefetch('peripheral_definition__quantity_types',
+                     queryset = backend.models.QuantityType.objects.order_by('pk'))
+        )
+
+        for peripheral in peripherals_qs:
+            quantity_types = {}
+            for quantity_type in peripheral.peripheral_definition.quantity_types.all():
+                quantity_types.setdefault((quantity_type.physical_quantity, quantity_type.physical_unit), quantity_type.pk)
+
+            peripheral_ids[peripheral.pk] = {pk: quantity for (quantity, pk) in quantity_types.items()}
+
+            if peripheral.name in peripherals:
+                peripherals[peripheral.name] = None
+            else:
+                peripherals[peripheral.name] = (peripheral.pk, quantity_types)
+
+        return (peripherals, peripheral_ids)
+
+    def resolve(self, peripheral_name, physical_quantity, physical_unit):
+        """
+        Resolve a measurement.
+
+        :param peripheral_name: The name of the peripheral device of the kit.
+        :param physical_quantity: The physical quantity measured.
+        :param physical_unit: The physical unit of the measurement.
+
+        :return: A tuple of the peripheral device id and the id of the quantity
+        type. The quantity type id is None if the physical quantity and unit
+        are not registered for the peripheral device's definition.
+
+        :raises backend.models.Peripheral.DoesNotExist: If the kit has no
+        (unique) peripheral device with the given name.
+        """
+        if self.needs_load(peripheral_names = [peripheral_name]):
+            # The peripheral device might have been added since the cache was
+            # loaded
+            self.load(peripheral_names = [peripheral_name])
+
+        resolved = self._peripherals.get(peripheral_name)
+        if resolved is None:
+            raise backend.models.Peripheral.DoesNotExist("Kit %s has no unique peripheral device named %s" % (self.kit, peripheral_name))
+
+        (peripheral_id, quantity_types) = resolved
+        return (peripheral_id, quantity_types.get((physical_quantity, physical_unit)))
+
+    def resolve_ids(self, peripheral_id, quantity_type_id):
+        """
+        Resolve a measurement by ids.
+
+        :param peripheral_id: The id of the peripheral device of the kit.
+        :param quantity_type_id: The id of the quantity type.
+
+        :return: A tuple of the physical quantity and physical unit.
+
+        :raises backend.models.Peripheral.DoesNotExist: If the kit has no
+        peripheral device with the given id.
+        :raises backend.models.QuantityType.DoesNotExist: If the quantity type
+        is not registered for the peripheral device's definition.
+        """
+        if self.needs_load(peripheral_ids = [peripheral_id]):
+            self.load(peripheral_ids = [peripheral_id])
+
+        quantity_types = self._peripheral_ids.get(peripheral_id)
+        if quantity_types is None:
+            raise backend.models.Peripheral.DoesNotExist("Kit %s has no peripheral device with id %s" % (self.kit, peripheral_id))
+
+        if quantity_type_id not in quantity_types:
+            raise backend.models.QuantityType.DoesNotExist("Quantity type %s is not registered for peripheral device %s" % (quantity_type_id, peripheral_id))
+
+        return quantity_types[quantity_type_id]
+
+    def create_measurement(self, validated_data, peripheral_name):
+        """
+        Create a measurement of the kit from validated measurement data.
+        Resolves the peripheral device by its name and, if it is registered
+        for the peripheral device's definition, the quantity type by its
+        physical quantity and unit.
+
+        :param validated_data: The validated data of a `MeasurementSerializer`.
+        :param peripheral_name: The name of the peripheral device that made
+        the measurement.
+        :return: The (unsaved) measurement.
+        """
+        measurement = backend.models.Measurement(**validated_data)
+
+        # Add the kit to the measurement
+        measurement.kit = self.kit
+
+        # Get the peripheral device and the registered quantity type (if it exists)
+        # by the peripheral device name and the physical quantity and physical unit
+        (peripheral_id, quantity_type_id) = self.resolve(peripheral_name, measurement.physical_quantity, measurement.physical_unit)
+
+        measurement.peripheral_id = peripheral_id
+        measurement.quantity_type_id = quantity_type_id
+
+        return measurement
+
+
+def deserialize_record(resolver, record):
+    """
+    Deserialize a measurement record of a binary frame (see `backend.wire`).
+
+    :param resolver: The `MeasurementResolver` of the publishing kit.
+    :param record: A decoded measurement record.
+    :return: A tuple of the measurement type and the (unsaved) measurement.
+    :raises ValueError: If the record is invalid.
+    """
+    (measurement_type, peripheral_id, quantity_type_id, seconds, value) = record
+
+    if measurement_type is None:
+        raise ValueError("Unknown measurement type")
+    if quantity_type_id is None:
+        # Without it, the measurement would have no quantity at all
+        raise ValueError("The quantity type is required")
+    if not math.isfinite(seconds) or not math.isfinite(value):
+        raise ValueError("The time and value must be finite")
+
+    (physical_quantity, physical_unit) = resolver.resolve_ids(peripheral_id, quantity_type_id)
+
+    measurement = backend.models.Measurement(
+        kit = resolver.kit,
+        peripheral_id = peripheral_id,
+        quantity_type_id = quantity_type_id,
+        date_time = backend.wire.from_timestamp(seconds),
+        value = value,
+        physical_quantity = physical_quantity,
+        physical_unit = physical_unit,
+    )
+
+    return (measurement_type, measurement)
+
+
+def deserialize_records(resolver, records):
+    """
+    Deserialize the measurement records of a binary frame (see `backend.wire`).
+
+    :param resolver: The `MeasurementResolver` of the publishing kit.
+    :param records: A list of decoded measurement records.
+    :return: A tuple of a list of tuples of measurement types and (unsaved)
+    measurements that are valid, and a list of per-record statuses in the
+    same order as the records.
+    """
+    statuses = []
+    published = []
+    for record in records:
+        try:
+            published.append(deserialize_record(resolver, record))
+            statuses.append(backend.wire.STATUS_PUBLISHED)
+        except Exception as exception:
+            statuses.append(backend.wire.STATUS_ERROR)
+            print("Websocket: exception on publishing measurement")
+            print(exception)
+
+    return (published, statuses)
+
+
+def mark_duplicate_records(statuses, duplicates):
+    """
+    Set the status of records dropped as duplicates.
+
+    :param statuses: The per-record statuses, as returned by
+    `deserialize_records`.
+    :param duplicates: The duplicate flags of the published measurements, as
+    returned by `store_measurements`.
+    """
+    published = (index for (index, status) in enumerate(statuses) if status == backend.wire.STATUS_PUBLISHED)
+    for (index, duplicate) in zip(list(published), duplicates):
+        if duplicate:
+            statuses[index] = backend.wire.STATUS_DUPLICATE
+
+
+def deserialize_measurement(resolver, content):
+    """
+    Deserialize a published measurement message.
+
+    :param resolver: The `MeasurementResolver` of the publishing kit.
+    :param content: The measurement message, with keys 'measurement_type'
+    and 'measurement'.
+    :return: A tuple of the measurement type and the (unsaved) measurement.
+    """
+    # Fetch measurement message type
+    measurement_type = content['measurement_type']
+
+    # Deserialize measurement
+    measurement_serializer = backend.serializers.MeasurementSerializer(data=content['measurement'])
+    measurement_serializer.is_valid(raise_exception = True)
+
+    measurement = resolver.create_measurement(measurement_serializer.validated_data, content['measurement']['peripheral'])
+
+    return (measurement_type, measurement)
+
+
+def deserialize_measurements(resolver, contents):
+    """
+    Deserialize a list of published measurement messages. The measurements
+    are validated together, using a single serializer.
+
+    :param resolver: The `MeasurementResolver` of the publishing kit.
+    :param contents: A list of measurement messages, each with keys
+    'measurement_type' and 'measurement'.
+    :return: A tuple of a list of tuples of measurement types and (unsaved)
+    measurements that are valid, and a list of per-message results in the
+    same order as the messages.
+    """
+    measurement_serializer = backend.serializers.MeasurementSerializer()
+
+    results = []
+    published = []
+    for content in contents:
+        try:
+            measurement_type = content['measurement_type']
+            validated_data = measurement_serializer.run_validation(content['measurement'])
+            measurement = resolver.create_measurement(validated_data, content['measurement']['peripheral'])
+
+            published.append((measurement_type, measurement))
+            results.append({"success": "published"})
+        except Exception as exception:
+            results.append({"error": "You must provide a valid measurement."})
+            print("Websocket: exception on publishing measurement")
+            print(exception)
+
+    return (published, results)
+
+
+def peripheral_names(contents):
+    """
+    Get the names of the peripheral devices of published measurement messages.
+    Malformed messages are skipped.
+    """
+    names = set()
+    for content in contents:
+        try:
+            names.add(content['measurement']['peripheral'])
+        except (KeyError, TypeError):
+            pass
+    return names
+
+
+def store_measurements(published):
+    """
+    Store all measurements of type REDUCED, by adding them to the measurement
+    buffer. Blocks while the buffer is at its cap. The latest measurements
+    (see `backend.latest`) are updated with all published measurements that
+    are not duplicates.
+
+    :param published: A list of tuples of measurement types and measurements.
+    :return: A tuple of a `concurrent.futures.Future` that is resolved once
+    the measurements have been written, and a list of booleans indicating for
+    each published measurement whether it was dropped as a duplicate.
+    """
+    (future, duplicates) = backend.buffer.get_measurement_buffer().add(
+        [measurement for (measurement_type, measurement) in published if measurement_type == "REDUCED"]
+    )
+    duplicates = set(id(measurement) for measurement in duplicates)
+    duplicate_flags = [id(measurement) in duplicates for (measurement_type, measurement) in published]
+
+    try:
+        backend.latest.update(
+            published_measurement for (published_measurement, duplicate) in zip(published, duplicate_flags) if not duplicate
+        )
+    except Exception as exception:
+        print("Exception on updating latest measurements: %s" % exception)
+
+    return (future, duplicate_flags)
+
+
+def measurement_message(measurement_type, measurement):
+    """
+    Create the message sent to channels subscribed to the measurements of a kit.
+    """
+    output_serializer = backend.serializers.MeasurementOutputSerializer(measurement)
+    return {'measurement_type': measurement_type, 'measurement': output_serializer.data}
+
+
+def measurement_event(measurement_type, measurement):
+    """
+    Create the channel event sent to the group of channels subscribed to the
+    measurements of a kit. The message is encoded once, as a JSON text frame
+    (`text`) and as a binary frame (`bytes`, see `backend.wire`), such that
+    subscribers forward the frame of their choice unchanged, instead of each
+    encoding the message themselves. The measurement type and series
+    (peripheral device and quantity type ids) are included for conflation
+    (see `backend.conflation`).
+    """
+    return {
+        'type': 'measurement',
+        'measurement_type': measurement_type,
+        'series': [measurement.peripheral_id, measurement.quantity_type_id],
+        'text': json.dumps(measurement_message(measurement_type, measurement)),
+        'bytes': backend.wire.encode_measurements([backend.wire.measurement_record(measurement_type, measurement)]),
+    }
+
+
+def parse_ndjson(stream):
+    """
+    Parse a stream of newline-delimited JSON documents. Blank lines are
+    skipped.
+
+    :param stream: A binary file-like object, iterable by lines.
+    :return: A generator of parsed documents. Lines that are not valid JSON
+    yield a `ValueError` instead.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            yield json.loads(line.decode('utf-8'))
+        except ValueError as exception:
+            yield exception
+
+
+def deserialize_rows(resolver, rows):
+    """
+    Deserialize measurement rows uploaded in bulk. Each row is formatted as the
+    'measurement' of a published measurement message, i.e., holds the keys
+    'peripheral' (the peripheral device name), 'physical_quantity',
+    'physical_unit', 'value' and 'date_time'. The rows are validated using a
+    single serializer.
+
+    :param resolver: The `MeasurementResolver` of the uploading kit.
+    :param rows: An iterable of rows. Rows may be exceptions, which are
+    reported as errors.
+    :return: A generator of tuples of row indices and either the (unsaved)
+    measurement, or a dictionary describing the error.
+    """
+    measurement_serializer = backend.serializers.MeasurementSerializer()
+
+    for (index, row) in enumerate(rows):
+        try:
+            if isinstance(row, Exception):
+                raise exceptions.ParseError(str(row))
+            if not isinstance(row, dict):
+                raise exceptions.ParseError("Expected an object.")
+
+            validated_data = measurement_serializer.run_validation(row)
+            yield (index, resolver.create_measurement(validated_data, row.get('peripheral')))
+        except exceptions.ValidationError as exception:
+            yield (index, exception.detail)
+        except exceptions.ParseError as exception:
+            yield (index, {'non_field_errors': [exception.detail]})
+        except (backend.models.Peripheral.DoesNotExist, TypeError):
+            yield (index, {'peripheral': ["Unknown peripheral device."]})
+
+
+def bulk_store_rows(resolver, rows, chunk_size = 1000, max_errors = 100):
+    """
+    Deserialize and store measurement rows uploaded in bulk (see
+    `deserialize_rows`). Valid rows are inserted in chunks, each in its own
+    transaction, such that the rows need not be held in memory at once.
+    The measurements are written directly, bypassing the measurement buffer.
+
+    :param resolver: The `MeasurementResolver` of the uploading kit.
+    :param rows: An iterable of rows.
+    :param chunk_size: The number of rows to insert at once.
+    :param max_errors: The maximum number of errors to report.
+    :return: A dictionary holding the number of rows created, the number of
+    rows skipped as duplicates of stored measurements, the number of rows
+    rejected, and a list of (at most `max_errors`) errors.
+    """
+    created = 0
+    duplicates = 0
+    rejected = 0
+    errors = []
+
+    def insert(chunk):
+        inserted = backend.rollups.insert_measurements(chunk)
+        backend.latest.update(("REDUCED", measurement) for measurement in chunk)
+        return inserted
+
+    chunk = []
+    for (index, result) in deserialize_rows(resolver, rows):
+        if isinstance(result, backend.models.Measurement):
+            chunk.append(result)
+            if len(chunk) >= chunk_size:
+                inserted = insert(chunk)
+                created += inserted
+                duplicates += len(chunk) - inserted
+                chunk = []
+        else:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append({'index': index, 'errors': result})
+
+    if chunk:
+        inserted = insert(chunk)
+        created += inserted
+        duplicates += len(chunk) - inserted
+
+    return {'created': created, 'duplicates': duplicates, 'rejected': rejected, 'errors': errors}
@@ -0,0 +1,108 @@
+"""
+Module defining the maintenance and querying of the latest measurements.
+
+The latest measurement of each peripheral device's quantity type of a kit
+is kept in `backend.models.LatestMeasurement`, such that current readings of
+one or many kits are fetched with a single indexed query (see `get`), rather
+than by ordering the measurement history of each series.
+
+The table is upserted with every published (REAL_TIME or REDUCED) and every
+stored measurement through `update`. A process-wide cache of the date-time of
+the latest measurement of each series seen by the process skips upserts of
+measurements that are not newer, such as the REDUCED measurements of a
+series that also publishes REAL_TIME measurements.
+
+Measurements without a quantity type are not kept.
+"""
+
+import collections
+import threading
+
+import backend.models
+
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+def update(published):
+    """
+    Store the latest of published measurements per series, if they are newer
+    than the stored latest measurements.
+
+    :param published: An iterable of tuples of measurement types and
+    measurements.
+    """
+    newest = {}
+    for (measurement_type, measurement) in published:
+        if measurement.quantity_type_id is None:
+            continue
+
+        key = (measurement.kit_id, measurement.peripheral_id, measurement.quantity_type_id)
+        if key not in newest or measurement.date_time >= newest[key][1].date_time:
+            newest[key] = (measurement_type, measurement)
+
+    with _latest_lock:
+        newer = {
+            key: (measurement_type, measurement)
+            for (key, (measurement_type, measurement)) in newest.items()
+            if key not in _latest or measurement.date_time > _latest[key]
+        }
+
+    backend.models.LatestMeasurement.objects.bulk_upsert([
+        backend.models.LatestMeasurement(
+            kit_id = measurement.kit_id,
+            peripheral_id = measurement.peripheral_id,
+            quantity_type_id = measurement.quantity_type_id,
+            measurement_type = measurement_type,
+            date_time = measurement.date_time,
+            value = measurement.value,
+        )
+        for (measurement_type, measurement) in newer.values()
+    ])
+
+    with _latest_lock:
+        for (key, (measurement_type, measurement)) in newer.items():
+            if key not in _latest or measurement.date_time > _latest[key]:
+                _latest[key] = measurement.date_time
+
+
+def forget(kit):
+    """
+    Forget the latest measurements of a kit, e.g. after its measurements have
+    been removed. Only the cache of this process is cleared.
+
+    :param kit: The kit (or kit id).
+    """
+    kit_id = getattr(kit, 'pk', kit)
+
+    backend.models.LatestMeasurement.objects.filter(kit_id = kit_id).delete()
+    with _latest_lock:
+        for key in [key for key in _latest if key[0] == kit_id]:
+            del _latest[key]
+
+
+def get(kits):
+    """
+    Get the latest measurements of kits.
+
+    :param kits: A kit, or an iterable or queryset of kits.
+    :return: A queryset of `backend.models.LatestMeasurement`.
+    """
+    latest = backend.models.LatestMeasurement.objects.select_related('peripheral', 'quantity_type')
+    if isinstance(kits, backend.models.Kit):
+        return latest.filter(kit = kits)
+    return latest.filter(kit__in = kits)
+
+
+def by_series(kit):
+    """
+    Get the latest measurements of a kit.
+
+    :return: A dictionary of peripheral devices to dictionaries of quantity
+    types to latest measurements, like `backend.models.Kit.recent_measurements`.
+    Series without a latest measurement map to None.
+    """
+    latest = collections.defaultdict(lambda: collections.defaultdict(lambda: None))
+    for latest_measurement in get(kit):
+        latest[latest_measurement.peripheral][latest_measurement.quantity_type] = latest_measurement
+    return latest
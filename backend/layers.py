@@ -0,0 +1,350 @@
+"""
+Module defining a channel layer for multiple processes on a single machine,
+without an external broker.
+
+Each process binds a Unix domain datagram socket in a shared directory, and
+names its channels after it, such that a message for a channel is sent
+directly to the socket of the process owning the channel. Group membership is
+stored in the shared directory as well, as one empty file per member channel
+in a directory per group, such that any process can send to a group.
+
+Configure it in `CHANNEL_LAYERS`, e.g.:
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'backend.layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'directory': '/run/astroplant/channels',
+            },
+        },
+    }
+
+All processes using the layer must be able to read and write the directory.
+Preferably, it is on a memory-backed file system (such as `/run` or
+`/dev/shm`).
+
+Only process-specific channels (those containing `!`, as created by
+`new_channel`) are delivered across processes; messages on other channels are
+only received within the sending process. Messages are encoded with
+`marshal`, so may only hold the basic types supported by it.
+"""
+
+import asyncio
+import atexit
+import errno
+import marshal
+import os
+import random
+import socket
+import string
+import tempfile
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+#: The maximum size of an encoded message
+MAX_MESSAGE_SIZE = 65536
+
+
+def encode(channel, data):
+    """
+    Encode a datagram holding a message for a channel.
+
+    :param channel: The channel name.
+    :param data: The marshalled message.
+    """
+    name = channel.encode('ascii')
+    return bytes((len(name),)) + name + data
+
+
+def decode(data):
+    """
+    Decode a datagram into the channel name and message.
+    """
+    length = data[0]
+    return (data[1:1 + length].decode('ascii'), marshal.loads(data[1 + length:]))
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for processes on a single machine, using Unix domain
+    datagram sockets.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        directory = None,
+        expiry = 60,
+        group_expiry = 86400,
+        capacity = 100,
+        channel_capacity = None,
+        **kwargs
+    ):
+        """
+        :param directory: The directory shared by the processes using the layer.
+        Defaults to a directory in the system's temporary directory.
+        :param expiry: The time in seconds after which undelivered messages are
+        dropped.
+        :param group_expiry: The time in seconds after which group memberships
+        expire.
+        :param capacity: The maximum number of undelivered messages per channel.
+        """
+        super().__init__(
+            expiry = expiry,
+            capacity = capacity,
+            channel_capacity = channel_capacity,
+            **kwargs
+        )
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'astroplant-channels')
+        self.group_expiry = group_expiry
+
+        self._pid = None
+        self._socket = None
+        self._token = None
+        self._reader_loop = None
+        self._channels = {}
+        self._memberships = set()
+
+    ### Process socket ###
+
+    def _ensure_socket(self):
+        """
+        Bind the socket of this process, if it has not been bound yet (or if
+        the process was forked after binding it).
+        """
+        if self._pid == os.getpid():
+            return
+
+        os.makedirs(os.path.join(self.directory, 'groups'), exist_ok=True)
+
+        self._pid = os.getpid()
+        self._token = "".join(random.choice(string.ascii_letters + string.digits) for i in range(12))
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(self._socket_path(self._token))
+        self._reader_loop = None
+        self._channels = {}
+        self._memberships = set()
+
+        atexit.register(self._cleanup, self._pid)
+
+    def _socket_path(self, token):
+        return os.path.join(self.directory, '%s.sock' % token)
+
+    def _group_path(self, group):
+        return os.path.join(self.directory, 'groups', group)
+
+    def _ensure_reader(self):
+        """
+        Read the socket of this process in the running event loop.
+        """
+        loop = asyncio.get_event_loop()
+        if self._reader_loop is loop and not loop.is_closed():
+            return
+
+        if self._reader_loop is not None and not self._reader_loop.is_closed():
+            self._reader_loop.remove_reader(self._socket.fileno())
+
+        # Queues belong to the loop they were created in
+        self._channels = {}
+        self._reader_loop = loop
+        loop.add_reader(self._socket.fileno(), self._read)
+
+    def _read(self):
+        """
+        Read all datagrams available on the socket of this process into the
+        queues of their channels.
+        """
+        while True:
+            try:
+                data = self._socket.recv(MAX_MESSAGE_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            (channel, message) = decode(data)
+            self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        """
+        Put a message in the queue of a channel of this process. The message
+        is dropped if the queue is full.
+        """
+        queue = self._channels.setdefault(channel, asyncio.Queue())
+        if queue.qsize() < self.get_capacity(channel):
+            queue.put_nowait((time.time() + self.expiry, message))
+
+    def _cleanup(self, pid):
+        """
+        Remove the socket and group memberships of this process.
+        """
+        if pid != os.getpid():
+            return
+
+        for (group, channel) in self._memberships:
+            try:
+                os.unlink(os.path.join(self._group_path(group), channel))
+            except OSError:
+                pass
+
+        try:
+            os.unlink(self._socket_path(self._token))
+        except OSError:
+            pass
+
+    ### Channel layer API ###
+
+    async def send(self, channel, message):
+        """
+        Send a message onto a channel.
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        self._send(channel, encode(channel, marshal.dumps(message)))
+
+    def _send(self, channel, data):
+        """
+        Send an encoded message to the process owning a channel.
+
+        :raises ChannelFull: If the owning process is not keeping up.
+        :raises ConnectionRefusedError: If the owning process has gone.
+        """
+        self._ensure_socket()
+
+        if len(data) > MAX_MESSAGE_SIZE:
+            raise ValueError("Message of %d bytes is too large for the channel layer" % len(data))
+
+        if "!" not in channel:
+            # Only received within this process
+            (channel, message) = decode(data)
+            self._deliver(channel, message)
+            return
+
+        token = channel[channel.rfind(".", 0, channel.find("!")) + 1:channel.find("!")]
+        try:
+            self._socket.sendto(data, self._socket_path(token))
+        except (BlockingIOError, InterruptedError):
+            raise ChannelFull(channel)
+        except FileNotFoundError:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, "No process owns channel %s" % channel)
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel.
+        """
+        assert self.valid_channel_name(channel)
+        self._ensure_socket()
+        self._ensure_reader()
+
+        while True:
+            queue = self._channels.setdefault(channel, asyncio.Queue())
+            (expires, message) = await queue.get()
+
+            if queue.empty():
+                del self._channels[channel]
+
+            if expires >= time.time():
+                return message
+
+    async def new_channel(self, prefix = "specific."):
+        """
+        Returns a new channel name that can be used by something in our
+        process as a specific channel.
+        """
+        self._ensure_socket()
+        return "%s%s!%s" % (
+            prefix,
+            self._token,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    ### Flush extension ###
+
+    async def flush(self):
+        """
+        Remove all queued messages and group memberships of this process.
+        Other processes sharing the directory are not affected.
+        """
+        self._channels = {}
+
+        for (group, channel) in self._memberships:
+            try:
+                os.unlink(os.path.join(self._group_path(group), channel))
+            except OSError:
+                pass
+        self._memberships = set()
+
+    async def close(self):
+        pass
+
+    ### Groups extension ###
+
+    async def group_add(self, group, channel):
+        """
+        Adds the channel name to a group.
+        """
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self._ensure_socket()
+
+        group_path = self._group_path(group)
+        os.makedirs(group_path, exist_ok=True)
+
+        # Creating the file, or updating its modification time, marks the
+        # time the channel joined
+        with open(os.path.join(group_path, channel), 'a'):
+            os.utime(os.path.join(group_path, channel))
+
+        self._memberships.add((group, channel))
+
+    async def group_discard(self, group, channel):
+        """
+        Removes the channel name from a group.
+        """
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+
+        try:
+            os.unlink(os.path.join(self._group_path(group), channel))
+        except FileNotFoundError:
+            pass
+
+        self._memberships.discard((group, channel))
+
+    async def group_send(self, group, message):
+        """
+        Send a message to all channels in a group. The message is encoded
+        once for all channels. Memberships of channels whose process has gone, or that have
+        expired, are removed.
+        """
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+
+        group_path = self._group_path(group)
+        try:
+            entries = list(os.scandir(group_path))
+        except FileNotFoundError:
+            return
+
+        data = marshal.dumps(message)
+        timeout = time.time() - self.group_expiry
+
+        for entry in entries:
+            channel = entry.name
+            try:
+                if entry.stat().st_mtime < timeout:
+                    os.unlink(entry.path)
+                    continue
+
+                self._send(channel, encode(channel, data))
+            except ChannelFull:
+                pass
+            except (FileNotFoundError, ConnectionRefusedError):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
@@ -0,0 +1,24 @@
+"""
+Management command to move old measurements into the archive.
+"""
+
+from django.core.management.base import BaseCommand
+
+import backend.archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move measurements older than the configured number of days out of "
+        "the database into archive blocks on disk (see the "
+        "MEASUREMENT_ARCHIVE setting). Meant to be run periodically, e.g. "
+        "daily from cron."
+    )
+
+    def handle(self, *args, **options):
+        if backend.archive.get_configuration()['AFTER_DAYS'] is None:
+            self.stdout.write("Archiving is disabled (MEASUREMENT_ARCHIVE['AFTER_DAYS'] is None)")
+            return
+
+        archived = backend.archive.archive()
+        self.stdout.write("Archived %d measurements" % archived)
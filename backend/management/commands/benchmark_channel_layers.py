@@ -0,0 +1,185 @@
+"""
+Management command to benchmark the Unix socket channel layer against the
+in-memory channel layer.
+"""
+
+import asyncio
+import multiprocessing
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from channels.layers import InMemoryChannelLayer
+
+import backend.models
+import backend.ingest
+import backend.layers
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the throughput and latency of the Unix socket channel "
+        "layer against the in-memory channel layer, with measurement channel "
+        "events as messages. The Unix socket layer is additionally "
+        "benchmarked between two processes. No database access is required."
+    )
+
+    #: The number of messages sent before receiving them, when measuring
+    #: throughput
+    BATCH_SIZE = 50
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000,
+                            help="The number of messages to send per benchmark.")
+        parser.add_argument('--group-size', type=int, default=10,
+                            help="The number of channels in the group sent to.")
+
+    def handle(self, *args, **options):
+        measurement = backend.models.Measurement(
+            peripheral_id = 1,
+            kit_id = 1,
+            quantity_type_id = 1,
+            date_time = timezone.now().replace(microsecond=0),
+            value = 21.5,
+            physical_quantity = "Temperature",
+            physical_unit = "Degrees Celsius",
+        )
+        message = backend.ingest.measurement_event("REAL_TIME", measurement)
+
+        messages = options['messages']
+        group_size = options['group_size']
+        loop = asyncio.get_event_loop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            layers = [
+                ('in-memory', InMemoryChannelLayer(capacity=self.BATCH_SIZE)),
+                ('unix socket', backend.layers.UnixSocketChannelLayer(directory=directory, capacity=self.BATCH_SIZE)),
+            ]
+
+            for (name, layer) in layers:
+                throughput = loop.run_until_complete(self.throughput(layer, message, messages))
+                latencies = loop.run_until_complete(self.latencies(layer, message, messages))
+                group_throughput = loop.run_until_complete(self.group_throughput(layer, message, messages // group_size, group_size))
+
+                self.stdout.write("%s layer:" % name)
+                self.write_results(throughput, latencies, group_throughput, group_size)
+
+            self.stdout.write("unix socket layer, between two processes:")
+            self.stdout.write("  round trip latency:     %s" % self.format_latencies(self.process_latencies(directory, message, messages)))
+
+    def write_results(self, throughput, latencies, group_throughput, group_size):
+        self.stdout.write("  messages per second:    %.0f" % throughput)
+        self.stdout.write("  latency:                %s" % self.format_latencies(latencies))
+        self.stdout.write("  group sends per second: %.0f (%d channels)" % (group_throughput, group_size))
+
+    def format_latencies(self, latencies):
+        latencies = sorted(latencies)
+        return "p50 %.1f us, p99 %.1f us" % (
+            latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+        )
+
+    async def throughput(self, layer, message, messages):
+        """
+        Send messages to a channel in batches, receiving each batch.
+
+        :return: The number of messages per second.
+        """
+        channel = await layer.new_channel()
+
+        start = time.perf_counter()
+        for _ in range(messages // self.BATCH_SIZE):
+            for _ in range(self.BATCH_SIZE):
+                await layer.send(channel, message)
+            for _ in range(self.BATCH_SIZE):
+                await layer.receive(channel)
+
+        return (messages // self.BATCH_SIZE * self.BATCH_SIZE) / (time.perf_counter() - start)
+
+    async def latencies(self, layer, message, messages):
+        """
+        Send messages to a channel one by one, receiving each.
+
+        :return: A list of latencies in seconds.
+        """
+        channel = await layer.new_channel()
+
+        latencies = []
+        for _ in range(messages):
+            start = time.perf_counter()
+            await layer.send(channel, message)
+            await layer.receive(channel)
+            latencies.append(time.perf_counter() - start)
+
+        return latencies
+
+    async def group_throughput(self, layer, message, messages, group_size):
+        """
+        Send messages to a group, receiving them on each channel.
+
+        :return: The number of group sends per second.
+        """
+        channels = [await layer.new_channel() for _ in range(group_size)]
+        for channel in channels:
+            await layer.group_add("benchmark", channel)
+
+        start = time.perf_counter()
+        for _ in range(messages):
+            await layer.group_send("benchmark", message)
+            for channel in channels:
+                await layer.receive(channel)
+        elapsed = time.perf_counter() - start
+
+        for channel in channels:
+            await layer.group_discard("benchmark", channel)
+
+        return messages / elapsed
+
+    def process_latencies(self, directory, message, messages):
+        """
+        Send messages to a channel of another process, which sends them back.
+
+        :return: A list of round trip latencies in seconds.
+        """
+        (parent_connection, child_connection) = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=echo, args=(directory, messages, child_connection))
+        process.start()
+
+        async def ping():
+            layer = backend.layers.UnixSocketChannelLayer(directory=directory)
+            channel = await layer.new_channel()
+            parent_connection.send(channel)
+            echo_channel = parent_connection.recv()
+
+            latencies = []
+            for _ in range(messages):
+                start = time.perf_counter()
+                await layer.send(echo_channel, dict(message, reply_channel=channel))
+                await layer.receive(channel)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        try:
+            return asyncio.get_event_loop().run_until_complete(ping())
+        finally:
+            process.join()
+
+
+def echo(directory, messages, connection):
+    """
+    Send messages received on a new channel back to their reply channel.
+    Runs in a separate process.
+    """
+    async def run():
+        layer = backend.layers.UnixSocketChannelLayer(directory=directory)
+        channel = await layer.new_channel()
+        connection.recv()
+        connection.send(channel)
+
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            await layer.send(message['reply_channel'], message)
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    asyncio.get_event_loop().run_until_complete(run())
@@ -0,0 +1,173 @@
+"""
+Management command to benchmark the synchronous and asynchronous websocket
+consumers against each other.
+"""
+
+import asyncio
+import datetime
+import json
+import random
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from channels.testing import WebsocketCommunicator
+
+import backend.models
+import backend.consumers
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the synchronous and asynchronous websocket consumers. "
+        "Opens a number of kit and subscriber connections to each consumer "
+        "implementation, and reports the cost of holding the connections and "
+        "the rate at which published measurements are handled. A temporary "
+        "kit is created in the database for the duration of the benchmark."
+    )
+
+    #: The consumer implementations to benchmark, as (name, kit consumer,
+    #: subscribe consumer) tuples.
+    IMPLEMENTATIONS = [
+        ('sync', backend.consumers.KitConsumer, backend.consumers.MeasurementSubscribeConsumer),
+        ('async', backend.consumers.AsyncKitConsumer, backend.consumers.AsyncMeasurementSubscribeConsumer),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500,
+                            help="The number of kit connections to hold open.")
+        parser.add_argument('--subscribers', type=int, default=10,
+                            help="The number of subscriber connections to hold open.")
+        parser.add_argument('--messages', type=int, default=2000,
+                            help="The number of measurements to publish.")
+
+    def handle(self, *args, **options):
+        kit = self.create_kit()
+        try:
+            loop = asyncio.get_event_loop()
+            for (name, kit_consumer, subscribe_consumer) in self.IMPLEMENTATIONS:
+                results = loop.run_until_complete(self.benchmark(
+                    kit, kit_consumer, subscribe_consumer,
+                    options['connections'], options['subscribers'], options['messages']
+                ))
+
+                self.stdout.write("%s consumers:" % name)
+                self.stdout.write("  connections held:      %d kits, %d subscribers" % (options['connections'], options['subscribers']))
+                self.stdout.write("  time to connect:       %.3f s" % results['connect_time'])
+                self.stdout.write("  memory per connection: %.1f KiB" % (results['memory'] / (options['connections'] + options['subscribers']) / 1024))
+                self.stdout.write("  threads while held:    %d" % results['threads'])
+                self.stdout.write("  messages per second:   %.0f" % (options['messages'] / results['publish_time']))
+                self.stdout.write("  delivered to subscribers: %.1f%%" % (results['delivered'] * 100))
+        finally:
+            backend.models.PeripheralDefinition.objects.filter(peripheral__kit=kit).delete()
+            kit.delete()
+
+    def create_kit(self):
+        """
+        Create a temporary kit with a single peripheral device.
+        """
+        kit = backend.models.Kit.objects.create(
+            username = 'k.benchmark-%08x' % random.getrandbits(32),
+            name = 'Benchmark kit',
+        )
+        quantity_type = backend.models.QuantityType.objects.filter(
+            physical_quantity = 'Temperature', physical_unit = 'Degrees Celsius'
+        ).first()
+        peripheral_definition = backend.models.PeripheralDefinition.objects.create(
+            name = 'Benchmark definition %s' % kit.username,
+            module_name = 'benchmark',
+            class_name = 'Benchmark',
+        )
+        if quantity_type:
+            peripheral_definition.quantity_types.add(quantity_type)
+        backend.models.Peripheral.objects.create(
+            kit = kit,
+            peripheral_definition = peripheral_definition,
+            name = 'benchmark',
+        )
+        return kit
+
+    async def benchmark(self, kit, kit_consumer, subscribe_consumer, connections, subscribers, messages):
+        """
+        Benchmark a consumer implementation.
+
+        :return: A dictionary of results.
+        """
+        results = {}
+
+        def kit_communicator():
+            communicator = WebsocketCommunicator(kit_consumer, '/kit/')
+            communicator.scope['user'] = kit
+            return communicator
+
+        def subscribe_communicator():
+            communicator = WebsocketCommunicator(subscribe_consumer, '/measurements/subscribe/%s/' % kit.username)
+            communicator.scope['user'] = kit
+            communicator.scope['url_route'] = {'kwargs': {'kit_name': kit.username}}
+            return communicator
+
+        tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+
+        kit_communicators = [kit_communicator() for _ in range(connections)]
+        subscribe_communicators = [subscribe_communicator() for _ in range(subscribers)]
+        await asyncio.gather(*[communicator.connect() for communicator in kit_communicators + subscribe_communicators])
+
+        results['connect_time'] = time.perf_counter() - start
+        results['memory'] = tracemalloc.get_traced_memory()[0] - start_memory
+        results['threads'] = threading.active_count()
+        tracemalloc.stop()
+
+        frame = json.dumps({
+            'stream': 'publish-measurement',
+            'nonce': 0,
+            'payload': {
+                'measurement_type': 'REAL_TIME',
+                'measurement': {
+                    'peripheral': 'benchmark',
+                    'physical_quantity': 'Temperature',
+                    'physical_unit': 'Degrees Celsius',
+                    'value': 20.0,
+                    'date_time': datetime.datetime.utcnow().isoformat() + 'Z',
+                }
+            }
+        })
+
+        async def publish(communicator, count):
+            for _ in range(count):
+                await communicator.send_to(text_data=frame)
+                await communicator.receive_from(timeout=60)
+
+        published = asyncio.Event()
+        received = [0]
+
+        async def receive(communicator):
+            # Measurements may be dropped by the channel layer when a
+            # subscriber falls behind, so receive until publishing is done
+            # and no more measurements arrive
+            while True:
+                try:
+                    await communicator.receive_from(timeout=0.5)
+                    received[0] += 1
+                except asyncio.TimeoutError:
+                    if published.is_set():
+                        return
+
+        async def publish_all():
+            await asyncio.gather(*[publish(communicator, count) for (communicator, count) in zip(publishers, counts)])
+            results['publish_time'] = time.perf_counter() - start
+            published.set()
+
+        # Spread the messages over (at most) 50 publishing connections
+        publishers = kit_communicators[:50]
+        counts = [messages // len(publishers) + (1 if n < messages % len(publishers) else 0) for n in range(len(publishers))]
+
+        start = time.perf_counter()
+        await asyncio.gather(publish_all(), *[receive(communicator) for communicator in subscribe_communicators])
+        results['delivered'] = received[0] / (messages * subscribers) if subscribers else 1.0
+
+        await asyncio.gather(*[communicator.disconnect() for communicator in kit_communicators + subscribe_communicators])
+
+        return results
@@ -0,0 +1,80 @@
+"""
+Management command to benchmark the cost of fanning out a published
+measurement to the subscribers of a kit.
+"""
+
+import copy
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+import backend.models
+import backend.ingest
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the cost of fanning out a measurement to a number of "
+        "subscribers. Compares sending the message as a dictionary encoded "
+        "by each subscriber with sending the frame encoded once by the "
+        "publisher. No database access is required."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 10, 100, 500],
+                            help="The numbers of subscribers to benchmark.")
+        parser.add_argument('--messages', type=int, default=200,
+                            help="The number of measurements to fan out per run.")
+
+    def handle(self, *args, **options):
+        measurement = backend.models.Measurement(
+            peripheral_id = 1,
+            kit_id = 1,
+            quantity_type_id = 1,
+            date_time = timezone.now().replace(microsecond=0),
+            value = 21.5,
+            physical_quantity = "Temperature",
+            physical_unit = "Degrees Celsius",
+        )
+
+        self.stdout.write("%11s  %20s  %20s  %8s" % ("subscribers", "per-subscriber (ms)", "encode-once (ms)", "speedup"))
+        for subscribers in options['subscribers']:
+            per_subscriber = self.benchmark(
+                subscribers, options['messages'],
+                lambda: {'type': 'measurement', 'message': backend.ingest.measurement_message("REAL_TIME", measurement)},
+                lambda event: json.dumps(event['message']),
+            )
+            encode_once = self.benchmark(
+                subscribers, options['messages'],
+                lambda: backend.ingest.measurement_event("REAL_TIME", measurement),
+                lambda event: event['text'],
+            )
+
+            self.stdout.write("%11d  %20.3f  %20.3f  %7.1fx" % (
+                subscribers,
+                per_subscriber / options['messages'] * 1000,
+                encode_once / options['messages'] * 1000,
+                per_subscriber / encode_once,
+            ))
+
+    def benchmark(self, subscribers, messages, create_event, encode_frame):
+        """
+        Fan out measurements to subscribers. The channel layer is left out to
+        isolate the cost of the messages themselves: as the in-memory channel
+        layer does, each subscriber receives a copy of the event.
+
+        :param create_event: Function creating the channel event sent by the
+        publisher.
+        :param encode_frame: Function creating the frame a subscriber sends
+        from a received channel event.
+        :return: The time taken in seconds.
+        """
+        start = time.perf_counter()
+        for _ in range(messages):
+            event = create_event()
+            for _ in range(subscribers):
+                encode_frame(copy.deepcopy(event))
+
+        return time.perf_counter() - start
@@ -0,0 +1,188 @@
+"""
+Management command to benchmark the hot measurement queries with and without
+the measurement indexes.
+"""
+
+import datetime
+import random
+import statistics
+import time
+
+from django.apps.registry import Apps
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+def create_model(name, indexed):
+    """
+    Create a synthetic measurement model in an isolated app registry, such
+    that it is not part of the project's models.
+
+    :param name: The name of the model (and its table).
+    :param indexed: Whether to declare the indexes of `backend.models.Measurement`.
+    Otherwise, only the single-column indexes of the foreign keys are declared.
+    """
+    meta = {
+        'apps': Apps(),
+        'app_label': 'backend',
+        'db_table': name,
+    }
+    if indexed:
+        meta['unique_together'] = (('kit_id', 'peripheral_id', 'quantity_type_id', 'date_time'),)
+        meta['indexes'] = [models.Index(fields = ['kit_id', 'date_time'], name = 'benchmark_kit_time_idx')]
+
+    return type(name, (models.Model,), {
+        '__module__': __name__,
+        'Meta': type('Meta', (), meta),
+        'kit_id': models.IntegerField(db_index = True),
+        'peripheral_id': models.IntegerField(db_index = True),
+        'quantity_type_id': models.IntegerField(db_index = True, null = True),
+        'date_time': models.DateTimeField(),
+        'value': models.FloatField(),
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the hot measurement queries (the recent measurements of a "
+        "kit's time series, and the measurements of a kit in a time range) on "
+        "synthetic measurement tables with and without the measurement "
+        "indexes. Shows the query plans and latencies. The synthetic tables "
+        "are created in the configured database and dropped afterwards."
+    )
+
+    #: The number of rows inserted at once
+    INSERT_BATCH_SIZE = 10000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000000,
+                            help="The number of rows in each synthetic table.")
+        parser.add_argument('--kits', type=int, default=100,
+                            help="The number of kits measurements are spread over.")
+        parser.add_argument('--series', type=int, default=10,
+                            help="The number of (peripheral device, quantity type) series per kit.")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="The number of times each query is run.")
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the synthetic tables after the benchmark.")
+
+    def handle(self, *args, **options):
+        tables = [
+            ('without indexes', create_model('benchmark_measurement_plain', indexed=False)),
+            ('with indexes', create_model('benchmark_measurement_indexed', indexed=True)),
+        ]
+
+        now = timezone.now().replace(microsecond=0)
+        rows_per_series = max(1, options['rows'] // (options['kits'] * options['series']))
+        start = now - datetime.timedelta(minutes=rows_per_series)
+
+        for (name, model) in tables:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.create_model(model)
+
+        try:
+            for (name, model) in tables:
+                self.stdout.write("Filling table %s..." % model._meta.db_table)
+                self.fill(model, options['kits'], options['series'], rows_per_series, start)
+
+            for (name, model) in tables:
+                self.stdout.write("")
+                self.stdout.write("%s (%s):" % (name, model._meta.db_table))
+                for (description, create_queryset) in self.queries(model, options['kits'], options['series'], now):
+                    self.benchmark(description, create_queryset, options['repeat'])
+        finally:
+            if not options['keep']:
+                for (name, model) in tables:
+                    with connection.schema_editor() as schema_editor:
+                        schema_editor.delete_model(model)
+
+    def fill(self, model, kits, series, rows_per_series, start):
+        """
+        Fill a synthetic table. Measurements are inserted in time order,
+        interleaving all series, as they are when ingested.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ", ".join(connection.ops.quote_name(column) for column in ('kit_id', 'peripheral_id', 'quantity_type_id', 'date_time', 'value'))
+        statement = "INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s, %%s)" % (table, columns)
+
+        date_time_field = model._meta.get_field('date_time')
+
+        def rows():
+            for minute in range(rows_per_series):
+                date_time = date_time_field.get_db_prep_value(start + datetime.timedelta(minutes=minute), connection)
+                for kit in range(1, kits + 1):
+                    for serie in range(series):
+                        yield (kit, kit * series + serie // 2, serie % 2 + 1, date_time, random.random())
+
+        def insert(batch):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(statement, batch)
+
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= self.INSERT_BATCH_SIZE:
+                insert(batch)
+                batch = []
+        if batch:
+            insert(batch)
+
+    def queries(self, model, kits, series, now):
+        """
+        Get the benchmarked queries, as tuples of a description and a function
+        creating a queryset for a random kit and series.
+        """
+        def series_recent():
+            kit = random.randint(1, kits)
+            serie = random.randrange(series)
+            return model.objects.filter(
+                kit_id = kit,
+                peripheral_id = kit * series + serie // 2,
+                quantity_type_id = serie % 2 + 1,
+                date_time__gte = now - datetime.timedelta(days=3),
+            ).order_by('-date_time')[:100]
+
+        def series_range():
+            kit = random.randint(1, kits)
+            serie = random.randrange(series)
+            return model.objects.filter(
+                kit_id = kit,
+                peripheral_id = kit * series + serie // 2,
+                quantity_type_id = serie % 2 + 1,
+                date_time__gte = now - datetime.timedelta(hours=6),
+            ).order_by('date_time')
+
+        def kit_range():
+            return model.objects.filter(
+                kit_id = random.randint(1, kits),
+                date_time__gte = now - datetime.timedelta(hours=1),
+            ).order_by('date_time')[:100]
+
+        return [
+            ("recent measurements of a series (Kit.recent_measurements with a maximum)", series_recent),
+            ("measurements of a series in a time range (Kit.recent_measurements)", series_range),
+            ("measurements of a kit in a time range", kit_range),
+        ]
+
+    def benchmark(self, description, create_queryset, repeat):
+        """
+        Show the query plan of a query, and its median latency.
+        """
+        explain = "EXPLAIN QUERY PLAN" if connection.vendor == 'sqlite' else "EXPLAIN"
+
+        self.stdout.write("  %s" % description)
+        (statement, params) = create_queryset().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("%s %s" % (explain, statement), params)
+            for row in cursor.fetchall():
+                self.stdout.write("    plan: %s" % " | ".join(str(column) for column in row))
+
+        latencies = []
+        for _ in range(repeat):
+            queryset = create_queryset()
+            start = time.perf_counter()
+            list(queryset)
+            latencies.append(time.perf_counter() - start)
+
+        self.stdout.write("    median latency: %.2f ms" % (statistics.median(latencies) * 1000))
@@ -0,0 +1,34 @@
+"""
+Management command to convert stored measurements to or from compact rows.
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import backend.compaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert stored measurements to compact rows without physical "
+        "quantity and unit strings, or back with --expand, in small batches. "
+        "Run it after changing the COMPACT_MEASUREMENTS setting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expand', action='store_true',
+                            help="Fill in the physical quantity and unit strings of compact measurements.")
+        parser.add_argument('--batch-size', type=int, default=backend.compaction.BATCH_SIZE,
+                            help="The number of consecutive primary keys converted at once.")
+
+    def handle(self, *args, **options):
+        compact = not options['expand']
+        if compact != getattr(settings, 'COMPACT_MEASUREMENTS', False):
+            self.stderr.write("Warning: COMPACT_MEASUREMENTS is %s; new measurements will be stored %s" % (
+                getattr(settings, 'COMPACT_MEASUREMENTS', False),
+                "compact" if not compact else "with their strings",
+            ))
+
+        changed = backend.compaction.convert(apps, compact, batch_size = options['batch_size'])
+        self.stdout.write("Converted %d measurements" % changed)
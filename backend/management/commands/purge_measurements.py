@@ -0,0 +1,38 @@
+"""
+Management command to remove expired measurements and rollups.
+"""
+
+from django.core.management.base import BaseCommand
+
+import backend.models
+import backend.retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove measurements and rollups that have expired according to the "
+        "retention policies (see the MEASUREMENT_RETENTION setting). Meant "
+        "to be run periodically, e.g. daily from cron. Rows are removed in "
+        "small chunks of primary keys."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int,
+                            help="The number of consecutive primary keys removed at once.")
+        parser.add_argument('--chunk-delay', type=int,
+                            help="The pause between chunks in milliseconds.")
+        parser.add_argument('--status', action='store_true',
+                            help="Show the progress and results of recent runs instead of purging.")
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for run in backend.models.RetentionRun.objects.all()[:10]:
+                self.stdout.write("%s  %-8s  %s %3.0f%%  %d measurements, %d rollups removed" % (
+                    run.started, run.state, run.current_table or '-', run.progress * 100,
+                    run.measurements_removed, run.rollups_removed,
+                ))
+            return
+
+        chunk_delay = options['chunk_delay'] / 1000.0 if options['chunk_delay'] is not None else None
+        run = backend.retention.purge(chunk_size = options['chunk_size'], chunk_delay = chunk_delay)
+        self.stdout.write("Removed %d measurements and %d rollups" % (run.measurements_removed, run.rollups_removed))
@@ -0,0 +1,50 @@
+"""
+Management command to rebuild measurement rollups from the stored
+measurements.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse
+
+import backend.models
+import backend.rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the measurement rollups (minute, hour and day aggregates) "
+        "from the stored measurements, e.g. after measurements have been "
+        "backfilled. Rollups are rebuilt per whole day (in UTC)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kit',
+                            help="The username of the kit to rebuild the rollups of. Defaults to all kits.")
+        parser.add_argument('--since',
+                            help="The date-time (ISO 8601) from which to rebuild. Defaults to the first measurement.")
+        parser.add_argument('--until',
+                            help="The date-time (ISO 8601) until which to rebuild. Defaults to the last measurement.")
+
+    def handle(self, *args, **options):
+        kit = None
+        if options['kit']:
+            kit = backend.models.Kit.kits.safe_get_by_username(options['kit'])
+            if kit is None:
+                raise CommandError("Kit %s does not exist" % options['kit'])
+
+        since = self.parse_date_time(options['since'])
+        until = self.parse_date_time(options['until'])
+
+        created = backend.rollups.rebuild(kit = kit, since = since, until = until)
+        self.stdout.write("Created %d rollups" % created)
+
+    def parse_date_time(self, value):
+        if value is None:
+            return None
+
+        date_time = dateparse.parse_datetime(value)
+        if date_time is None:
+            raise CommandError("Invalid date-time: %s" % value)
+        if date_time.tzinfo is None:
+            raise CommandError("Date-time must include a timezone: %s" % value)
+        return date_time
@@ -0,0 +1,18 @@
+"""
+Management command to run pending kit deletion jobs.
+"""
+
+from django.core.management.base import BaseCommand
+
+import backend.deletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Run pending kit deletion jobs in the foreground, including jobs that "
+        "were interrupted by a restart of the server."
+    )
+
+    def handle(self, *args, **options):
+        count = backend.deletion.run_pending()
+        self.stdout.write("Ran %d deletion jobs" % count)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:05
+from __future__ import unicode_literals
+
+import backend.models
+import datetime
+from django.conf import settings
+import django.contrib.auth.models
+import django.contrib.auth.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0008_alter_user_username_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('first_name', models.CharField(blank=True, max_length=30, verbose_name='first name')),
+                ('last_name', models.CharField(blank=True, max_length=30, verbose_name='last name')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email address')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Experiment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time_start', models.DateTimeField()),
+                ('date_time_end', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KitMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time_linked', models.DateTimeField(default=datetime.datetime.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Measurement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('physical_quantity', models.CharField(max_length=100, null=True)),
+                ('physical_unit', models.CharField(max_length=100, null=True)),
+                ('experiment', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='backend.Experiment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Peripheral',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('active', models.BooleanField(default=True)),
+                ('date_time_added', models.DateTimeField(default=datetime.datetime.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PeripheralConfiguration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(blank=True, max_length=100)),
+                ('peripheral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peripheral_configurations', to='backend.Peripheral')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PeripheralConfigurationDefinition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('default_value', models.CharField(max_length=100)),
+                ('description', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PeripheralDefinition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('verified', models.BooleanField(default=False)),
+                ('public', models.BooleanField(default=False)),
+                ('brand', models.CharField(blank=True, max_length=100)),
+                ('type', models.CharField(blank=True, max_length=100)),
+                ('module_name', models.CharField(max_length=255)),
+                ('class_name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuantityType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('physical_quantity', models.CharField(max_length=100)),
+                ('physical_unit', models.CharField(max_length=100)),
+                ('physical_unit_symbol', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Kit',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('type', models.CharField(max_length=10)),
+                ('name', models.CharField(max_length=250)),
+                ('description', models.TextField(blank=True, default='')),
+                ('latitude', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('longitude', models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True)),
+                ('privacy_public_dashboard', models.BooleanField(default=False)),
+                ('privacy_show_on_map', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Kit',
+                'verbose_name_plural': 'Kits',
+            },
+            bases=('backend.user',),
+            managers=[
+                ('kits', django.db.models.manager.Manager()),
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PersonUser',
+            fields=[
+                ('user_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('use_gravatar', models.BooleanField(default=True)),
+                ('gravatar_alternative', models.TextField(default=backend.models._generate_gravatar_alternative, max_length=255)),
+            ],
+            options={
+                'verbose_name': 'user',
+                'verbose_name_plural': 'users',
+                'abstract': False,
+            },
+            bases=('backend.user',),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='peripheraldefinition',
+            name='quantity_types',
+            field=models.ManyToManyField(blank=True, to='backend.QuantityType'),
+        ),
+        migrations.AddField(
+            model_name='peripheralconfigurationdefinition',
+            name='peripheral_definition',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peripheral_configuration_definitions', to='backend.PeripheralDefinition'),
+        ),
+        migrations.AddField(
+            model_name='peripheralconfiguration',
+            name='peripheral_configuration_definition',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.PeripheralConfigurationDefinition'),
+        ),
+        migrations.AddField(
+            model_name='peripheral',
+            name='peripheral_definition',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.PeripheralDefinition'),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='peripheral',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Peripheral'),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='quantity_type',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='backend.QuantityType'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='groups',
+            field=models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.Group', verbose_name='groups'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='user_permissions',
+            field=models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.Permission', verbose_name='user permissions'),
+        ),
+        migrations.AddField(
+            model_name='peripheraldefinition',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='peripheral_definitions', to='backend.PersonUser'),
+        ),
+        migrations.AddField(
+            model_name='peripheral',
+            name='kit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peripherals', to='backend.Kit'),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='kit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='measurements', to='backend.Kit'),
+        ),
+        migrations.AddField(
+            model_name='kitmembership',
+            name='kit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='backend.Kit'),
+        ),
+        migrations.AddField(
+            model_name='kitmembership',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='backend.PersonUser'),
+        ),
+        migrations.AddField(
+            model_name='kit',
+            name='users',
+            field=models.ManyToManyField(through='backend.KitMembership', to='backend.PersonUser'),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='kit',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Kit'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='measurement',
+            unique_together=set([('kit', 'peripheral', 'quantity_type', 'date_time')]),
+        ),
+        migrations.AddIndex(
+            model_name='measurement',
+            index=models.Index(fields=['kit', 'date_time'], name='measurement_kit_time_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_measurement_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, 'Minute'), (3600, 'Hour'), (86400, 'Day')])),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+                ('sum', models.FloatField()),
+                ('sum_of_squares', models.FloatField()),
+                ('kit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='measurement_rollups', to='backend.Kit')),
+                ('peripheral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Peripheral')),
+                ('quantity_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.QuantityType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='measurementrollup',
+            unique_together=set([('kit', 'peripheral', 'quantity_type', 'resolution', 'bucket')]),
+        ),
+    ]
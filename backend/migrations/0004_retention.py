@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_measurementrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KitRetentionPolicy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raw_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('minute_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('hour_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('day_days', models.PositiveIntegerField(blank=True, null=True)),
+                ('kit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='retention_policy', to='backend.Kit')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RetentionRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('state', models.CharField(choices=[('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('current_table', models.CharField(blank=True, max_length=100)),
+                ('progress', models.FloatField(default=0.0)),
+                ('measurements_removed', models.PositiveIntegerField(default=0)),
+                ('rollups_removed', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-started',),
+            },
+        ),
+    ]
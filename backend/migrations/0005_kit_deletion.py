@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KitDeletionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kit_name', models.CharField(max_length=250)),
+                ('action', models.CharField(choices=[('remove_measurements', 'Remove measurements'), ('remove_kit', 'Remove kit')], max_length=20)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('max_measurement_id', models.IntegerField(blank=True, null=True)),
+                ('measurements_total', models.PositiveIntegerField(blank=True, null=True)),
+                ('measurements_deleted', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddField(
+            model_name='kit',
+            name='deleted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='kitdeletionjob',
+            name='kit',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deletion_jobs', to='backend.Kit'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_kit_deletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementArchiveBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('physical_quantity', models.CharField(max_length=100, null=True)),
+                ('physical_unit', models.CharField(max_length=100, null=True)),
+                ('path', models.CharField(max_length=255)),
+                ('kit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_blocks', to='backend.Kit')),
+                ('peripheral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Peripheral')),
+                ('quantity_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.QuantityType')),
+            ],
+            options={
+                'ordering': ('start',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='measurementarchiveblock',
+            unique_together=set([('kit', 'peripheral', 'quantity_type', 'start')]),
+        ),
+    ]
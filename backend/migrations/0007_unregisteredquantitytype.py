@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:25
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+import backend.compaction
+
+
+def convert_measurements(apps, schema_editor):
+    # Measurements without a quantity type get their unregistered quantity
+    # type, and are compacted if configured
+    backend.compaction.convert(apps, getattr(settings, 'COMPACT_MEASUREMENTS', False))
+
+
+def expand_measurements(apps, schema_editor):
+    backend.compaction.convert(apps, False)
+
+
+class Migration(migrations.Migration):
+
+    # Measurements are converted in batches, each in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('backend', '0006_measurementarchiveblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnregisteredQuantityType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('physical_quantity', models.CharField(max_length=100)),
+                ('physical_unit', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='unregisteredquantitytype',
+            unique_together=set([('physical_quantity', 'physical_unit')]),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='unregistered_quantity_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='backend.UnregisteredQuantityType'),
+        ),
+        migrations.RunPython(convert_measurements, expand_measurements),
+    ]
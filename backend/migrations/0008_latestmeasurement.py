@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_latest_measurements(apps, schema_editor):
+    # One indexed lookup per peripheral device quantity type
+    Peripheral = apps.get_model('backend', 'Peripheral')
+    Measurement = apps.get_model('backend', 'Measurement')
+    LatestMeasurement = apps.get_model('backend', 'LatestMeasurement')
+
+    for peripheral in Peripheral.objects.select_related('peripheral_definition'):
+        for quantity_type in peripheral.peripheral_definition.quantity_types.all():
+            measurement = Measurement.objects.filter(
+                kit_id = peripheral.kit_id,
+                peripheral = peripheral,
+                quantity_type = quantity_type,
+            ).order_by('-date_time').first()
+            if measurement is not None:
+                LatestMeasurement.objects.create(
+                    kit_id = measurement.kit_id,
+                    peripheral_id = measurement.peripheral_id,
+                    quantity_type_id = measurement.quantity_type_id,
+                    measurement_type = 'REDUCED',
+                    date_time = measurement.date_time,
+                    value = measurement.value,
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0007_unregisteredquantitytype'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestMeasurement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('measurement_type', models.CharField(max_length=10)),
+                ('date_time', models.DateTimeField()),
+                ('value', models.FloatField()),
+                ('kit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='latest_measurements', to='backend.Kit')),
+                ('peripheral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.Peripheral')),
+                ('quantity_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='backend.QuantityType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='latestmeasurement',
+            unique_together=set([('kit', 'peripheral', 'quantity_type')]),
+        ),
+        migrations.RunPython(fill_latest_measurements, migrations.RunPython.noop),
+    ]
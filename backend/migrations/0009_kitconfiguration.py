@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_latestmeasurement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KitConfiguration',
+            fields=[
+                ('kit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='configuration', serialize=False, to='backend.Kit')),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('config', models.TextField(blank=True, null=True)),
+                ('hash', models.CharField(blank=True, max_length=40)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
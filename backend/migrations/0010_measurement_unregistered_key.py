@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:52
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def delete_duplicates(apps, schema_editor):
+    # Retried measurements of unregistered quantity types were stored more
+    # than once; keep the first of each
+    Measurement = apps.get_model('backend', 'Measurement')
+
+    duplicated = Measurement.objects.filter(
+        unregistered_quantity_type__isnull = False,
+    ).values(
+        'kit_id', 'peripheral_id', 'unregistered_quantity_type_id', 'date_time',
+    ).annotate(first = Min('pk'), count = Count('pk')).filter(count__gt = 1).order_by()
+
+    for key in duplicated:
+        first = key.pop('first')
+        key.pop('count')
+        Measurement.objects.filter(**key).exclude(pk = first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_kitconfiguration'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='measurement',
+            unique_together=set([('kit', 'peripheral', 'quantity_type', 'date_time'), ('kit', 'peripheral', 'unregistered_quantity_type', 'date_time')]),
+        ),
+    ]
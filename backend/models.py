@@ -4,13 +4,23 @@ Module defining backend AstroPlant models.
 
 import datetime
 import collections
-from django.db import models
+import copy
+import math
+import re
+import sqlite3
+import threading
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import sql
 import django.contrib.auth.models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import PermissionsMixin
 from django.core import exceptions
 import random
 
+import backend.archive
+import backend.downsampling
+
 
 class User(AbstractUser):
     pass
@@ -56,6 +66,21 @@ class KitQuerySet(models.QuerySet):
             kit = None
         return kit
 
+    def safe_get_by_username(self, username):
+        try:
+            kit = self.get(username=username)
+        except exceptions.ObjectDoesNotExist:
+            kit = None
+        return kit
+
+
+class KitManager(models.Manager.from_queryset(KitQuerySet)):
+    """
+    AstroPlant Kit manager class, excluding deleted kits.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
 
 class Kit(User):
     """
@@ -72,13 +97,17 @@ class Kit(User):
     privacy_public_dashboard = models.BooleanField(default = False)
     privacy_show_on_map = models.BooleanField(default = False)
 
+    # Deleted kits are hidden immediately, and removed in the background (see
+    # backend.deletion)
+    deleted = models.BooleanField(default = False)
+
     users = models.ManyToManyField(
         PersonUser,
         through='KitMembership',
         through_fields=('kit', 'user'),
     )
 
-    kits = KitQuerySet.as_manager()
+    kits = KitManager()
 
     class Meta:
         verbose_name = 'Kit'
@@ -96,18 +125,23 @@ class Kit(User):
         quantity types.
         """
         peripherals_and_quantity_types = []
-        for peripheral in self.active_peripherals():
+        peripherals = self.active_peripherals().select_related('peripheral_definition').prefetch_related('peripheral_definition__quantity_types')
+        for peripheral in peripherals:
             for quantity_type in peripheral.peripheral_definition.quantity_types.all():
                 peripherals_and_quantity_types.append((peripheral, quantity_type,))
         return peripherals_and_quantity_types
 
-    def recent_measurements(self, since = None, max_measurements = None):
+    def recent_measurements(self, since = None, max_measurements = None, points = None, method = 'lttb'):
         """
         Get a dictionary of peripheral devices to dictionaries of quantity types to recent measurements.
+        Archived measurements (see `backend.archive`) are included.
 
         :param since: The date after which to get measurements.
         :param max_measurements: The maximum number of measurements (per peripheral device and quantity
         type combination) to get.
+        :param points: The budget of points to downsample each series to (see `backend.downsampling`),
+        or None to not downsample.
+        :param method: The downsampling method.
 
         :return: A dictionary of peripheral devices to dictionaries of quantity types to recent measurements.
         """
@@ -117,11 +151,36 @@ class Kit(User):
         measurements = collections.defaultdict(dict)
 
         active_peripherals_and_quantity_types = self.active_peripherals_and_quantity_types()
+        if not active_peripherals_and_quantity_types:
+            return {}
+
+        # Archived measurements are rarely recent
+        archived = self.archive_blocks.filter(end__gt=since).exists()
+
+        # The measurements of all series are fetched at once
+        series = [(peripheral.pk, quantity_type.pk) for (peripheral, quantity_type) in active_peripherals_and_quantity_types]
+        recent_by_series = self.measurements.filter(date_time__gte=since).recent_by_series(series, max_measurements)
+
         for (peripheral, quantity_type) in active_peripherals_and_quantity_types:
+            recent = recent_by_series[(peripheral.pk, quantity_type.pk)]
             if max_measurements:
-                measurements[peripheral][quantity_type] = reversed(self.measurements.filter(peripheral=peripheral,quantity_type=quantity_type,date_time__gte=since).order_by('-date_time')[:max_measurements])
+                if archived and len(recent) < max_measurements:
+                    recent = backend.archive.series(
+                        self, peripheral, quantity_type,
+                        since = since,
+                        until = recent[0].date_time if recent else None,
+                        last = max_measurements - len(recent),
+                    ) + recent
+                measurements[peripheral][quantity_type] = recent
             else:
-                measurements[peripheral][quantity_type] = self.measurements.filter(peripheral=peripheral,quantity_type=quantity_type,date_time__gte=since).order_by('date_time')
+                if archived:
+                    recent = backend.archive.series(self, peripheral, quantity_type, since = since) + recent
+                measurements[peripheral][quantity_type] = recent
+
+            if points is not None:
+                measurements[peripheral][quantity_type] = backend.downsampling.downsample(
+                    measurements[peripheral][quantity_type], points, method
+                )
                         
         return dict(measurements)
 
@@ -133,7 +192,12 @@ class Kit(User):
         # Generate the configuration dictionary for each peripheral device
         peripherals = []
         modules = []
-        for peripheral in self.peripherals.filter(active = True).all():
+        active_peripherals = self.peripherals.filter(active = True).select_related('peripheral_definition').prefetch_related(
+            'peripheral_definition__peripheral_configuration_definitions',
+            'peripheral_definition__quantity_types',
+            'peripheral_configurations__peripheral_configuration_definition',
+        )
+        for peripheral in active_peripherals:
 
             # Get the peripheral device definition
             peripheral_definition = peripheral.peripheral_definition
@@ -160,11 +224,20 @@ class Kit(User):
 
                 param_config[configuration_definition.name] = value
 
+            # The ids of the peripheral device and its quantity types are used
+            # by the binary wire format (see backend.wire)
+            quantity_types = [{'id': quantity_type.pk,
+                               'physical_quantity': quantity_type.physical_quantity,
+                               'physical_unit': quantity_type.physical_unit}
+                              for quantity_type in peripheral_definition.quantity_types.all()]
+
             peripherals.append({
                 'peripheral_definition_name': peripheral_definition.name,
                 'peripheral_name': peripheral.name,
+                'peripheral_id': peripheral.pk,
                 'module_name': peripheral_definition.module_name,
                 'class_name': peripheral_definition.class_name,
+                'quantity_types': quantity_types,
                 'parameters': param_config})
 
         return {'serial': self.username, 'name': self.name, 'modules': modules, 'peripherals': peripherals}
@@ -199,10 +272,41 @@ class KitMembership(models.Model):
     def __str__(self):
         return "%s - %s" % (self.kit, self.user)
     
+class QuantityTypeManager(models.Manager):
+    """
+    AstroPlant QuantityType manager class, caching the physical quantities
+    and units of quantity types in-process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._physical_quantities = {}
+
+    def physical_quantity_and_unit(self, pk):
+        """
+        Get the physical quantity and unit of a quantity type.
+
+        :return: A tuple of the physical quantity and unit, or of None and
+        None if the quantity type does not exist.
+        """
+        with self._lock:
+            if pk not in self._physical_quantities:
+                self._physical_quantities = {
+                    pk: (physical_quantity, physical_unit)
+                    for (pk, physical_quantity, physical_unit) in self.values_list('pk', 'physical_quantity', 'physical_unit')
+                }
+            return self._physical_quantities.get(pk, (None, None))
+
+    def clear_cache(self):
+        with self._lock:
+            self._physical_quantities = {}
+
 class QuantityType(models.Model):
     """
     Model to hold the definitions for the types of quantities.
     """
+    objects = QuantityTypeManager()
 
     physical_quantity = models.CharField(max_length = 100)
     physical_unit = models.CharField(max_length = 100)
@@ -211,6 +315,77 @@ class QuantityType(models.Model):
     def __str__(self):
         return "%s (%s)" % (self.physical_quantity, self.physical_unit)
 
+class UnregisteredQuantityTypeManager(models.Manager):
+    """
+    AstroPlant UnregisteredQuantityType manager class, caching the lookup
+    table in-process. Rows are never changed, so the cache does not have to
+    be invalidated.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._pks = {}
+        self._physical_quantities = {}
+
+    def get_pk(self, physical_quantity, physical_unit):
+        """
+        Get the id of a physical quantity and unit pair, creating it if it
+        does not exist yet.
+        """
+        key = (physical_quantity, physical_unit)
+        with self._lock:
+            pk = self._pks.get(key)
+        if pk is None:
+            (unregistered_quantity_type, _) = self.get_or_create(
+                physical_quantity = physical_quantity,
+                physical_unit = physical_unit,
+            )
+            pk = unregistered_quantity_type.pk
+            with self._lock:
+                self._pks[key] = pk
+                self._physical_quantities[pk] = key
+        return pk
+
+    def physical_quantity_and_unit(self, pk):
+        """
+        Get the physical quantity and unit of a pair by its id.
+
+        :return: A tuple of the physical quantity and unit, or of None and
+        None if the pair does not exist.
+        """
+        with self._lock:
+            if pk not in self._physical_quantities:
+                self._physical_quantities = {
+                    pk: (physical_quantity, physical_unit)
+                    for (pk, physical_quantity, physical_unit) in self.values_list('pk', 'physical_quantity', 'physical_unit')
+                }
+                self._pks = {key: pk for (pk, key) in self._physical_quantities.items()}
+            return self._physical_quantities.get(pk, (None, None))
+
+    def clear_cache(self):
+        with self._lock:
+            self._pks = {}
+            self._physical_quantities = {}
+
+class UnregisteredQuantityType(models.Model):
+    """
+    Model to hold the physical quantity and unit pairs of measurements that
+    are not registered as a quantity type of the peripheral device's
+    definition. Pairs are added on the fly when such measurements are
+    stored.
+    """
+    objects = UnregisteredQuantityTypeManager()
+
+    physical_quantity = models.CharField(max_length = 100)
+    physical_unit = models.CharField(max_length = 100)
+
+    class Meta:
+        unique_together = (('physical_quantity', 'physical_unit'),)
+
+    def __str__(self):
+        return "%s (%s)" % (self.physical_quantity, self.physical_unit)
+
 class PeripheralDefinition(models.Model):
     """
     Model to hold peripheral device definitions. Each peripheral device of a specific
@@ -283,10 +458,296 @@ class PeripheralConfiguration(models.Model):
     def __str__(self):
         return "%s - %s" % (self.peripheral, self.peripheral_configuration_definition)
 
+_window_functions = {}
+
+def supports_window_functions(connection):
+    """
+    Get whether a database supports window functions, such as `ROW_NUMBER()`.
+    The result is cached per database alias.
+    """
+    if connection.alias not in _window_functions:
+        if connection.vendor == 'postgresql':
+            supported = True
+        elif connection.vendor == 'sqlite':
+            supported = sqlite3.sqlite_version_info >= (3, 25, 0)
+        elif connection.vendor == 'mysql':
+            with connection.temporary_connection() as cursor:
+                cursor.execute('SELECT VERSION()')
+                server_info = cursor.fetchone()[0]
+            version = tuple(int(part) for part in re.match(r'(\d+)\.(\d+)\.(\d+)', server_info).groups())
+            supported = version >= ((10, 2, 0) if 'mariadb' in server_info.lower() else (8, 0, 2))
+        else:
+            supported = False
+        _window_functions[connection.alias] = supported
+    return _window_functions[connection.alias]
+
+class MeasurementQuerySet(models.QuerySet):
+    """
+    AstroPlant Measurement QuerySet class
+    """
+
+    #: Rewrites of insert statements ignoring rows that violate the idempotency
+    #: key, per database vendor
+    _IGNORE_DUPLICATES = {
+        # `INSERT IGNORE` also turns other errors into warnings, which are
+        # raised after the statement (see `_raise_ignored_errors`). An upsert
+        # (`ON DUPLICATE KEY UPDATE`) would not, but Django connects with
+        # `CLIENT_FOUND_ROWS`, with which the inserted rows cannot be counted.
+        'mysql': lambda sql: sql.replace('INSERT INTO', 'INSERT IGNORE INTO', 1),
+        'sqlite': lambda sql: sql.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1),
+        'postgresql': lambda sql: sql + ' ON CONFLICT DO NOTHING',
+    }
+
+    #: The MySQL warning code of a duplicate key
+    _MYSQL_DUPLICATE_ENTRY = 1062
+
+    def bulk_create_ignoring_duplicates(self, objs, batch_size = None):
+        """
+        Insert measurements in bulk, skipping those of which the idempotency
+        key (see `Measurement.idempotency_key`) has already been stored.
+        Unlike `bulk_create`, primary keys are not set on the measurements.
+
+        On database vendors that do not support ignoring conflicts, the
+        measurements are inserted with `bulk_create`, such that duplicates
+        raise an IntegrityError.
+
+        :param objs: A list of unsaved measurements.
+        :param batch_size: The maximum number of measurements per statement.
+        :return: The number of measurements inserted.
+        """
+        if not objs:
+            return 0
+
+        for obj in objs:
+            obj.set_unregistered_quantity_type()
+
+        connection = connections[self.db]
+        rewrite = self._IGNORE_DUPLICATES.get(connection.vendor)
+        if rewrite is None:
+            if Measurement.is_compact():
+                objs = [obj.compacted() for obj in objs]
+            self.bulk_create(objs, batch_size=batch_size)
+            return len(objs)
+
+        fields = [field for field in self.model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+        if Measurement.is_compact():
+            fields = [field for field in fields if field.name not in Measurement.PHYSICAL_QUANTITY_FIELDS]
+        batch_size = min(batch_size or len(objs), max(connection.ops.bulk_batch_size(fields, objs), 1))
+
+        inserted = 0
+        with connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                query = sql.InsertQuery(self.model)
+                query.insert_values(fields, objs[start:start + batch_size])
+                for (statement, params) in query.get_compiler(connection=connection).as_sql():
+                    cursor.execute(rewrite(statement), params)
+                    inserted += cursor.rowcount
+                    if connection.vendor == 'mysql':
+                        self._raise_ignored_errors(connection, cursor)
+
+        return inserted
+
+    def _raise_ignored_errors(self, connection, cursor):
+        """
+        Raise the errors that MySQL turned into warnings while ignoring
+        duplicates, such as foreign key violations and truncated values.
+        Should be called right after the insert statement, inside a
+        transaction, such that the insert is rolled back.
+        """
+        if not connection.connection.warning_count():
+            return
+
+        cursor.execute('SHOW WARNINGS')
+        errors = [message for (level, code, message) in cursor.fetchall() if code != self._MYSQL_DUPLICATE_ENTRY]
+        if errors:
+            raise IntegrityError('; '.join(errors))
+
+    def recent_by_series(self, series, max_measurements = None):
+        """
+        Get the measurements of multiple series (peripheral device and quantity
+        type pairs) in a single query.
+
+        The most recent measurements per series are selected with a window
+        function where the database supports it, and otherwise with a union of
+        one limited selection per series, which is bounded by the number of
+        series.
+
+        :param series: A list of tuples of peripheral device and quantity type
+        ids.
+        :param max_measurements: The maximum number of (most recent)
+        measurements per series to get, or None for all measurements.
+        :return: A dictionary of each of the series to a list of its
+        measurements, ordered by time.
+        """
+        recent = collections.OrderedDict((key, []) for key in series)
+        if not series:
+            return recent
+
+        if not max_measurements:
+            queryset = self.filter(
+                peripheral_id__in = set(peripheral_id for (peripheral_id, _) in series),
+                quantity_type_id__in = set(quantity_type_id for (_, quantity_type_id) in series),
+            ).order_by('date_time')
+        elif supports_window_functions(connections[self.db]):
+            queryset = self._recent_by_window(series, max_measurements)
+        else:
+            queryset = self._recent_by_union(series, max_measurements)
+
+        for measurement in queryset:
+            key = (measurement.peripheral_id, measurement.quantity_type_id)
+            if key in recent:
+                recent[key].append(measurement)
+        return recent
+
+    def _recent_by_window(self, series, max_measurements):
+        """
+        Select the most recent measurements of series, ranking the measurements
+        of each series with `ROW_NUMBER()`.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+
+        ranked = self.filter(
+            peripheral_id__in = set(peripheral_id for (peripheral_id, _) in series),
+            quantity_type_id__in = set(quantity_type_id for (_, quantity_type_id) in series),
+        ).extra(select = {
+            'series_rank': 'ROW_NUMBER() OVER (PARTITION BY %s.%s, %s.%s ORDER BY %s.%s DESC)' % (
+                table, quote('peripheral_id'), table, quote('quantity_type_id'), table, quote('date_time'),
+            ),
+        }).order_by()
+        (statement, params) = ranked.query.get_compiler(connection=connection).as_sql()
+
+        return self.model.objects.raw(
+            'SELECT * FROM (%s) %s WHERE %s <= %%s ORDER BY %s' % (
+                statement, quote('ranked'), quote('series_rank'), quote('date_time'),
+            ),
+            params + (max_measurements,),
+            using = self.db,
+        )
+
+    def _recent_by_union(self, series, max_measurements):
+        """
+        Select the most recent measurements of series, with a union of one
+        limited selection per series.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+
+        statements = []
+        params = []
+        for (index, (peripheral_id, quantity_type_id)) in enumerate(series):
+            selection = self.filter(peripheral_id = peripheral_id, quantity_type_id = quantity_type_id).order_by('-date_time')[:max_measurements]
+            (statement, selection_params) = selection.query.get_compiler(connection=connection).as_sql()
+            statements.append('SELECT * FROM (%s) %s' % (statement, quote('series_%d' % index)))
+            params.extend(selection_params)
+
+        return self.model.objects.raw(
+            'SELECT * FROM (%s) %s ORDER BY %s' % (' UNION ALL '.join(statements), quote('recent'), quote('date_time')),
+            params,
+            using = self.db,
+        )
+
+    def last_in_ranges(self, ranges, chunk_size = 100):
+        """
+        Select the last measurement in each of a number of time ranges, with a
+        union of one limited selection per time range, such that each range
+        is a single lookup in the time-series index. The queryset should be
+        filtered to a single peripheral device quantity type.
+
+        :param ranges: A list of tuples of the start and (exclusive) end of
+        time ranges.
+        :param chunk_size: The maximum number of time ranges per query.
+        :return: A list of the last measurement in each time range that has
+        measurements, ordered by time.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+
+        measurements = []
+        for offset in range(0, len(ranges), chunk_size):
+            statements = []
+            params = []
+            for (index, (start, end)) in enumerate(ranges[offset:offset + chunk_size]):
+                selection = self.filter(date_time__gte = start, date_time__lt = end).order_by('-date_time')[:1]
+                (statement, selection_params) = selection.query.get_compiler(connection=connection).as_sql()
+                statements.append('SELECT * FROM (%s) %s' % (statement, quote('range_%d' % index)))
+                params.extend(selection_params)
+
+            measurements.extend(self.model.objects.raw(
+                'SELECT * FROM (%s) %s ORDER BY %s' % (' UNION ALL '.join(statements), quote('last'), quote('date_time')),
+                params,
+                using = self.db,
+            ))
+        return measurements
+
+    def first_of_kits(self, kit_ids, limit):
+        """
+        Select the first measurements, by date-time and id, of multiple kits,
+        with a union of one limited selection per kit, such that each kit is
+        a single range scan of its time-series index rather than all
+        measurements of the kits being sorted.
+
+        :param kit_ids: A list of kit ids.
+        :param limit: The maximum number of measurements to select.
+        :return: A list of the first measurements, ordered by date-time and
+        id.
+        """
+        if not kit_ids:
+            return []
+
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+
+        statements = []
+        params = []
+        for (index, kit_id) in enumerate(kit_ids):
+            selection = self.filter(kit_id = kit_id).order_by('date_time', 'pk')[:limit]
+            (statement, selection_params) = selection.query.get_compiler(connection=connection).as_sql()
+            statements.append('SELECT * FROM (%s) %s' % (statement, quote('kit_%d' % index)))
+            params.extend(selection_params)
+
+        return list(self.model.objects.raw(
+            'SELECT * FROM (%s) %s ORDER BY %s, %s LIMIT %%s' % (
+                ' UNION ALL '.join(statements), quote('first'), quote('date_time'), quote(self.model._meta.pk.column),
+            ),
+            params + [limit],
+            using = self.db,
+        ))
+
+    def expanded_values(self):
+        """
+        Iterate over the measurements as dictionaries, like `values()`, with
+        the physical quantities and units of compact measurements filled in.
+        """
+        for values in self.values():
+            if values['physical_quantity'] is None:
+                (values['physical_quantity'], values['physical_unit']) = Measurement.lookup_physical_quantity_and_unit(
+                    values['quantity_type_id'],
+                    values['unregistered_quantity_type_id'],
+                )
+            yield values
+
+
 class Measurement(models.Model):
     """
     Model to hold peripheral device measurements.
+
+    Measurements are idempotent on their kit, peripheral device, quantity
+    type (or unregistered quantity type) and date-time, such that retried
+    publications are stored once. Measurements without a quantity type and
+    without a physical quantity and unit are not deduplicated.
+
+    With the `COMPACT_MEASUREMENTS` setting, the physical quantity and unit
+    strings are not stored, but looked up from the quantity type (or, if the
+    measurement has none, its unregistered quantity type) when measurements
+    are loaded. Existing measurements are compacted by the
+    `compact_measurements` management command.
     """
+    objects = MeasurementQuerySet.as_manager()
+
+    #: The fields not stored in compact mode
+    PHYSICAL_QUANTITY_FIELDS = ('physical_quantity', 'physical_unit')
 
     peripheral = models.ForeignKey(Peripheral, on_delete = models.CASCADE)
     kit = models.ForeignKey(Kit,
@@ -302,3 +763,519 @@ class Measurement(models.Model):
 
     physical_quantity = models.CharField(max_length = 100, null = True)
     physical_unit = models.CharField(max_length = 100, null = True)
+
+    # Set if the physical quantity and unit are not a registered quantity type
+    unregistered_quantity_type = models.ForeignKey(UnregisteredQuantityType, on_delete = models.PROTECT, null = True, blank = True)
+
+    class Meta:
+        # The idempotency key doubles as the index of the time series of a
+        # peripheral device's quantity type. As nulls never conflict, the
+        # measurements of unregistered quantity types have a key of their own
+        unique_together = (
+            ('kit', 'peripheral', 'quantity_type', 'date_time'),
+            ('kit', 'peripheral', 'unregistered_quantity_type', 'date_time'),
+        )
+        indexes = [
+            # Measurements of a kit in a time range
+            models.Index(fields = ['kit', 'date_time'], name = 'measurement_kit_time_idx'),
+        ]
+
+    def idempotency_key(self):
+        """
+        Get the key on which measurements are idempotent.
+
+        :return: A tuple of the kit, peripheral device, quantity type (or
+        physical quantity and unit) and date-time, or None if the measurement
+        has neither a quantity type nor a physical quantity and unit.
+        """
+        if self.quantity_type_id is not None:
+            quantity = self.quantity_type_id
+        elif self.physical_quantity is not None and self.physical_unit is not None:
+            quantity = (self.physical_quantity, self.physical_unit)
+        elif self.unregistered_quantity_type_id is not None:
+            quantity = UnregisteredQuantityType.objects.physical_quantity_and_unit(self.unregistered_quantity_type_id)
+        else:
+            return None
+        return (self.kit_id, self.peripheral_id, quantity, self.date_time)
+
+    @staticmethod
+    def is_compact():
+        """
+        Get whether the physical quantity and unit strings are not stored.
+        """
+        return getattr(settings, 'COMPACT_MEASUREMENTS', False)
+
+    @staticmethod
+    def lookup_physical_quantity_and_unit(quantity_type_id, unregistered_quantity_type_id):
+        """
+        Look up the physical quantity and unit of a compact measurement.
+        """
+        if quantity_type_id is not None:
+            return QuantityType.objects.physical_quantity_and_unit(quantity_type_id)
+        if unregistered_quantity_type_id is not None:
+            return UnregisteredQuantityType.objects.physical_quantity_and_unit(unregistered_quantity_type_id)
+        return (None, None)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        # Deferred fields are left alone
+        loaded = instance.__dict__
+        if loaded.get('physical_quantity', '') is None and 'quantity_type_id' in loaded and 'unregistered_quantity_type_id' in loaded:
+            (instance.physical_quantity, instance.physical_unit) = cls.lookup_physical_quantity_and_unit(
+                instance.quantity_type_id,
+                instance.unregistered_quantity_type_id,
+            )
+        return instance
+
+    def set_unregistered_quantity_type(self):
+        """
+        Set the unregistered quantity type of a measurement without a
+        quantity type from its physical quantity and unit.
+        """
+        if self.quantity_type_id is None and self.unregistered_quantity_type_id is None and self.physical_quantity is not None and self.physical_unit is not None:
+            self.unregistered_quantity_type_id = UnregisteredQuantityType.objects.get_pk(self.physical_quantity, self.physical_unit)
+
+    def compacted(self):
+        """
+        Get a copy of the measurement without the physical quantity and unit
+        strings, to be stored.
+        """
+        measurement = copy.copy(self)
+        measurement.physical_quantity = None
+        measurement.physical_unit = None
+        return measurement
+
+    def save(self, *args, **kwargs):
+        self.set_unregistered_quantity_type()
+        if not self.is_compact():
+            return super().save(*args, **kwargs)
+
+        physical_quantities = (self.physical_quantity, self.physical_unit)
+        (self.physical_quantity, self.physical_unit) = (None, None)
+        try:
+            return super().save(*args, **kwargs)
+        finally:
+            (self.physical_quantity, self.physical_unit) = physical_quantities
+
+class MeasurementRollupQuerySet(models.QuerySet):
+    """
+    AstroPlant MeasurementRollup QuerySet class
+    """
+
+    #: The aggregate columns, and how they are combined when incrementing
+    _COMBINE = [
+        ('count', '%(old)s + %(new)s'),
+        ('min', '%(least)s(%(old)s, %(new)s)'),
+        ('max', '%(greatest)s(%(old)s, %(new)s)'),
+        ('sum', '%(old)s + %(new)s'),
+        ('sum_of_squares', '%(old)s + %(new)s'),
+    ]
+
+    def bulk_increment(self, objs):
+        """
+        Add aggregates to the stored rollups of their buckets, creating the
+        rollups that do not exist yet.
+
+        On database vendors that do not support upserts, the rollups are
+        incremented one by one.
+
+        :param objs: A list of unsaved rollups, at most one per bucket.
+        """
+        if not objs:
+            return
+
+        connection = connections[self.db]
+        upsert = self._upsert_clause(connection)
+        if upsert is None:
+            for obj in objs:
+                self._increment(obj)
+            return
+
+        fields = [field for field in self.model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+        batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                query = sql.InsertQuery(self.model)
+                query.insert_values(fields, objs[start:start + batch_size])
+                for (statement, params) in query.get_compiler(connection=connection).as_sql():
+                    cursor.execute(statement + upsert, params)
+
+    def _upsert_clause(self, connection):
+        """
+        Get the clause turning an insert statement of rollups into an upsert
+        incrementing the existing rollups, or None if the database vendor is
+        not supported.
+        """
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+
+        if connection.vendor == 'mysql':
+            functions = {'least': 'LEAST', 'greatest': 'GREATEST'}
+            clause = ' ON DUPLICATE KEY UPDATE '
+            new = 'VALUES(%s)'
+            old = '%s'
+        elif connection.vendor in ('postgresql', 'sqlite'):
+            if connection.vendor == 'postgresql':
+                functions = {'least': 'LEAST', 'greatest': 'GREATEST'}
+            else:
+                functions = {'least': 'MIN', 'greatest': 'MAX'}
+            key = [self.model._meta.get_field(name).column for name in self.model._meta.unique_together[0]]
+            clause = ' ON CONFLICT (%s) DO UPDATE SET ' % ', '.join(quote(column) for column in key)
+            new = 'EXCLUDED.%s'
+            old = table + '.%s'
+        else:
+            return None
+
+        return clause + ', '.join(
+            '%s = %s' % (quote(column), combine % dict(functions, old=old % quote(column), new=new % quote(column)))
+            for (column, combine) in self._COMBINE
+        )
+
+    def _increment(self, obj):
+        """
+        Add the aggregates of an unsaved rollup to the stored rollup of its
+        bucket.
+        """
+        with transaction.atomic():
+            (rollup, created) = self.select_for_update().get_or_create(
+                kit_id = obj.kit_id,
+                peripheral_id = obj.peripheral_id,
+                quantity_type_id = obj.quantity_type_id,
+                resolution = obj.resolution,
+                bucket = obj.bucket,
+                defaults = {column: getattr(obj, column) for (column, combine) in self._COMBINE},
+            )
+            if not created:
+                rollup.count += obj.count
+                rollup.min = min(rollup.min, obj.min)
+                rollup.max = max(rollup.max, obj.max)
+                rollup.sum += obj.sum
+                rollup.sum_of_squares += obj.sum_of_squares
+                rollup.save()
+
+
+class MeasurementRollup(models.Model):
+    """
+    Model to hold aggregates of the measurements of a peripheral device's
+    quantity type per time bucket, at several resolutions. See
+    `backend.rollups`.
+    """
+    objects = MeasurementRollupQuerySet.as_manager()
+
+    MINUTE = 60
+    HOUR = 60 * 60
+    DAY = 24 * 60 * 60
+
+    #: The resolutions, in seconds
+    RESOLUTIONS = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+
+    kit = models.ForeignKey(Kit,
+                            on_delete = models.CASCADE,
+                            related_name = 'measurement_rollups')
+    peripheral = models.ForeignKey(Peripheral, on_delete = models.CASCADE)
+    quantity_type = models.ForeignKey(QuantityType, on_delete = models.CASCADE)
+
+    resolution = models.PositiveIntegerField(choices = RESOLUTIONS)
+
+    # The start of the bucket, in UTC
+    bucket = models.DateTimeField()
+
+    count = models.PositiveIntegerField()
+    min = models.FloatField()
+    max = models.FloatField()
+    sum = models.FloatField()
+    sum_of_squares = models.FloatField()
+
+    class Meta:
+        unique_together = (('kit', 'peripheral', 'quantity_type', 'resolution', 'bucket'),)
+
+    def mean(self):
+        return self.sum / self.count
+
+    def standard_deviation(self):
+        return math.sqrt(max(0.0, self.sum_of_squares / self.count - self.mean() ** 2))
+
+class LatestMeasurementQuerySet(models.QuerySet):
+    """
+    AstroPlant LatestMeasurement QuerySet class
+    """
+
+    #: The columns replaced by those of a newer measurement
+    _REPLACED = ['measurement_type', 'value']
+
+    def bulk_upsert(self, objs):
+        """
+        Store latest measurements, replacing the stored latest measurements of
+        their series if they are newer.
+
+        On database vendors that do not support upserts, the latest
+        measurements are stored one by one.
+
+        :param objs: A list of unsaved latest measurements, at most one per
+        series.
+        """
+        if not objs:
+            return
+
+        connection = connections[self.db]
+        upsert = self._upsert_clause(connection)
+        if upsert is None:
+            for obj in objs:
+                self._upsert(obj)
+            return
+
+        fields = [field for field in self.model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+        batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                query = sql.InsertQuery(self.model)
+                query.insert_values(fields, objs[start:start + batch_size])
+                for (statement, params) in query.get_compiler(connection=connection).as_sql():
+                    cursor.execute(statement + upsert, params)
+
+    def _upsert_clause(self, connection):
+        """
+        Get the clause turning an insert statement of latest measurements into
+        an upsert replacing older stored latest measurements, or None if the
+        database vendor is not supported.
+        """
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        date_time = quote('date_time')
+
+        if connection.vendor == 'mysql':
+            # Assignments are made from left to right, so the date-time is
+            # replaced last
+            return ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+                ['%s = IF(VALUES(%s) >= %s, VALUES(%s), %s)' % (quote(column), date_time, date_time, quote(column), quote(column)) for column in self._REPLACED]
+                + ['%s = GREATEST(%s, VALUES(%s))' % (date_time, date_time, date_time)]
+            )
+        elif connection.vendor in ('postgresql', 'sqlite'):
+            key = [self.model._meta.get_field(name).column for name in self.model._meta.unique_together[0]]
+            return ' ON CONFLICT (%s) DO UPDATE SET %s WHERE EXCLUDED.%s >= %s.%s' % (
+                ', '.join(quote(column) for column in key),
+                ', '.join('%s = EXCLUDED.%s' % (quote(column), quote(column)) for column in self._REPLACED + ['date_time']),
+                date_time, table, date_time,
+            )
+        else:
+            return None
+
+    def _upsert(self, obj):
+        """
+        Store a latest measurement, if it is newer than the stored latest
+        measurement of its series.
+        """
+        with transaction.atomic():
+            (latest, created) = self.select_for_update().get_or_create(
+                kit_id = obj.kit_id,
+                peripheral_id = obj.peripheral_id,
+                quantity_type_id = obj.quantity_type_id,
+                defaults = {column: getattr(obj, column) for column in self._REPLACED + ['date_time']},
+            )
+            if not created and obj.date_time >= latest.date_time:
+                for column in self._REPLACED + ['date_time']:
+                    setattr(latest, column, getattr(obj, column))
+                latest.save()
+
+class LatestMeasurement(models.Model):
+    """
+    Model to hold the latest measurement of each peripheral device's quantity
+    type of a kit (see `backend.latest`).
+    """
+    objects = LatestMeasurementQuerySet.as_manager()
+
+    kit = models.ForeignKey(Kit,
+                            on_delete = models.CASCADE,
+                            related_name = 'latest_measurements')
+    peripheral = models.ForeignKey(Peripheral, on_delete = models.CASCADE)
+    quantity_type = models.ForeignKey(QuantityType, on_delete = models.CASCADE)
+
+    measurement_type = models.CharField(max_length = 10)
+    date_time = models.DateTimeField()
+    value = models.FloatField()
+
+    class Meta:
+        unique_together = (('kit', 'peripheral', 'quantity_type'),)
+
+    def __str__(self):
+        return "%s of %s at %s" % (self.value, self.peripheral, self.date_time)
+
+class KitRetentionPolicy(models.Model):
+    """
+    Model to hold the retention policy of a kit, overriding the retention
+    configured for the deployment (see `backend.retention`). The number of
+    days measurements and rollups are kept; empty to use the deployment's
+    retention.
+    """
+    kit = models.OneToOneField(Kit,
+                               on_delete = models.CASCADE,
+                               related_name = 'retention_policy')
+
+    raw_days = models.PositiveIntegerField(null = True, blank = True)
+    minute_days = models.PositiveIntegerField(null = True, blank = True)
+    hour_days = models.PositiveIntegerField(null = True, blank = True)
+    day_days = models.PositiveIntegerField(null = True, blank = True)
+
+    def __str__(self):
+        return "Retention policy of %s" % self.kit
+
+
+class RetentionRun(models.Model):
+    """
+    Model to hold the progress and results of runs of the retention purger.
+    """
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    STATES = (
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+
+    started = models.DateTimeField(auto_now_add = True)
+    finished = models.DateTimeField(null = True, blank = True)
+    state = models.CharField(max_length = 10, choices = STATES, default = RUNNING)
+
+    # The table being purged, and the fraction of its primary key range done
+    current_table = models.CharField(max_length = 100, blank = True)
+    progress = models.FloatField(default = 0.0)
+
+    measurements_removed = models.PositiveIntegerField(default = 0)
+    rollups_removed = models.PositiveIntegerField(default = 0)
+
+    class Meta:
+        ordering = ('-started',)
+
+    def __str__(self):
+        return "Retention run of %s (%s)" % (self.started, self.state)
+
+
+class MeasurementArchiveBlock(models.Model):
+    """
+    Model to hold a block of archived measurements of a peripheral device's
+    quantity type in a closed time range. The measurements themselves are
+    stored in files (see `backend.archive`).
+    """
+    kit = models.ForeignKey(Kit,
+                            on_delete = models.CASCADE,
+                            related_name = 'archive_blocks')
+    peripheral = models.ForeignKey(Peripheral, on_delete = models.CASCADE)
+    quantity_type = models.ForeignKey(QuantityType, on_delete = models.CASCADE)
+
+    # The time range [start, end) of the block
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    count = models.PositiveIntegerField()
+
+    physical_quantity = models.CharField(max_length = 100, null = True)
+    physical_unit = models.CharField(max_length = 100, null = True)
+
+    # The directory holding the block's column files, relative to the archive
+    # directory
+    path = models.CharField(max_length = 255)
+
+    class Meta:
+        unique_together = (('kit', 'peripheral', 'quantity_type', 'start'),)
+        ordering = ('start',)
+
+    def __str__(self):
+        return "Archived measurements of %s from %s to %s" % (self.peripheral, self.start, self.end)
+
+
+class KitDeletionJob(models.Model):
+    """
+    Model to hold the progress of the background removal of a kit or its
+    measurements (see `backend.deletion`).
+    """
+    REMOVE_MEASUREMENTS = 'remove_measurements'
+    REMOVE_KIT = 'remove_kit'
+
+    ACTIONS = (
+        (REMOVE_MEASUREMENTS, 'Remove measurements'),
+        (REMOVE_KIT, 'Remove kit'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    STATES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+        (FAILED, 'Failed'),
+    )
+
+    # Null once the kit has been removed
+    kit = models.ForeignKey(Kit,
+                            on_delete = models.SET_NULL,
+                            null = True,
+                            related_name = 'deletion_jobs')
+    kit_name = models.CharField(max_length = 250)
+
+    action = models.CharField(max_length = 20, choices = ACTIONS)
+    state = models.CharField(max_length = 10, choices = STATES, default = PENDING)
+
+    created = models.DateTimeField(auto_now_add = True)
+    finished = models.DateTimeField(null = True, blank = True)
+
+    # Measurements stored after the job was created are kept
+    max_measurement_id = models.IntegerField(null = True, blank = True)
+
+    measurements_total = models.PositiveIntegerField(null = True, blank = True)
+    measurements_deleted = models.PositiveIntegerField(default = 0)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return "%s of %s (%s)" % (self.get_action_display(), self.kit_name, self.state)
+
+    def progress(self):
+        """
+        Get the fraction of the measurements deleted.
+        """
+        if self.state == self.FINISHED:
+            return 1.0
+        if not self.measurements_total:
+            return 0.0
+        return min(1.0, self.measurements_deleted / self.measurements_total)
+
+    def percentage(self):
+        return int(self.progress() * 100)
+
+
+class KitConfiguration(models.Model):
+    """
+    Model to hold the rendered configuration of a kit, such that polls of the
+    configuration do not have to generate it (see `backend.configuration`).
+    """
+    kit = models.OneToOneField(Kit,
+                               on_delete = models.CASCADE,
+                               primary_key = True,
+                               related_name = 'configuration')
+
+    # Bumped whenever any input of the configuration changes
+    version = models.PositiveIntegerField(default = 1)
+
+    # The configuration as JSON, and its hash; null when it has to be
+    # generated again
+    config = models.TextField(null = True, blank = True)
+    hash = models.CharField(max_length = 40, blank = True)
+
+    updated = models.DateTimeField(auto_now = True)
+
+    def __str__(self):
+        return "Configuration of %s (version %s)" % (self.kit, self.version)
@@ -0,0 +1,137 @@
+"""
+Module defining the pagination of measurement listings.
+
+Measurements are paged by keyset (or "cursor"): each page starts after the
+(date-time, id) key of the last measurement of the previous page, rather than
+at an offset, such that fetching a page takes a single range scan of an index
+whatever its position in the history. The time-series indexes of the
+measurements (see `backend.models.Measurement`) end in the date-time, and the
+primary key is implied by the index, so that pages of a kit (or of a
+peripheral device quantity type) are read from an index in order. A page of
+the measurements of multiple kits is selected as a union of a page per kit
+(see `backend.models.MeasurementQuerySet.first_of_kits`).
+
+Archived measurements (see `backend.archive`) have no id; they are listed
+before the measurements in the database, and are paged by (date-time, kit,
+peripheral device, quantity type) instead.
+"""
+
+import base64
+import collections
+
+from django.db.models import Q
+from rest_framework import exceptions, pagination, response
+from rest_framework.compat import coreapi
+from rest_framework.utils.urls import replace_query_param
+
+import backend.archive
+
+
+class MeasurementCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination of measurements, in order of (date-time, id). The view
+    should provide `get_archive_blocks()`, returning a queryset of the
+    archive blocks of the measurements it lists, and may provide
+    `get_time_range()`, returning the start and end of the time range of the
+    measurements it lists, and `get_page_kits()`, returning the ids of the
+    kits of the measurements it lists.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    #: The default and maximum number of measurements per page
+    page_size = 100
+    max_page_size = 1000
+
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        (since, until) = view.get_time_range() if hasattr(view, 'get_time_range') else (None, None)
+
+        page = []
+        if cursor is None or cursor[0] == 'a':
+            after = None if cursor is None else cursor[1:]
+            page = backend.archive.page(view.get_archive_blocks(), after, self.page_size + 1, since, until)
+            cursor = None
+
+        if len(page) <= self.page_size:
+            measurements = self.get_page_queryset(queryset, cursor)
+            limit = self.page_size + 1 - len(page)
+            kits = view.get_page_kits() if hasattr(view, 'get_page_kits') else None
+            if kits is not None and len(kits) > 1:
+                page += measurements.first_of_kits(kits, limit)
+            else:
+                page += list(measurements[:limit])
+
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.last = page[-1] if page else None
+        return page
+
+    def get_page_queryset(self, queryset, cursor):
+        """
+        Get the measurements in the database from a cursor on, in order.
+
+        :param cursor: A decoded cursor of a measurement (see
+        `decode_cursor`), or None to start at the first measurement.
+        """
+        measurements = queryset.order_by('date_time', 'pk')
+        if cursor is not None:
+            (_, date_time, pk) = cursor
+            measurements = measurements.filter(date_time__gte=date_time).filter(Q(date_time__gt=date_time) | Q(pk__gt=pk))
+        return measurements
+
+    def get_paginated_response(self, data):
+        return response.Response(collections.OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        if self.last.pk is None:
+            cursor = ['a', backend.archive.to_microseconds(self.last.date_time), self.last.kit_id, self.last.peripheral_id, self.last.quantity_type_id]
+        else:
+            cursor = ['m', backend.archive.to_microseconds(self.last.date_time), self.last.pk]
+        encoded = base64.urlsafe_b64encode(':'.join(str(part) for part in cursor).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor of a request.
+
+        :return: A tuple of 'a' (for an archived measurement), the date-time,
+        and the kit, peripheral device and quantity type ids; or of 'm', the
+        date-time and the id; or None if there is no cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            parts = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split(':')
+            if parts[0] == 'a' and len(parts) == 5 or parts[0] == 'm' and len(parts) == 3:
+                return (parts[0], backend.archive.from_microseconds(int(parts[1]))) + tuple(int(part) for part in parts[2:])
+        except (TypeError, ValueError):
+            pass
+        raise exceptions.NotFound(self.invalid_cursor_message)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(name=self.cursor_query_param, required=False, location='query'),
+            coreapi.Field(name=self.page_size_query_param, required=False, location='query'),
+        ]
@@ -32,8 +32,11 @@ class IsMeasurementOwner(permissions.BasePermission):
 
 class IsNotCreationOrIsAuthenticatedKit(permissions.BasePermission):
 
+    #: The view actions creating objects
+    CREATION_ACTIONS = ('create', 'bulk')
+
     def has_permission(self, request, view):
-        if view.action != 'create':
+        if view.action not in self.CREATION_ACTIONS:
             return True
         else:
             return request.user.is_authenticated() and isinstance(request.user, models.Kit)
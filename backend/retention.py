@@ -0,0 +1,212 @@
+"""
+Module defining the retention of measurements and rollups.
+
+The number of days measurements and rollups (per resolution) are kept is
+configured for the deployment by the `MEASUREMENT_RETENTION` setting, e.g.:
+
+    MEASUREMENT_RETENTION = {
+        'RAW': 30,
+        'MINUTE': 90,
+        'HOUR': None,
+        'DAY': None,
+        'CHUNK_SIZE': 5000,
+        'CHUNK_DELAY': 100,
+    }
+
+None keeps the rows forever. Kits can override the deployment's retention
+with a `backend.models.KitRetentionPolicy`. The `RAW` retention applies to
+archived measurements (see `backend.archive`) as well; archive blocks are
+removed once all of their time range has expired.
+
+Expired rows are removed by `purge` (see the `purge_measurements` management
+command, which is meant to be run periodically). Tables are purged in chunks
+of `CHUNK_SIZE` consecutive primary keys, each in its own short transaction,
+with a pause of `CHUNK_DELAY` milliseconds in between, such that the purger
+never holds locks on large parts of a table. The progress and results of
+each run are recorded in a `backend.models.RetentionRun`.
+"""
+
+import collections
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+import backend.models
+
+#: The default configuration
+DEFAULT_CONFIGURATION = {
+    'RAW': None,
+    'MINUTE': None,
+    'HOUR': None,
+    'DAY': None,
+    'CHUNK_SIZE': 5000,
+    'CHUNK_DELAY': 100,
+}
+
+#: The kinds of rows kept for a configurable time, as tuples of the
+#: configuration key, the field of `KitRetentionPolicy`, the model, its time
+#: field, and the filter selecting the rows
+PERIODS = (
+    ('RAW', 'raw_days', backend.models.Measurement, 'date_time', {}),
+    ('MINUTE', 'minute_days', backend.models.MeasurementRollup, 'bucket', {'resolution': backend.models.MeasurementRollup.MINUTE}),
+    ('HOUR', 'hour_days', backend.models.MeasurementRollup, 'bucket', {'resolution': backend.models.MeasurementRollup.HOUR}),
+    ('DAY', 'day_days', backend.models.MeasurementRollup, 'bucket', {'resolution': backend.models.MeasurementRollup.DAY}),
+)
+
+
+def get_configuration():
+    """
+    Get the retention configuration of the deployment.
+    """
+    return dict(DEFAULT_CONFIGURATION, **getattr(settings, 'MEASUREMENT_RETENTION', {}))
+
+
+def expired(key, policy_field, time_field, now = None):
+    """
+    Get the condition selecting expired rows.
+
+    :param key: The configuration key of the rows' retention.
+    :param policy_field: The field of `KitRetentionPolicy` overriding the
+    retention.
+    :param time_field: The time field of the rows.
+    :return: A `Q` object, or None if no rows expire.
+    """
+    now = now or timezone.now()
+    default_days = get_configuration()[key]
+
+    kits_by_days = collections.defaultdict(list)
+    for (kit_id, days) in backend.models.KitRetentionPolicy.objects.exclude(**{policy_field: None}).values_list('kit_id', policy_field):
+        kits_by_days[days].append(kit_id)
+
+    conditions = []
+    if default_days is not None:
+        overridden = [kit_id for kit_ids in kits_by_days.values() for kit_id in kit_ids]
+        conditions.append(~Q(kit_id__in = overridden) & Q(**{'%s__lt' % time_field: now - datetime.timedelta(days=default_days)}))
+
+    for (days, kit_ids) in kits_by_days.items():
+        conditions.append(Q(kit_id__in = kit_ids) & Q(**{'%s__lt' % time_field: now - datetime.timedelta(days=days)}))
+
+    if not conditions:
+        return None
+
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition |= other
+    return condition
+
+
+def raw_cutoff(kit = None, now = None):
+    """
+    Get the time before which measurements may have been purged.
+
+    :param kit: The kit (or kit id), or None for the most recent time of all
+    kits.
+    :return: The time, or None if measurements are kept forever.
+    """
+    now = now or timezone.now()
+    default_days = get_configuration()['RAW']
+
+    policies = backend.models.KitRetentionPolicy.objects.exclude(raw_days = None)
+    if kit is not None:
+        days = policies.filter(kit = kit).values_list('raw_days', flat=True).first()
+        if days is None:
+            days = default_days
+    else:
+        days = min([days for days in [default_days] + list(policies.values_list('raw_days', flat=True)) if days is not None], default=None)
+
+    if days is None:
+        return None
+    return now - datetime.timedelta(days=days)
+
+
+def purge(chunk_size = None, chunk_delay = None, now = None):
+    """
+    Remove expired measurements and rollups.
+
+    :param chunk_size: The number of consecutive primary keys removed at once.
+    Defaults to the configured `CHUNK_SIZE`.
+    :param chunk_delay: The pause between chunks in seconds. Defaults to the
+    configured `CHUNK_DELAY`.
+    :return: The `backend.models.RetentionRun` recording the run.
+    """
+    configuration = get_configuration()
+    if chunk_size is None:
+        chunk_size = configuration['CHUNK_SIZE']
+    if chunk_delay is None:
+        chunk_delay = configuration['CHUNK_DELAY'] / 1000.0
+    now = now or timezone.now()
+
+    run = backend.models.RetentionRun.objects.create()
+    try:
+        for (key, policy_field, model, time_field, filters) in PERIODS:
+            condition = expired(key, policy_field, time_field, now = now)
+            if condition is None:
+                continue
+
+            run.current_table = "%s (%s)" % (model._meta.db_table, key.lower())
+            run.progress = 0.0
+            run.save()
+
+            def on_chunk(removed, progress):
+                if model is backend.models.Measurement:
+                    run.measurements_removed += removed
+                else:
+                    run.rollups_removed += removed
+                run.progress = progress
+                run.save()
+
+            purge_table(model, condition & Q(**filters), chunk_size, chunk_delay, on_chunk)
+
+        condition = expired('RAW', 'raw_days', 'end', now = now)
+        if condition is not None:
+            blocks = backend.models.MeasurementArchiveBlock.objects.filter(condition)
+            run.measurements_removed += sum(blocks.values_list('count', flat=True))
+            blocks.delete()
+
+        run.state = backend.models.RetentionRun.FINISHED
+    except Exception:
+        run.state = backend.models.RetentionRun.FAILED
+        raise
+    finally:
+        run.finished = timezone.now()
+        run.save()
+
+    return run
+
+
+def purge_table(model, condition, chunk_size, chunk_delay, on_chunk = None):
+    """
+    Remove the rows of a table matching a condition, in chunks of consecutive
+    primary keys, each in its own transaction.
+
+    :param on_chunk: Function called after each chunk with the number of rows
+    removed in the chunk, and the fraction of the primary key range done.
+    :return: The number of rows removed.
+    """
+    bounds = model.objects.aggregate(first = Min('pk'), last = Max('pk'))
+    if bounds['first'] is None:
+        return 0
+
+    first = bounds['first']
+    last = bounds['last']
+
+    removed = 0
+    start = first
+    while start <= last:
+        end = start + chunk_size
+        with transaction.atomic():
+            (chunk_removed, _) = model.objects.filter(condition, pk__gte = start, pk__lt = end).delete()
+        removed += chunk_removed
+
+        if on_chunk is not None:
+            on_chunk(chunk_removed, min(1.0, (end - first) / (last - first + 1)))
+
+        start = end
+        if chunk_delay and start <= last:
+            time.sleep(chunk_delay)
+
+    return removed
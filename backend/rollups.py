@@ -0,0 +1,378 @@
+"""
+Module defining the maintenance and querying of measurement rollups.
+
+Rollups (see `backend.models.MeasurementRollup`) hold the count, minimum,
+maximum, sum and sum of squares of the measurements of a peripheral device's
+quantity type per minute, hour and day (in UTC). They are incremented when
+measurements are inserted through `insert_measurements`, and can be rebuilt
+from the stored measurements with `rebuild`, e.g. after measurements have
+been backfilled by other means (see the `rebuild_rollups` management
+command).
+
+Series of arbitrary bucket widths are aggregated from the rollups with
+`bucketed_series`, backing the series API.
+
+Measurements without a quantity type are not rolled up.
+"""
+
+import collections
+import datetime
+
+from django.db import transaction
+from django.db.models import Max, Min
+
+import backend.archive
+import backend.models
+import backend.retention
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+#: The resolutions, from coarsest to finest
+RESOLUTIONS = (
+    backend.models.MeasurementRollup.DAY,
+    backend.models.MeasurementRollup.HOUR,
+    backend.models.MeasurementRollup.MINUTE,
+)
+
+_DAY = datetime.timedelta(seconds=backend.models.MeasurementRollup.DAY)
+
+#: The aggregate functions of bucketed series
+AGGREGATES = ('mean', 'min', 'max', 'count', 'last')
+
+
+def bucket(date_time, resolution):
+    """
+    Get the start of the bucket of a date-time at a resolution.
+
+    :param date_time: An aware date-time.
+    :param resolution: The resolution in seconds.
+    """
+    seconds = (date_time - _EPOCH) // datetime.timedelta(seconds=1)
+    return _EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+
+def aggregate(rows):
+    """
+    Aggregate measurements into rollups at all resolutions.
+
+    :param rows: An iterable of tuples of the kit, peripheral device and
+    quantity type ids, the date-time and the value of measurements.
+    :return: A list of unsaved rollups, one per bucket.
+    """
+    aggregates = collections.OrderedDict()
+    for (kit_id, peripheral_id, quantity_type_id, date_time, value) in rows:
+        if quantity_type_id is None:
+            continue
+
+        for resolution in RESOLUTIONS:
+            key = (kit_id, peripheral_id, quantity_type_id, resolution, bucket(date_time, resolution))
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregates[key] = [1, value, value, value, value * value]
+            else:
+                aggregate[0] += 1
+                aggregate[1] = min(aggregate[1], value)
+                aggregate[2] = max(aggregate[2], value)
+                aggregate[3] += value
+                aggregate[4] += value * value
+
+    return [
+        backend.models.MeasurementRollup(
+            kit_id = kit_id,
+            peripheral_id = peripheral_id,
+            quantity_type_id = quantity_type_id,
+            resolution = resolution,
+            bucket = bucket_start,
+            count = count,
+            min = minimum,
+            max = maximum,
+            sum = total,
+            sum_of_squares = total_of_squares,
+        )
+        for ((kit_id, peripheral_id, quantity_type_id, resolution, bucket_start), (count, minimum, maximum, total, total_of_squares)) in aggregates.items()
+    ]
+
+
+def insert_measurements(measurements, batch_size = None):
+    """
+    Insert measurements in bulk, skipping duplicates (see
+    `backend.models.MeasurementQuerySet.bulk_create_ignoring_duplicates`), and
+    increment the rollups with the measurements inserted, in a single
+    transaction.
+
+    Duplicates are rare, so the measurements are first inserted as if there
+    are none. If there are, that is rolled back, and the measurements that
+    have not been stored yet are looked up and inserted instead.
+
+    :param measurements: A list of unsaved measurements.
+    :param batch_size: The maximum number of measurements per statement.
+    :return: The number of measurements inserted.
+    """
+    # Set outside of any rolled back savepoint, as the unregistered quantity
+    # types are cached in-process
+    for measurement in measurements:
+        measurement.set_unregistered_quantity_type()
+
+    with transaction.atomic():
+        if not _insert_all(measurements, batch_size):
+            measurements = _not_stored(measurements)
+            if not _insert_all(measurements, batch_size):
+                # Some were stored concurrently in the meantime
+                measurements = [
+                    measurement for measurement in measurements
+                    if backend.models.Measurement.objects.bulk_create_ignoring_duplicates([measurement])
+                ]
+
+        backend.models.MeasurementRollup.objects.bulk_increment(aggregate(
+            (m.kit_id, m.peripheral_id, m.quantity_type_id, m.date_time, m.value) for m in measurements
+        ))
+
+    return len(measurements)
+
+
+def _insert_all(measurements, batch_size):
+    """
+    Insert measurements in bulk, unless any of them is a duplicate.
+
+    :return: Whether the measurements were inserted.
+    """
+    try:
+        with transaction.atomic():
+            if backend.models.Measurement.objects.bulk_create_ignoring_duplicates(measurements, batch_size=batch_size) != len(measurements):
+                raise _Duplicates()
+    except _Duplicates:
+        return False
+    return True
+
+
+class _Duplicates(Exception):
+    """
+    Raised to roll back the insertion of measurements of which some are
+    duplicates.
+    """
+
+
+def _not_stored(measurements):
+    """
+    Select the measurements of which the idempotency key has not been stored,
+    nor occurs earlier in the list.
+    """
+    def key(kit_id, peripheral_id, quantity_type_id, unregistered_quantity_type_id, date_time):
+        if quantity_type_id is None and unregistered_quantity_type_id is None:
+            return None
+        return (kit_id, peripheral_id, quantity_type_id, unregistered_quantity_type_id, date_time)
+
+    seen = set(
+        key(*row) for row in backend.models.Measurement.objects.filter(
+            kit_id__in = set(m.kit_id for m in measurements),
+            date_time__in = set(m.date_time for m in measurements),
+        ).values_list('kit_id', 'peripheral_id', 'quantity_type_id', 'unregistered_quantity_type_id', 'date_time')
+    )
+
+    selected = []
+    for m in measurements:
+        measurement_key = key(m.kit_id, m.peripheral_id, m.quantity_type_id, m.unregistered_quantity_type_id, m.date_time)
+        if measurement_key is None or measurement_key not in seen:
+            seen.add(measurement_key)
+            selected.append(m)
+    return selected
+
+
+def rebuild(kit = None, since = None, until = None):
+    """
+    Rebuild rollups from the stored measurements, one day at a time (each in
+    its own transaction).
+
+    Days of which measurements may have been purged (see `backend.retention`)
+    or archived (see `backend.archive`) are not rebuilt, as their rollups
+    would be incomplete.
+
+    :param kit: The kit (or kit id) to rebuild the rollups of, or None for all
+    kits.
+    :param since: The date-time from which to rebuild, rounded down to the
+    start of its day, or None to start at the first measurement.
+    :param until: The date-time until which to rebuild, rounded up to the end
+    of its day, or None to end at the last measurement.
+    :return: The number of rollups created.
+    """
+    measurements = backend.models.Measurement.objects.exclude(quantity_type = None)
+    rollups = backend.models.MeasurementRollup.objects.all()
+    if kit is not None:
+        measurements = measurements.filter(kit = kit)
+        rollups = rollups.filter(kit = kit)
+
+    if since is None or until is None:
+        bounds = measurements.aggregate(first = Min('date_time'), last = Max('date_time'))
+        if bounds['first'] is None:
+            return 0
+        since = since or bounds['first']
+        until = until or bounds['last'] + datetime.timedelta(microseconds=1)
+
+    day = bucket(since, backend.models.MeasurementRollup.DAY)
+
+    cutoff = backend.retention.raw_cutoff(kit)
+    if cutoff is not None:
+        day = max(day, bucket(cutoff, backend.models.MeasurementRollup.DAY) + _DAY)
+
+    archived = backend.archive.archived_until(kit)
+    if archived is not None:
+        day = max(day, bucket(archived - datetime.timedelta(microseconds=1), backend.models.MeasurementRollup.DAY) + _DAY)
+
+    created = 0
+    while day < until:
+        with transaction.atomic():
+            rollups.filter(bucket__gte = day, bucket__lt = day + _DAY).delete()
+
+            rows = measurements.filter(
+                date_time__gte = day,
+                date_time__lt = day + _DAY,
+            ).values_list('kit_id', 'peripheral_id', 'quantity_type_id', 'date_time', 'value')
+            objs = aggregate(rows.iterator())
+            backend.models.MeasurementRollup.objects.bulk_create(objs, batch_size=1000)
+
+        created += len(objs)
+        day += _DAY
+
+    return created
+
+
+def select_resolution(since, until, points):
+    """
+    Select the coarsest resolution that has at least the requested number of
+    buckets in a time range.
+
+    :param since: The start of the time range.
+    :param until: The end of the time range.
+    :param points: The requested number of points.
+    :return: The resolution in seconds, or None if even the finest resolution
+    has too few buckets, in which case the measurements themselves should be
+    used.
+    """
+    seconds = (until - since).total_seconds()
+    for resolution in RESOLUTIONS:
+        if seconds / resolution >= points:
+            return resolution
+    return None
+
+
+def series(kit, peripheral, quantity_type, since, until, points):
+    """
+    Get the measurements of a peripheral device's quantity type in a time range,
+    at the coarsest resolution meeting a requested number of points (see
+    `select_resolution`).
+
+    :return: A tuple of the resolution in seconds (None for raw measurements),
+    and a queryset of the rollups or measurements in the time range, ordered
+    by time.
+    """
+    resolution = select_resolution(since, until, points)
+    if resolution is None:
+        return (None, backend.models.Measurement.objects.filter(
+            kit = kit,
+            peripheral = peripheral,
+            quantity_type = quantity_type,
+            date_time__gte = since,
+            date_time__lt = until,
+        ).order_by('date_time'))
+
+    return (resolution, backend.models.MeasurementRollup.objects.filter(
+        kit = kit,
+        peripheral = peripheral,
+        quantity_type = quantity_type,
+        resolution = resolution,
+        bucket__gte = bucket(since, resolution),
+        bucket__lt = until,
+    ).order_by('bucket'))
+
+
+def bucketed_series(kit, peripheral, quantity_type, since, until, width, aggregates):
+    """
+    Aggregate the measurements of a peripheral device's quantity type in a time
+    range into buckets of a width. The buckets are aggregated from the rollups
+    at the coarsest resolution dividing the width, such that the number of
+    rows read grows with the number of buckets rather than the number of
+    measurements.
+
+    The buckets are aligned to multiples of the width since the epoch (in UTC);
+    all buckets overlapping the time range are aggregated, and buckets without
+    measurements are left out. The last measurement of each bucket is not
+    rolled up, and is looked up in the measurements (or the archive) instead,
+    with one indexed lookup per bucket.
+
+    :param since: The start of the time range.
+    :param until: The (exclusive) end of the time range.
+    :param width: The width of the buckets in seconds, a multiple of the finest
+    resolution.
+    :param aggregates: A list of the aggregate functions to compute (see
+    `AGGREGATES`).
+    :return: A dictionary of `bucket` to a list of the starts of the buckets,
+    and of each aggregate function to a list of its values per bucket.
+    """
+    resolution = next((resolution for resolution in RESOLUTIONS if width % resolution == 0), None)
+    if resolution is None:
+        raise ValueError("The bucket width must be a multiple of %d seconds." % RESOLUTIONS[-1])
+
+    rows = backend.models.MeasurementRollup.objects.filter(
+        kit = kit,
+        peripheral = peripheral,
+        quantity_type = quantity_type,
+        resolution = resolution,
+        bucket__gte = bucket(since, width),
+        bucket__lt = until,
+    ).order_by('bucket').values_list('bucket', 'count', 'min', 'max', 'sum')
+
+    buckets = collections.OrderedDict()
+    for (rollup_bucket, count, minimum, maximum, total) in rows.iterator():
+        key = bucket(rollup_bucket, width)
+        aggregate = buckets.get(key)
+        if aggregate is None:
+            buckets[key] = [count, minimum, maximum, total]
+        else:
+            aggregate[0] += count
+            aggregate[1] = min(aggregate[1], minimum)
+            aggregate[2] = max(aggregate[2], maximum)
+            aggregate[3] += total
+
+    columns = collections.OrderedDict([('bucket', list(buckets))])
+    for name in aggregates:
+        if name == 'mean':
+            columns[name] = [total / count for (count, _, _, total) in buckets.values()]
+        elif name == 'min':
+            columns[name] = [minimum for (_, minimum, _, _) in buckets.values()]
+        elif name == 'max':
+            columns[name] = [maximum for (_, _, maximum, _) in buckets.values()]
+        elif name == 'count':
+            columns[name] = [count for (count, _, _, _) in buckets.values()]
+        elif name == 'last':
+            columns[name] = _last_values(kit, peripheral, quantity_type, list(buckets), width)
+        else:
+            raise ValueError("Unknown aggregate function: %s" % name)
+
+    return columns
+
+
+def _last_values(kit, peripheral, quantity_type, starts, width):
+    """
+    Get the value of the last measurement in each of a number of buckets.
+    """
+    length = datetime.timedelta(seconds=width)
+    ranges = [(start, start + length) for start in starts]
+
+    last = {
+        bucket(measurement.date_time, width): measurement.value
+        for measurement in backend.models.Measurement.objects.filter(
+            kit = kit,
+            peripheral = peripheral,
+            quantity_type = quantity_type,
+        ).last_in_ranges(ranges)
+    }
+
+    archived = backend.archive.archived_until(kit)
+    if archived is not None:
+        for (start, end) in ranges:
+            if start not in last and start < archived:
+                measurements = backend.archive.series(kit, peripheral, quantity_type, since = start, until = end, last = 1)
+                if measurements:
+                    last[start] = measurements[-1].value
+
+    return [last.get(start) for start in starts]
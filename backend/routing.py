@@ -9,8 +9,8 @@ import backend.consumers
 application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(backend.middleware.JWTAuthMiddleware(
         URLRouter([
-            url(r"^measurements/subscribe/(?P<kit_name>[\.a-z0-9]+)/$", backend.consumers.MeasurementSubscribeConsumer),
-            url(r"^kit/$", backend.consumers.KitConsumer),
+            url(r"^measurements/subscribe/(?P<kit_name>[\.a-z0-9]+)/$", backend.consumers.AsyncMeasurementSubscribeConsumer),
+            url(r"^kit/$", backend.consumers.AsyncKitConsumer),
         ])
     )),
 })
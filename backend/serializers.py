@@ -40,13 +40,19 @@ class HyperlinkedPeripheralSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = models.Peripheral
-        fields = ('url', 'kit', 'peripheral_definition', 'name', 'active', 'date_time_added', 'date_time_removed', 'peripheral_configurations')
+        fields = ('url', 'kit', 'peripheral_definition', 'name', 'active', 'date_time_added', 'peripheral_configurations')
 
 class HyperlinkedMeasurementSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = models.Measurement
         fields = ('url', 'id', 'peripheral', 'date_time', 'value')
 
+class AcceptedMeasurementSerializer(serializers.HyperlinkedModelSerializer):
+    # A measurement accepted to be written behind has no url or id yet
+    class Meta:
+        model = models.Measurement
+        fields = ('peripheral', 'date_time', 'value')
+
 class MeasurementSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Measurement
@@ -56,3 +62,11 @@ class MeasurementOutputSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Measurement
         fields = ('peripheral', 'quantity_type', 'physical_quantity', 'physical_unit', 'value', 'date_time')
+
+class LatestMeasurementSerializer(serializers.ModelSerializer):
+    physical_quantity = serializers.CharField(source='quantity_type.physical_quantity', read_only=True)
+    physical_unit = serializers.CharField(source='quantity_type.physical_unit', read_only=True)
+
+    class Meta:
+        model = models.LatestMeasurement
+        fields = ('kit', 'peripheral', 'quantity_type', 'physical_quantity', 'physical_unit', 'measurement_type', 'value', 'date_time')
@@ -0,0 +1,185 @@
+"""
+Module defining signal receivers of the backend.
+
+Consumers of kits cache data derived from the kits' peripheral devices,
+peripheral device definitions and quantity types. The receivers in this
+module notify those consumers over the channel layer when such data changes.
+
+The rendered configurations of kits (see `backend.configuration`) are
+invalidated when any of their inputs change, and the kits' consumers are
+notified, such that they push the new configurations to the kits.
+
+The in-process cache of the physical quantities and units of quantity types
+(see `backend.models.QuantityTypeManager`) is cleared when they change, and
+the files of archived measurement blocks are removed along with the blocks.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+import backend.archive
+import backend.configuration
+import backend.models
+
+
+def kit_resolution_group(kit_username):
+    """
+    Get the name of the channel layer group notified when the measurement
+    resolution data of a kit changes.
+    """
+    return "kit-resolution-%s" % kit_username
+
+
+def invalidate_kit_resolution(kit_usernames):
+    """
+    Notify the consumers of the given kits that their measurement resolution
+    data has changed. The notification is sent once the current transaction
+    (if any) is committed.
+
+    :param kit_usernames: An iterable of usernames of kits.
+    """
+    kit_usernames = set(kit_usernames)
+    if not kit_usernames:
+        return
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def send():
+        for kit_username in kit_usernames:
+            async_to_sync(channel_layer.group_send)(
+                kit_resolution_group(kit_username),
+                {'type': 'kit.resolution.invalidate'}
+            )
+
+    transaction.on_commit(send)
+
+
+def kit_config_group(kit_pk):
+    """
+    Get the name of the channel layer group notified when the configuration
+    of a kit changes.
+    """
+    return "kit-config-%s" % kit_pk
+
+
+def invalidate_kit_configuration(kit_pks):
+    """
+    Invalidate the rendered configurations of the given kits, and notify
+    their consumers once the current transaction (if any) is committed.
+
+    :param kit_pks: An iterable of ids of kits.
+    """
+    kit_pks = set(kit_pks)
+    if not kit_pks:
+        return
+
+    backend.configuration.invalidate(kit_pks)
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def send():
+        for kit_pk in kit_pks:
+            async_to_sync(channel_layer.group_send)(
+                kit_config_group(kit_pk),
+                {'type': 'kit.config.changed'}
+            )
+
+    transaction.on_commit(send)
+
+
+def _kit_usernames_of_definitions(peripheral_definition_pks):
+    return backend.models.Kit.objects.filter(
+        peripherals__peripheral_definition__in=peripheral_definition_pks
+    ).values_list('username', flat=True).distinct()
+
+
+def _kit_pks_of_definitions(peripheral_definition_pks):
+    return list(backend.models.Kit.objects.filter(
+        peripherals__peripheral_definition__in=peripheral_definition_pks
+    ).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_save, sender=backend.models.Kit)
+def kit_changed(sender, instance, update_fields, **kwargs):
+    # Of the kit itself, only its serial (username) and name are configured
+    if update_fields is not None and not {'username', 'name'} & set(update_fields):
+        return
+    invalidate_kit_configuration([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=backend.models.Peripheral)
+def peripheral_changed(sender, instance, **kwargs):
+    invalidate_kit_resolution([instance.kit.username])
+    invalidate_kit_configuration([instance.kit_id])
+
+
+@receiver(post_save, sender=backend.models.PeripheralDefinition)
+def peripheral_definition_changed(sender, instance, **kwargs):
+    # Deleting a peripheral device definition deletes its peripheral devices,
+    # which is handled by `peripheral_changed`
+    invalidate_kit_resolution(_kit_usernames_of_definitions([instance.pk]))
+    invalidate_kit_configuration(_kit_pks_of_definitions([instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=backend.models.PeripheralConfigurationDefinition)
+def peripheral_configuration_definition_changed(sender, instance, **kwargs):
+    invalidate_kit_configuration(_kit_pks_of_definitions([instance.peripheral_definition_id]))
+
+
+@receiver([post_save, post_delete], sender=backend.models.PeripheralConfiguration)
+def peripheral_configuration_changed(sender, instance, **kwargs):
+    invalidate_kit_configuration(
+        backend.models.Peripheral.objects.filter(pk=instance.peripheral_id).values_list('kit_id', flat=True)
+    )
+
+
+@receiver([post_save, pre_delete], sender=backend.models.QuantityType)
+def quantity_type_changed(sender, instance, **kwargs):
+    # On deletion, the quantity type has to be handled before it is removed
+    # from the peripheral device definitions
+    peripheral_definition_pks = list(backend.models.PeripheralDefinition.objects.filter(
+        quantity_types=instance
+    ).values_list('pk', flat=True))
+    invalidate_kit_resolution(_kit_usernames_of_definitions(peripheral_definition_pks))
+    invalidate_kit_configuration(_kit_pks_of_definitions(peripheral_definition_pks))
+
+
+@receiver([post_save, post_delete], sender=backend.models.QuantityType)
+def quantity_type_saved(sender, instance, **kwargs):
+    backend.models.QuantityType.objects.clear_cache()
+
+
+@receiver(m2m_changed, sender=backend.models.PeripheralDefinition.quantity_types.through)
+def peripheral_definition_quantity_types_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        # The instance is a peripheral device definition
+        peripheral_definition_pks = [instance.pk]
+    elif pk_set:
+        # The instance is a quantity type, and the primary key set holds the
+        # peripheral device definitions added or removed
+        peripheral_definition_pks = list(pk_set)
+    elif action == 'pre_clear':
+        # The instance is a quantity type being removed from all peripheral
+        # device definitions, which are only known before the clear
+        peripheral_definition_pks = list(instance.peripheraldefinition_set.values_list('pk', flat=True))
+    else:
+        return
+
+    invalidate_kit_resolution(_kit_usernames_of_definitions(peripheral_definition_pks))
+    invalidate_kit_configuration(_kit_pks_of_definitions(peripheral_definition_pks))
+
+
+@receiver(post_delete, sender=backend.models.MeasurementArchiveBlock)
+def archive_block_removed(sender, instance, **kwargs):
+    path = instance.path
+    transaction.on_commit(lambda: backend.archive.remove(path))
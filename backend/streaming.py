@@ -0,0 +1,152 @@
+"""
+Module defining streaming responses of API list endpoints.
+
+Django REST framework renders the complete list of a list endpoint at once,
+such that the memory used grows with the size of the list. With the
+`StreamingListMixin`, a list endpoint streams its items instead when asked to
+by a `stream` query parameter (`?stream=1`, or `?stream=csv`) or by an
+`Accept: text/csv` header: the rows are fetched in chunks (see `iterate`),
+and each item is serialized and written as a JSON array element or a CSV line
+as it is produced.
+
+Streamed lists are not paginated. Errors raised after the response has
+started cannot change its status, and end the response early.
+"""
+
+import csv
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.utils import encoders
+
+#: The number of rows fetched at once when iterating over a queryset
+CHUNK_SIZE = 1000
+
+#: The number of items written at once when streaming
+WRITE_SIZE = 100
+
+
+def iterate(queryset, ordering = ('pk',), chunk_size = CHUNK_SIZE):
+    """
+    Iterate over a queryset in chunks, each chunk starting after the last row
+    of the previous chunk (by keyset), such that only a chunk of rows is in
+    memory at once, whatever the database driver.
+
+    :param ordering: The fields to order the rows by; together they must be
+    unique, e.g. end in the primary key.
+    """
+    queryset = queryset.order_by(*ordering)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+
+        last = [getattr(chunk[-1], field) for field in ordering]
+        after = Q()
+        for (index, field) in enumerate(ordering):
+            after |= Q(**dict(zip(ordering[:index], last[:index]), **{'%s__gt' % field: last[index]}))
+        chunk = list(queryset.filter(after)[:chunk_size])
+
+
+class Echo:
+    """
+    A file-like object returning what is written to it, to write CSV lines
+    one at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def json_lines(items):
+    """
+    Generate the parts of a JSON array of items.
+    """
+    yield '['
+    parts = []
+    for (index, item) in enumerate(items):
+        parts.append(('' if index == 0 else ',') + json.dumps(item, cls=encoders.JSONEncoder, ensure_ascii=False))
+        if len(parts) >= WRITE_SIZE:
+            yield ''.join(parts)
+            parts = []
+    parts.append(']')
+    yield ''.join(parts)
+
+
+def csv_lines(items):
+    """
+    Generate the lines of a CSV table of items, with a header of the keys of
+    the first item. Nested values are written as JSON.
+    """
+    writer = csv.writer(Echo())
+    header = None
+    lines = []
+    for item in items:
+        if header is None:
+            header = list(item.keys())
+            lines.append(writer.writerow(header))
+
+        lines.append(writer.writerow([
+            '' if item.get(key) is None
+            else json.dumps(item[key], cls=encoders.JSONEncoder, ensure_ascii=False) if isinstance(item[key], (dict, list))
+            else item[key]
+            for key in header
+        ]))
+        if len(lines) >= WRITE_SIZE:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+class StreamingListMixin(object):
+    """
+    Stream the list of a list endpoint when asked to (see the module
+    documentation).
+    """
+
+    #: The fields to order the streamed rows by, together unique
+    stream_ordering = ('pk',)
+
+    def get_stream_format(self, request):
+        """
+        Get the format to stream the list in.
+
+        :return: 'json', 'csv', or None to not stream the list.
+        """
+        stream = request.query_params.get('stream')
+        if stream == 'csv' or 'text/csv' in request.META.get('HTTP_ACCEPT', ''):
+            return 'csv'
+        if stream in ('1', 'true', 'json'):
+            return 'json'
+        return None
+
+    def perform_content_negotiation(self, request, force=False):
+        # CSV is not rendered by a renderer, but streamed
+        if self.get_stream_format(request) == 'csv':
+            force = True
+        return super().perform_content_negotiation(request, force=force)
+
+    def get_stream_items(self):
+        """
+        Get an iterable of the serialized items to stream.
+        """
+        serializer = self.get_serializer()
+        return (
+            serializer.to_representation(instance)
+            for instance in iterate(self.filter_queryset(self.get_queryset()), self.stream_ordering)
+        )
+
+    def stream(self, items, stream_format):
+        """
+        Get a streaming response of items.
+        """
+        if stream_format == 'csv':
+            return StreamingHttpResponse(csv_lines(items), content_type='text/csv; charset=utf-8')
+        return StreamingHttpResponse(json_lines(items), content_type='application/json')
+
+    def list(self, request, *args, **kwargs):
+        stream_format = self.get_stream_format(request)
+        if stream_format is None:
+            return super().list(request, *args, **kwargs)
+        return self.stream(self.get_stream_items(), stream_format)
@@ -1,3 +1,1584 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from backend import archive, buffer, compaction, configuration, consumers, deletion, downsampling, ingest, latest, layers, models, pagination, retention, rollups, serializers, streaming, wire
+
+
+class SensorKitMixin:
+    """
+    Mixin of test cases with kits measuring a single quantity type with a
+    sensor. Sets `quantity_type`, `peripheral_definition` and `now`.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.quantity_type = models.QuantityType.objects.create(physical_quantity='Temperature', physical_unit='Degrees Celsius', physical_unit_symbol='C')
+        self.peripheral_definition = models.PeripheralDefinition.objects.create(name='Sensor', module_name='sensors', class_name='Sensor')
+        self.peripheral_definition.quantity_types.add(self.quantity_type)
+        self.now = timezone.now().replace(microsecond=0)
+
+    def create_kit(self, username, name):
+        """
+        Create a kit with a sensor.
+
+        :return: The kit and its sensor peripheral device.
+        """
+        kit = models.Kit.objects.create(username=username, name=name)
+        peripheral = models.Peripheral.objects.create(kit=kit, peripheral_definition=self.peripheral_definition, name='Sensor')
+        return (kit, peripheral)
+
+    def measurement(self, date_time, value, **kwargs):
+        """
+        Create (but do not save) a measurement of the sensor of `self.kit`.
+        Keyword arguments override the fields of the measurement.
+        """
+        fields = dict(
+            kit=getattr(self, 'kit', None),
+            peripheral=getattr(self, 'peripheral', None),
+            quantity_type=self.quantity_type,
+            date_time=date_time,
+            value=value,
+            physical_quantity=self.quantity_type.physical_quantity,
+            physical_unit=self.quantity_type.physical_unit,
+        )
+        fields.update(kwargs)
+        return models.Measurement(**fields)
+
+
+class RecentMeasurementsTests(TestCase):
+    #: The number of peripheral devices of the kit
+    PERIPHERALS = 8
+
+    #: The number of quantity types of each peripheral device
+    QUANTITY_TYPES = 3
+
+    #: The number of measurements of each series
+    MEASUREMENTS = 10
+
+    def setUp(self):
+        self.kit = models.Kit.objects.create(username='k.recent', name='Recent measurements kit')
+        self.quantity_types = [
+            models.QuantityType.objects.create(physical_quantity='Quantity %d' % index, physical_unit='Unit', physical_unit_symbol='U')
+            for index in range(self.QUANTITY_TYPES)
+        ]
+        peripheral_definition = models.PeripheralDefinition.objects.create(name='Sensor', module_name='sensors', class_name='Sensor')
+        peripheral_definition.quantity_types.add(*self.quantity_types)
+
+        self.peripherals = [
+            models.Peripheral.objects.create(kit=self.kit, peripheral_definition=peripheral_definition, name='Sensor %d' % index)
+            for index in range(self.PERIPHERALS)
+        ]
+
+        self.now = timezone.now().replace(microsecond=0)
+        models.Measurement.objects.bulk_create([
+            models.Measurement(
+                kit=self.kit,
+                peripheral=peripheral,
+                quantity_type=quantity_type,
+                date_time=self.now - datetime.timedelta(minutes=minute),
+                value=minute,
+                physical_quantity=quantity_type.physical_quantity,
+                physical_unit=quantity_type.physical_unit,
+            )
+            for peripheral in self.peripherals
+            for quantity_type in self.quantity_types
+            for minute in range(self.MEASUREMENTS)
+        ])
+
+    def test_query_count(self):
+        # The active peripheral devices and their quantity types, the
+        # archive, and the measurements of all series
+        since = self.now - datetime.timedelta(days=1)
+        with self.assertNumQueries(4):
+            recent = self.kit.recent_measurements(since=since, max_measurements=5)
+        with self.assertNumQueries(4):
+            self.kit.recent_measurements(since=since)
+
+        self.assertEqual(len(recent), self.PERIPHERALS)
+        for peripheral in self.peripherals:
+            self.assertEqual(len(recent[peripheral]), self.QUANTITY_TYPES)
+            for quantity_type in self.quantity_types:
+                self.assertEqual([measurement.value for measurement in recent[peripheral][quantity_type]], [4, 3, 2, 1, 0])
+
+    def test_window_and_union_agree(self):
+        series = [(peripheral.pk, quantity_type.pk) for peripheral in self.peripherals for quantity_type in self.quantity_types]
+        measurements = self.kit.measurements.filter(date_time__gte=self.now - datetime.timedelta(minutes=7))
+
+        by_union = list(measurements._recent_by_union(series, 3))
+        self.assertEqual(len(by_union), len(series) * 3)
+
+        if models.supports_window_functions(connection):
+            by_window = list(measurements._recent_by_window(series, 3))
+            self.assertEqual(sorted(measurement.pk for measurement in by_window), sorted(measurement.pk for measurement in by_union))
+
+
+class ListQueryCountTests(TestCase):
+    """
+    The number of queries of the list endpoints must not grow with the number
+    of rows listed.
+    """
+
+    #: The list endpoints, by URL
+    ENDPOINTS = (
+        '/api/kits/',
+        '/api/kit-configurations/',
+        '/api/experiments/',
+        '/api/peripheral-definitions/',
+        '/api/peripheral-configuration-definitions/',
+        '/api/peripherals/',
+        '/api/measurements/',
+        '/api/latest-measurements/',
+    )
+
+    def setUp(self):
+        self.user = models.PersonUser.objects.create(username='p.query-count')
+        self.quantity_type = models.QuantityType.objects.create(physical_quantity='Temperature', physical_unit='Degrees Celsius', physical_unit_symbol='C')
+        self.now = timezone.now().replace(microsecond=0)
+        self.kit_count = 0
+
+    def add_kit(self):
+        """
+        Add a kit owned by the user, with a peripheral device of its own
+        definition (with configuration definitions), an experiment and
+        measurements.
+        """
+        self.kit_count += 1
+        kit = models.Kit.objects.create(username='k.query-count-%d' % self.kit_count, name='Kit %d' % self.kit_count)
+        models.KitMembership.objects.create(user=self.user, kit=kit)
+        models.Experiment.objects.create(kit=kit, date_time_start=self.now)
+
+        peripheral_definition = models.PeripheralDefinition.objects.create(name='Sensor %d' % self.kit_count, module_name='sensors', class_name='Sensor')
+        peripheral_definition.quantity_types.add(self.quantity_type)
+
+        peripheral = models.Peripheral.objects.create(kit=kit, peripheral_definition=peripheral_definition, name='Sensor')
+        for name in ('interval', 'pin'):
+            configuration_definition = models.PeripheralConfigurationDefinition.objects.create(
+                peripheral_definition=peripheral_definition,
+                name=name,
+                default_value='1',
+            )
+            models.PeripheralConfiguration.objects.create(
+                peripheral=peripheral,
+                peripheral_configuration_definition=configuration_definition,
+                value='2',
+            )
+
+        measurements = [
+            models.Measurement(
+                kit=kit,
+                peripheral=peripheral,
+                quantity_type=self.quantity_type,
+                date_time=self.now - datetime.timedelta(minutes=minute),
+                value=minute,
+                physical_quantity=self.quantity_type.physical_quantity,
+                physical_unit=self.quantity_type.physical_unit,
+            )
+            for minute in range(3)
+        ]
+        models.Measurement.objects.bulk_create(measurements)
+        models.LatestMeasurement.objects.create(
+            kit=kit,
+            peripheral=peripheral,
+            quantity_type=self.quantity_type,
+            measurement_type='REDUCED',
+            date_time=measurements[0].date_time,
+            value=measurements[0].value,
+        )
+
+    def count_queries(self, client, url):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        return len(queries)
+
+    def test_query_count_does_not_grow(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.add_kit()
+        counts = {url: self.count_queries(client, url) for url in self.ENDPOINTS}
+
+        for _ in range(3):
+            self.add_kit()
+        for url in self.ENDPOINTS:
+            self.assertEqual(self.count_queries(client, url), counts[url], url)
+
+
+class BulkIngestTests(SensorKitMixin, TestCase):
+    """
+    Measurements uploaded in bulk are stored, except for invalid rows, which
+    are reported by their index, and retried rows, which are counted as
+    duplicates.
+    """
+
+    URL = '/api/measurements/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.bulk', 'Bulk ingest kit')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+
+    def tearDown(self):
+        latest.forget(self.kit)
+
+    def row(self, minute, value=1.0, **kwargs):
+        row = {
+            'peripheral': self.peripheral.name,
+            'physical_quantity': self.quantity_type.physical_quantity,
+            'physical_unit': self.quantity_type.physical_unit,
+            'date_time': (self.now + datetime.timedelta(minutes=minute)).isoformat(),
+            'value': value,
+        }
+        row.update(kwargs)
+        return row
+
+    def post_ndjson(self, lines):
+        return self.client.generic('POST', self.URL, '\n'.join(lines) + '\n', content_type='application/x-ndjson')
+
+    def test_json_array(self):
+        response = self.client.post(self.URL, [self.row(minute, minute) for minute in range(5)], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 5, 'duplicates': 0, 'rejected': 0, 'errors': []})
+        self.assertEqual(sorted(self.kit.measurements.values_list('value', flat=True)), [0, 1, 2, 3, 4])
+
+    def test_ndjson(self):
+        lines = [json.dumps(self.row(minute)) for minute in range(3)]
+        response = self.post_ndjson(lines[:2] + [''] + lines[2:] + ['{not json'])
+        self.assertEqual(response.status_code, 201)
+
+        result = response.json()
+        self.assertEqual((result['created'], result['rejected']), (3, 1))
+        # Blank lines are skipped
+        self.assertEqual([error['index'] for error in result['errors']], [3])
+        self.assertEqual(self.kit.measurements.count(), 3)
+
+    def test_invalid_rows(self):
+        rows = [
+            self.row(0),
+            self.row(1, peripheral='Unknown sensor'),
+            5,
+            self.row(2, value='warm'),
+            self.row(3),
+        ]
+        response = self.client.post(self.URL, rows, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        result = response.json()
+        self.assertEqual((result['created'], result['rejected']), (2, 3))
+        self.assertEqual([error['index'] for error in result['errors']], [1, 2, 3])
+
+    def test_duplicates(self):
+        rows = [self.row(minute) for minute in range(4)]
+        self.client.post(self.URL, rows[:2], format='json')
+
+        response = self.client.post(self.URL, rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['created'], response.json()['duplicates']), (2, 2))
+        self.assertEqual(self.kit.measurements.count(), 4)
+
+    def test_rejected(self):
+        # Only a request of which every row is rejected fails
+        response = self.client.post(self.URL, [5, self.row(0, value='warm')], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rejected'], 2)
+
+        self.client.post(self.URL, [self.row(0)], format='json')
+        response = self.client.post(self.URL, [self.row(0), 5], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['duplicates'], response.json()['rejected']), (1, 1))
+
+        self.assertEqual(self.client.post(self.URL, {'measurements': []}, format='json').status_code, 400)
+
+
+class IdempotentInsertTests(SensorKitMixin, TestCase):
+    """
+    Retried measurements are stored once, and distinct measurements are
+    never taken for retries.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.idempotent', 'Idempotent insert kit')
+
+    def tearDown(self):
+        # The unregistered quantity types cached in-process are rolled back
+        models.UnregisteredQuantityType.objects.clear_cache()
+
+    def quantity_measurement(self, physical_quantity='Temperature', physical_unit='Degrees Celsius', registered=True):
+        return self.measurement(
+            self.now,
+            1.0,
+            quantity_type=self.quantity_type if registered else None,
+            physical_quantity=physical_quantity,
+            physical_unit=physical_unit,
+        )
+
+    def test_retries_are_inserted_once(self):
+        for registered in (True, False):
+            self.assertEqual(models.Measurement.objects.bulk_create_ignoring_duplicates([self.quantity_measurement(registered=registered)]), 1)
+            self.assertEqual(models.Measurement.objects.bulk_create_ignoring_duplicates([self.quantity_measurement(registered=registered)]), 0)
+        self.assertEqual(self.kit.measurements.count(), 2)
+
+    def test_unregistered_quantities_are_distinct(self):
+        measurements = [
+            self.quantity_measurement('Temperature', 'Kelvin', registered=False),
+            self.quantity_measurement('Humidity', 'Percent', registered=False),
+        ]
+        self.assertEqual(models.Measurement.objects.bulk_create_ignoring_duplicates(measurements), 2)
+
+    def test_buffer_drops_retries_only(self):
+        measurement_buffer = buffer.MeasurementBuffer(max_rows=100, max_delay=60, max_pending=1000)
+        (_, duplicates) = measurement_buffer.add([
+            self.quantity_measurement(),
+            self.quantity_measurement('Temperature', 'Kelvin', registered=False),
+            self.quantity_measurement('Humidity', 'Percent', registered=False),
+        ])
+        self.assertEqual(duplicates, [])
+
+        retry = self.quantity_measurement('Humidity', 'Percent', registered=False)
+        (_, duplicates) = measurement_buffer.add([retry])
+        self.assertEqual(duplicates, [retry])
+
+        measurement_buffer.flush()
+        measurement_buffer.close()
+        self.assertEqual(self.kit.measurements.count(), 3)
+
+    def test_measurements_without_quantity_are_not_deduplicated(self):
+        self.assertIsNone(self.quantity_measurement(None, None, registered=False).idempotency_key())
+
+
+class MeasurementBufferTests(SensorKitMixin, TransactionTestCase):
+    """
+    The measurement buffer is written by a background thread, which has a
+    database connection of its own.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.buffer', 'Buffer kit')
+        self.minutes = 0
+        self.buffers = []
+
+    def tearDown(self):
+        for measurement_buffer in self.buffers:
+            measurement_buffer.close()
+
+    def buffer(self, max_rows=100, max_delay=60, max_pending=1000):
+        measurement_buffer = buffer.MeasurementBuffer(max_rows=max_rows, max_delay=max_delay, max_pending=max_pending)
+        self.buffers.append(measurement_buffer)
+        return measurement_buffer
+
+    def measurements(self, count):
+        measurements = []
+        for _ in range(count):
+            self.minutes += 1
+            measurements.append(self.measurement(self.now + datetime.timedelta(minutes=self.minutes), self.minutes))
+        return measurements
+
+    def test_flush_on_size(self):
+        measurement_buffer = self.buffer(max_rows=3)
+        (first, _) = measurement_buffer.add(self.measurements(2))
+        (second, _) = measurement_buffer.add(self.measurements(1))
+        second.result(timeout=5)
+        self.assertTrue(first.done())
+        self.assertEqual(self.kit.measurements.count(), 3)
+        self.assertEqual(measurement_buffer.counters()['flushes'], 1)
+
+    def test_flush_on_interval(self):
+        measurement_buffer = self.buffer(max_delay=0.1)
+        (future, _) = measurement_buffer.add(self.measurements(1))
+        future.result(timeout=5)
+        self.assertEqual(self.kit.measurements.count(), 1)
+
+    def test_backpressure(self):
+        measurement_buffer = self.buffer(max_rows=2, max_pending=2)
+        writing = threading.Event()
+        release = threading.Event()
+        insert_measurements = rollups.insert_measurements
+
+        def blocked_insert_measurements(*args, **kwargs):
+            writing.set()
+            release.wait(5)
+            return insert_measurements(*args, **kwargs)
+
+        with mock.patch('backend.rollups.insert_measurements', blocked_insert_measurements):
+            measurement_buffer.add(self.measurements(2))
+            self.assertTrue(writing.wait(5))
+            measurement_buffer.add(self.measurements(2))
+
+            # The buffer is at its cap while the first rows are written
+            adding = threading.Thread(target=measurement_buffer.add, args=(self.measurements(1),))
+            adding.start()
+            adding.join(0.2)
+            self.assertTrue(adding.is_alive())
+
+            release.set()
+            adding.join(5)
+            self.assertFalse(adding.is_alive())
+            measurement_buffer.close()
+
+        self.assertEqual(self.kit.measurements.count(), 5)
+
+    def test_recovery_after_failed_write(self):
+        measurement_buffer = self.buffer(max_rows=1)
+        failing = mock.Mock(side_effect=[RuntimeError("Connection lost"), None])
+        with mock.patch('backend.buffer.close_old_connections', failing):
+            (future, _) = measurement_buffer.add(self.measurements(1))
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+            # The thread has kept running
+            (future, _) = measurement_buffer.add(self.measurements(1))
+            future.result(timeout=5)
+        self.assertEqual(self.kit.measurements.count(), 1)
+        self.assertEqual(measurement_buffer.counters()['rows_failed'], 1)
+
+    def test_stopped_thread_is_restarted(self):
+        measurement_buffer = self.buffer(max_rows=1)
+        measurement_buffer._thread = threading.Thread(target=lambda: None)
+        measurement_buffer._thread.start()
+        measurement_buffer._thread.join()
+
+        (future, _) = measurement_buffer.add(self.measurements(1))
+        future.result(timeout=5)
+        self.assertEqual(self.kit.measurements.count(), 1)
+
+    def test_created_measurements_are_accepted(self):
+        client = APIClient()
+        client.force_authenticate(self.kit)
+        response = client.post('/api/measurements/', {
+            'peripheral': 'http://testserver/api/peripherals/%d/' % self.peripheral.pk,
+            'date_time': self.now.isoformat(),
+            'value': 3.0,
+        }, format='json')
+
+        # The measurement might not be stored yet, so it has no url or id
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(sorted(response.json()), ['date_time', 'peripheral', 'value'])
+
+        buffer.get_measurement_buffer().flush()
+        self.assertEqual(list(self.kit.measurements.values_list('value', flat=True)), [3.0])
+
+
+class KitConsumerTests(SensorKitMixin, TransactionTestCase):
+    """
+    Measurements published by kits over websockets, through the synchronous
+    and the asynchronous consumers.
+    """
+
+    CONSUMERS = (consumers.KitConsumer, consumers.AsyncKitConsumer)
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.consumer', 'Consumer kit')
+
+    def tearDown(self):
+        buffer.get_measurement_buffer().flush()
+        latest.forget(self.kit)
+
+    def publish(self, consumer, *messages):
+        """
+        Publish messages through a kit consumer.
+
+        :return: The replies.
+        """
+        async def communicate():
+            communicator = WebsocketCommunicator(consumer, '/kit/')
+            communicator.scope['user'] = self.kit
+            (connected, _) = await communicator.connect()
+            self.assertTrue(connected)
+
+            replies = []
+            for message in messages:
+                if isinstance(message, bytes):
+                    await communicator.send_to(bytes_data=message)
+                    replies.append(await communicator.receive_from(timeout=5))
+                else:
+                    await communicator.send_to(text_data=json.dumps(message))
+                    replies.append(json.loads(await communicator.receive_from(timeout=5)))
+            await communicator.disconnect()
+            return replies
+
+        return asyncio.get_event_loop().run_until_complete(communicate())
+
+    def message(self, measurement_type, value, minutes=0):
+        return {
+            'stream': 'publish-measurement',
+            'nonce': 1,
+            'payload': {
+                'measurement_type': measurement_type,
+                'measurement': {
+                    'peripheral': self.peripheral.name,
+                    'physical_quantity': self.quantity_type.physical_quantity,
+                    'physical_unit': self.quantity_type.physical_unit,
+                    'date_time': (self.now + datetime.timedelta(minutes=minutes)).isoformat(),
+                    'value': value,
+                },
+            },
+        }
+
+    def latest_value(self):
+        return models.LatestMeasurement.objects.get(kit=self.kit, quantity_type=self.quantity_type).value
+
+    def test_real_time_measurements_update_latest(self):
+        for (minutes, consumer) in enumerate(self.CONSUMERS):
+            self.publish(consumer, self.message('REAL_TIME', minutes, minutes))
+            self.assertEqual(self.latest_value(), minutes)
+
+            frame = wire.encode_measurements(
+                [('REAL_TIME', self.peripheral.pk, self.quantity_type.pk, (self.now + datetime.timedelta(minutes=minutes, seconds=30)).timestamp(), 10.0 + minutes)],
+                opcode=wire.PUBLISH,
+            )
+            self.publish(consumer, frame)
+            self.assertEqual(self.latest_value(), 10.0 + minutes)
+
+    def test_duplicates_do_not_update_latest(self):
+        for consumer in self.CONSUMERS:
+            [first, retry] = self.publish(consumer, self.message('REDUCED', 1.0), self.message('REDUCED', 2.0))
+            self.assertEqual(retry['payload'], {'success': 'published', 'duplicates': 1})
+
+            # The cache of latest date-times of this process is bypassed, as if
+            # the retry was published to another process
+            latest._latest.clear()
+            self.publish(consumer, self.message('REDUCED', 2.0))
+            self.assertEqual(self.latest_value(), 1.0)
+
+    def test_resolution_follows_registration_changes(self):
+        for (index, consumer) in enumerate(self.CONSUMERS):
+            pressure = models.QuantityType.objects.create(physical_quantity='Pressure %d' % index, physical_unit='Pascal', physical_unit_symbol='Pa')
+
+            def message(value, physical_unit='Pascal'):
+                message = self.message('REDUCED', 10 * index + value, 10 * index + value)
+                message['payload']['measurement'].update(physical_quantity=pressure.physical_quantity, physical_unit=physical_unit)
+                return message
+
+            def register():
+                self.peripheral_definition.quantity_types.add(pressure)
+
+            def change_unit():
+                pressure.physical_unit = 'Hectopascal'
+                pressure.save()
+
+            async def communicate():
+                communicator = WebsocketCommunicator(consumer, '/kit/')
+                communicator.scope['user'] = self.kit
+                await communicator.connect()
+
+                for (change, published) in ((None, message(1)), (register, message(2)), (change_unit, message(3, 'Hectopascal'))):
+                    if change is not None:
+                        await database_sync_to_async(change)()
+                        # Let the consumer handle the invalidation, skipping
+                        # the configurations pushed as well
+                        while not await communicator.receive_nothing(timeout=0.2):
+                            await communicator.receive_from()
+                    await communicator.send_to(text_data=json.dumps(published))
+                    await communicator.receive_from(timeout=5)
+                await communicator.disconnect()
+
+            asyncio.get_event_loop().run_until_complete(communicate())
+            buffer.get_measurement_buffer().flush()
+
+            stored = dict(self.kit.measurements.filter(value__gt=10 * index, value__lt=10 * index + 10).values_list('value', 'quantity_type'))
+            self.assertEqual(stored, {10 * index + 1: None, 10 * index + 2: pressure.pk, 10 * index + 3: pressure.pk}, consumer)
+
+    def test_binary_frames(self):
+        for (minutes, consumer) in enumerate(self.CONSUMERS):
+            records = [
+                ('REDUCED', self.peripheral.pk, self.quantity_type.pk, (self.now + datetime.timedelta(minutes=minutes)).timestamp(), 1.0),
+                ('REDUCED', 0, self.quantity_type.pk, self.now.timestamp(), 2.0),
+            ]
+            published = wire.encode_measurements(records, opcode=wire.PUBLISH, nonce=7)
+            not_published = wire.encode_measurements(records, opcode=wire.MEASUREMENTS, nonce=8)
+
+            replies = self.publish(consumer, published, published, not_published)
+            self.assertEqual([wire.decode_header(reply) for reply in replies], [(wire.PUBLISH_REPLY, 7, 2), (wire.PUBLISH_REPLY, 7, 2), (wire.PUBLISH_REPLY, 8, 2)])
+            self.assertEqual(
+                [list(reply[wire.HEADER.size:]) for reply in replies],
+                [
+                    [wire.STATUS_PUBLISHED, wire.STATUS_ERROR],
+                    [wire.STATUS_DUPLICATE, wire.STATUS_ERROR],
+                    [wire.STATUS_ERROR, wire.STATUS_ERROR],
+                ],
+            )
+
+    def test_binary_records_require_a_quantity_type(self):
+        for (minutes, consumer) in enumerate(self.CONSUMERS):
+            frame = wire.encode_measurements(
+                [('REDUCED', self.peripheral.pk, None, (self.now + datetime.timedelta(minutes=minutes)).timestamp(), 1.0)],
+                opcode=wire.PUBLISH,
+            )
+            [reply] = self.publish(consumer, frame)
+            self.assertEqual(list(reply[wire.HEADER.size:]), [wire.STATUS_ERROR])
+        self.assertFalse(self.kit.measurements.exists())
+
+    def test_config_is_pushed_on_change(self):
+        for consumer in self.CONSUMERS:
+            async def communicate():
+                communicator = WebsocketCommunicator(consumer, '/kit/')
+                communicator.scope['user'] = self.kit
+                await communicator.connect()
+
+                await communicator.send_to(text_data=json.dumps({'stream': 'config', 'nonce': 1}))
+                reply = json.loads(await communicator.receive_from(timeout=5))
+
+                # A configuration definition with a default value changes the
+                # configuration
+                await database_sync_to_async(models.PeripheralConfigurationDefinition.objects.create)(
+                    peripheral_definition=self.peripheral.peripheral_definition,
+                    name='interval-%s' % consumer.__name__,
+                    default_value='5',
+                )
+                pushed = json.loads(await communicator.receive_from(timeout=5))
+
+                # Saving without changes pushes nothing
+                await database_sync_to_async(self.peripheral.save)()
+                nothing = await communicator.receive_nothing(timeout=0.2)
+                await communicator.disconnect()
+                return (reply, pushed, nothing)
+
+            (reply, pushed, nothing) = asyncio.get_event_loop().run_until_complete(communicate())
+            self.assertEqual(reply['reply-nonce'], 1)
+            self.assertEqual(pushed['stream'], 'config')
+            self.assertGreater(pushed['payload']['version'], reply['payload']['version'])
+            self.assertNotEqual(pushed['payload']['hash'], reply['payload']['hash'])
+            self.assertEqual(pushed['payload']['config']['peripherals'][0]['parameters']['interval-%s' % consumer.__name__], '5')
+            self.assertTrue(nothing)
+
+    @mock.patch('backend.deletion.start')
+    def test_config_of_deleted_kit(self, start):
+        def remove(kit):
+            models.Kit.objects.filter(pk=kit.pk).delete()
+
+        def schedule_removal(kit):
+            # The removal job is not started, such that the kit is only
+            # marked as deleted
+            deletion.schedule_kit_removal(kit)
+
+        for delete in (remove, schedule_removal):
+            for consumer in self.CONSUMERS:
+                (kit, _) = self.create_kit('k.%s-%s' % (delete.__name__, consumer.__name__), 'Deleted kit')
+
+                async def communicate():
+                    communicator = WebsocketCommunicator(consumer, '/kit/')
+                    communicator.scope['user'] = kit
+                    await communicator.connect()
+                    await database_sync_to_async(delete)(kit)
+
+                    await communicator.send_to(text_data=json.dumps({'stream': 'config', 'nonce': 1}))
+                    reply = json.loads(await communicator.receive_from(timeout=5))
+                    closed = await communicator.receive_output(timeout=5)
+                    await communicator.disconnect()
+                    return (reply, closed)
+
+                (reply, closed) = asyncio.get_event_loop().run_until_complete(communicate())
+                self.assertIn('error', reply['payload'])
+                self.assertEqual(closed['type'], 'websocket.close')
+
+
+class ConflationTests(SensorKitMixin, TransactionTestCase):
+    """
+    REAL_TIME measurements sent to subscribers are conflated per series, by
+    the synchronous and the asynchronous subscribe consumers.
+    """
+
+    CONSUMERS = (consumers.MeasurementSubscribeConsumer, consumers.AsyncMeasurementSubscribeConsumer)
+
+    #: The conflation interval in milliseconds
+    INTERVAL = 500
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.conflation', 'Conflation kit')
+        self.other_peripheral = models.Peripheral.objects.create(kit=self.kit, peripheral_definition=self.peripheral_definition, name='Other sensor')
+
+    def event(self, measurement_type, value, peripheral=None):
+        measurement = self.measurement(self.now + datetime.timedelta(seconds=value), value, peripheral=peripheral or self.peripheral)
+        return ingest.measurement_event(measurement_type, measurement)
+
+    def subscribe(self, consumer, events, binary=False):
+        """
+        Subscribe to the measurements of the kit, and send measurement events
+        to the subscribers.
+
+        :return: A list of tuples of the time in seconds since sending the
+        events at which each frame was received, and the frame.
+        """
+        async def communicate():
+            communicator = WebsocketCommunicator(consumer, '/measurements/subscribe/%s/%s' % (self.kit.username, '?format=binary' if binary else ''))
+            communicator.scope['user'] = self.kit
+            communicator.scope['url_route'] = {'kwargs': {'kit_name': self.kit.username}}
+            (connected, _) = await communicator.connect()
+            self.assertTrue(connected)
+
+            start = time.monotonic()
+            for event in events:
+                await get_channel_layer().group_send('kit-measurements-%s' % self.kit.username, event)
+
+            frames = []
+            while not await communicator.receive_nothing(timeout=2 * self.INTERVAL / 1000):
+                frame = await communicator.receive_from()
+                frames.append((time.monotonic() - start, frame))
+            await communicator.disconnect()
+            return frames
+
+        return asyncio.get_event_loop().run_until_complete(communicate())
+
+    def values(self, frames):
+        return [json.loads(frame)['measurement']['value'] for (_, frame) in frames]
+
+    def test_newest_real_time_measurements_are_kept(self):
+        events = (
+            [self.event('REAL_TIME', value) for value in range(10)]
+            + [self.event('REAL_TIME', value, self.other_peripheral) for value in range(100, 105)]
+            + [self.event('REDUCED', 99)]
+        )
+        for consumer in self.CONSUMERS:
+            with override_settings(REAL_TIME_SUBSCRIPTION_INTERVAL=self.INTERVAL):
+                frames = self.subscribe(consumer, events)
+
+            # The first measurement is sent right away, REDUCED measurements
+            # are never held back, and the newest of each series is sent once
+            # the interval has passed
+            self.assertEqual(self.values(frames), [0, 99, 9, 104], consumer)
+            self.assertGreaterEqual(frames[2][0], self.INTERVAL / 1000, consumer)
+
+    def test_rate_limit(self):
+        for consumer in self.CONSUMERS:
+            with override_settings(REAL_TIME_SUBSCRIPTION_INTERVAL=self.INTERVAL):
+                frames = self.subscribe(consumer, [self.event('REAL_TIME', value) for value in range(3)])
+                self.assertEqual(self.values(frames), [0, 2], consumer)
+                self.assertGreaterEqual(frames[1][0] - frames[0][0], self.INTERVAL / 1000 * 0.9, consumer)
+
+    def test_disabled(self):
+        events = [self.event('REAL_TIME', value) for value in range(10)]
+        for consumer in self.CONSUMERS:
+            with override_settings(REAL_TIME_SUBSCRIPTION_INTERVAL=0):
+                self.assertEqual(self.values(self.subscribe(consumer, events)), list(range(10)), consumer)
+
+    def test_binary_frames_are_joined(self):
+        events = [self.event('REAL_TIME', 1), self.event('REAL_TIME', 2), self.event('REAL_TIME', 3, self.other_peripheral)]
+        for consumer in self.CONSUMERS:
+            with override_settings(REAL_TIME_SUBSCRIPTION_INTERVAL=self.INTERVAL):
+                frames = self.subscribe(consumer, events, binary=True)
+
+            self.assertEqual(
+                [[(peripheral_id, value) for (_, peripheral_id, _, _, value) in wire.decode_measurements(frame)[1]] for (_, frame) in frames],
+                [[(self.peripheral.pk, 1)], [(self.peripheral.pk, 2), (self.other_peripheral.pk, 3)]],
+                consumer,
+            )
+
+
+class KitConfigurationTests(SensorKitMixin, TestCase):
+    """
+    Kit configurations are rendered once per version, and served with ETags.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, _) = self.create_kit('k.configuration', 'Configuration kit')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+        self.url = '/api/kits/%d/config/' % self.kit.pk
+
+    def add_configuration_definition(self, name):
+        models.PeripheralConfigurationDefinition.objects.create(peripheral_definition=self.peripheral_definition, name=name, default_value='5')
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        # A single indexed lookup
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate(self):
+        response = self.client.get(self.url)
+        self.add_configuration_definition('interval')
+
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()['peripherals'][0]['parameters'], {'interval': '5'})
+
+        # Saving without changes keeps the configuration
+        self.kit.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=changed['ETag']).status_code, 304)
+
+    def test_change_while_rendering_is_not_stored(self):
+        generate_config = models.Kit.generate_config
+
+        def generate_config_then_change(kit):
+            config = generate_config(kit)
+            self.add_configuration_definition('interval')
+            return config
+
+        for stored in (False, True):
+            if stored:
+                configuration.invalidate([self.kit.pk])
+            with mock.patch.object(models.Kit, 'generate_config', generate_config_then_change):
+                configuration.update(self.kit, models.KitConfiguration.objects.filter(kit=self.kit).first())
+            self.assertIsNone(models.KitConfiguration.objects.get(kit=self.kit).config)
+
+            self.assertEqual(self.client.get(self.url).json()['peripherals'][0]['parameters'], {'interval': '5'})
+            models.PeripheralConfigurationDefinition.objects.all().delete()
+
+
+class MeasurementPaginationTests(SensorKitMixin, TestCase):
+    """
+    Measurements are paged by keyset, such that any page costs as much as the
+    first.
+    """
+
+    #: The number of kits of the user
+    KITS = 3
+
+    #: The number of measurements of each kit
+    MEASUREMENTS = 20
+
+    def setUp(self):
+        super().setUp()
+        self.user = models.PersonUser.objects.create(username='p.pagination')
+
+        measurements = []
+        # The last kit is not the user's
+        for index in range(self.KITS + 1):
+            (kit, peripheral) = self.create_kit('k.pagination-%d' % index, 'Kit %d' % index)
+            if index < self.KITS:
+                models.KitMembership.objects.create(user=self.user, kit=kit)
+            measurements += [
+                self.measurement(self.now - datetime.timedelta(minutes=minute), index * 100 + minute, kit=kit, peripheral=peripheral)
+                for minute in range(self.MEASUREMENTS)
+            ]
+        models.Measurement.objects.bulk_create(measurements)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_of_all_kits(self):
+        url = '/api/measurements/?page_size=7'
+        values = []
+        query_counts = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            values += [measurement['value'] for measurement in response.json()['results']]
+            query_counts.append(len(queries))
+            url = response.json()['next']
+
+        self.assertEqual(values, [
+            kit * 100 + minute
+            for minute in reversed(range(self.MEASUREMENTS))
+            for kit in range(self.KITS)
+        ])
+        # The first page also looks up the archive
+        self.assertEqual(len(set(query_counts[1:])), 1)
+        self.assertLessEqual(query_counts[1], query_counts[0])
+
+    @skipUnless(connection.vendor == 'sqlite', "Inspects SQLite query plans")
+    def test_pages_are_read_in_index_order(self):
+        # The page of each kit, whatever its position
+        paginator = pagination.MeasurementCursorPagination()
+        kit = models.Kit.kits.owned_by(self.user.pk).first()
+        last = kit.measurements.order_by('date_time', 'pk')[self.MEASUREMENTS // 2]
+
+        for cursor in (None, ('m', last.date_time, last.pk)):
+            page = paginator.get_page_queryset(models.Measurement.objects.filter(kit=kit), cursor)[:paginator.page_size + 1]
+            (statement, params) = page.query.get_compiler(connection=connection).as_sql()
+            with connection.cursor() as database_cursor:
+                database_cursor.execute('EXPLAIN QUERY PLAN ' + statement, params)
+                plan = ' '.join(str(row[-1]) for row in database_cursor.fetchall())
+
+            # Not sorted after reading all measurements of the kit
+            self.assertNotIn('TEMP B-TREE', plan, cursor)
+
+
+class CompactMeasurementTests(SensorKitMixin, TestCase):
+    """
+    Measurements stored without their physical quantity and unit strings are
+    read as if they were stored with them.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.compact', 'Compact kit')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+
+    def tearDown(self):
+        # The quantity types cached in-process are rolled back
+        models.QuantityType.objects.clear_cache()
+        models.UnregisteredQuantityType.objects.clear_cache()
+
+    def store(self):
+        """
+        Store a measurement of a registered quantity type, and one of an
+        unregistered quantity type, once by saving and once in bulk.
+        """
+        def measurements(date_time):
+            return [
+                self.measurement(date_time, 1.0),
+                self.measurement(date_time, 2.0, quantity_type=None, physical_quantity='Pressure', physical_unit='Pascal'),
+            ]
+
+        for measurement in measurements(self.now):
+            measurement.save()
+        models.Measurement.objects.bulk_create_ignoring_duplicates(measurements(self.now + datetime.timedelta(minutes=1)))
+
+    def stored_strings(self):
+        return list(models.Measurement.objects.order_by('pk').values_list('physical_quantity', 'physical_unit'))
+
+    def listed(self):
+        response = self.client.get('/api/measurements/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_compact_rows_are_read_with_their_strings(self):
+        with override_settings(COMPACT_MEASUREMENTS=True):
+            self.store()
+
+        self.assertEqual(self.stored_strings(), [(None, None)] * 4)
+        self.assertEqual(
+            [(measurement.physical_quantity, measurement.physical_unit) for measurement in models.Measurement.objects.order_by('pk')],
+            [('Temperature', 'Degrees Celsius'), ('Pressure', 'Pascal')] * 2,
+        )
+
+        # The unregistered pair was created on the fly
+        unregistered = models.UnregisteredQuantityType.objects.get()
+        self.assertEqual((unregistered.physical_quantity, unregistered.physical_unit), ('Pressure', 'Pascal'))
+        self.assertEqual(models.Measurement.objects.filter(unregistered_quantity_type=unregistered).count(), 2)
+
+    def test_serialized_measurements_do_not_depend_on_the_mode(self):
+        self.store()
+        listed = self.listed()
+
+        with override_settings(COMPACT_MEASUREMENTS=True):
+            compaction.convert(apps, True)
+            self.assertEqual(self.stored_strings(), [(None, None)] * 4)
+            self.assertEqual(self.listed(), listed)
+
+            measurement = models.Measurement.objects.filter(quantity_type=None).first()
+            self.assertEqual(
+                serializers.MeasurementOutputSerializer(measurement).data['physical_quantity'],
+                'Pressure',
+            )
+
+    def test_compact_then_expand(self):
+        self.store()
+        stored = self.stored_strings()
+
+        call_command('compact_measurements', batch_size=1, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.stored_strings(), [(None, None)] * 4)
+
+        call_command('compact_measurements', expand=True, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.stored_strings(), stored)
+
+    def test_migration(self):
+        migration = importlib.import_module('backend.migrations.0007_unregisteredquantitytype')
+
+        # Measurements stored before unregistered quantity types existed
+        models.Measurement.objects.bulk_create([
+            self.measurement(self.now, 1.0, quantity_type=None, physical_quantity='Pressure', physical_unit='Pascal'),
+        ])
+        with override_settings(COMPACT_MEASUREMENTS=True):
+            migration.convert_measurements(apps, None)
+        self.assertEqual(self.stored_strings(), [(None, None)])
+        self.assertEqual(models.Measurement.objects.get().physical_unit, 'Pascal')
+
+        migration.expand_measurements(apps, None)
+        self.assertEqual(self.stored_strings(), [('Pressure', 'Pascal')])
+
+
+class RollupTests(SensorKitMixin, TestCase):
+    """
+    Rollups are incremented with the measurements inserted.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.rollups', 'Rollups kit')
+        self.day = rollups.bucket(self.now, models.MeasurementRollup.DAY)
+
+    def rollup(self, resolution, bucket):
+        return models.MeasurementRollup.objects.get(kit=self.kit, resolution=resolution, bucket=bucket)
+
+    def test_increment(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(rollups.insert_measurements([self.measurement(self.day, 1.0), self.measurement(self.day + hour, 3.0)]), 2)
+        self.assertEqual(rollups.insert_measurements([self.measurement(self.day + 2 * hour, -1.0)]), 1)
+
+        day = self.rollup(models.MeasurementRollup.DAY, self.day)
+        self.assertEqual((day.count, day.min, day.max, day.sum, day.sum_of_squares), (3, -1.0, 3.0, 3.0, 11.0))
+        self.assertEqual(self.rollup(models.MeasurementRollup.HOUR, self.day + hour).count, 1)
+
+        # Rebuilding from the measurements agrees
+        rollups.rebuild(kit=self.kit)
+        rebuilt = self.rollup(models.MeasurementRollup.DAY, self.day)
+        self.assertEqual((rebuilt.count, rebuilt.sum), (3, 3.0))
+
+    def test_duplicates_are_not_counted(self):
+        minute = datetime.timedelta(minutes=1)
+        rollups.insert_measurements([self.measurement(self.day, 1.0), self.measurement(self.day + minute, 2.0)])
+
+        batch = [
+            self.measurement(self.day, 1.0),
+            self.measurement(self.day + 2 * minute, 4.0),
+            self.measurement(self.day + 2 * minute, 4.0),
+        ]
+        self.assertEqual(rollups.insert_measurements(batch), 1)
+        day = self.rollup(models.MeasurementRollup.DAY, self.day)
+        self.assertEqual((day.count, day.sum), (3, 7.0))
+
+    def test_days_without_measurements_are_kept(self):
+        # The measurements of a past day have been archived or purged, and
+        # only its rollups are left
+        past = self.day - datetime.timedelta(days=400)
+        rollups.insert_measurements([self.measurement(past, 1.0), self.measurement(past + datetime.timedelta(minutes=1), 2.0)])
+        models.Measurement.objects.filter(date_time__lt=self.day).delete()
+        rollups.insert_measurements([self.measurement(self.day, 5.0)])
+
+        # A late measurement of the past day is published along with a
+        # duplicate
+        self.assertEqual(rollups.insert_measurements([self.measurement(self.day, 5.0), self.measurement(past + datetime.timedelta(minutes=2), 3.0)]), 1)
+        day = self.rollup(models.MeasurementRollup.DAY, past)
+        self.assertEqual((day.count, day.sum), (3, 6.0))
+
+
+class WireTests(SimpleTestCase):
+    """
+    The binary wire format of measurement websocket frames.
+    """
+
+    RECORDS = [
+        ('REAL_TIME', 1, 2, 1577836800.0, 21.5),
+        ('REDUCED', 0xFFFFFFFF, None, 1577836800.125, -1e300),
+    ]
+
+    def test_round_trip(self):
+        for opcode in (wire.PUBLISH, wire.MEASUREMENTS):
+            frame = wire.encode_measurements(self.RECORDS, opcode=opcode, nonce=42)
+            self.assertEqual(wire.decode_header(frame), (opcode, 42, 2))
+            self.assertEqual(wire.decode_measurements(frame, opcode=opcode), (42, self.RECORDS))
+
+        frames = [wire.encode_measurements([record]) for record in self.RECORDS]
+        self.assertEqual(wire.decode_measurements(wire.join_measurements(frames)), (0, self.RECORDS))
+
+        reply = wire.encode_publish_reply(42, [wire.STATUS_PUBLISHED, wire.STATUS_DUPLICATE])
+        self.assertEqual(wire.decode_header(reply), (wire.PUBLISH_REPLY, 42, 2))
+        self.assertEqual(list(reply[wire.HEADER.size:]), [wire.STATUS_PUBLISHED, wire.STATUS_DUPLICATE])
+
+    def test_date_times(self):
+        date_time = datetime.datetime(2020, 1, 1, 12, 30, 15, 250000, tzinfo=datetime.timezone.utc)
+        self.assertEqual(wire.from_timestamp(wire.timestamp(date_time)), date_time)
+
+    def test_unknown_measurement_types(self):
+        frame = bytearray(wire.encode_measurements(self.RECORDS[:1]))
+        frame[wire.HEADER.size] = 0xFF
+        self.assertEqual(wire.decode_measurements(bytes(frame))[1][0][0], None)
+
+    def test_malformed_frames(self):
+        frame = wire.encode_measurements(self.RECORDS, opcode=wire.PUBLISH)
+        malformed = [
+            # Shorter than the header
+            frame[:wire.HEADER.size - 1],
+            # Truncated, or with trailing data
+            frame[:-1],
+            frame + b'\x00',
+            # With a count not matching its records
+            wire.HEADER.pack(wire.PUBLISH, 0, 3) + frame[wire.HEADER.size:],
+            # Of a different opcode
+            wire.encode_measurements(self.RECORDS, opcode=wire.MEASUREMENTS),
+            wire.encode_publish_reply(0, [wire.STATUS_PUBLISHED, wire.STATUS_PUBLISHED]),
+        ]
+        for data in malformed:
+            with self.assertRaises(wire.FrameError):
+                wire.decode_measurements(data, opcode=wire.PUBLISH)
+
+        with self.assertRaises(wire.FrameError):
+            wire.encode_measurements(self.RECORDS[:1] * (wire.MAX_ENTRIES + 1))
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    """
+    The channel layer of processes on a single machine. Each layer binds a
+    socket of its own, as if it were a separate process.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def layer(self, **kwargs):
+        return layers.UnixSocketChannelLayer(directory=self.directory, **kwargs)
+
+    def run_async(self, coroutine):
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    def receive(self, layer, channel):
+        return self.run_async(asyncio.wait_for(layer.receive(channel), 1))
+
+    def test_send_and_receive(self):
+        (sender, receiver) = (self.layer(), self.layer())
+        channel = self.run_async(receiver.new_channel())
+
+        self.run_async(sender.send(channel, {'type': 'test.message', 'value': 1}))
+        self.assertEqual(self.receive(receiver, channel), {'type': 'test.message', 'value': 1})
+
+        # Channels that are not process-specific are local to the process
+        self.run_async(receiver.send('local', {'type': 'test.message'}))
+        self.assertEqual(self.receive(receiver, 'local'), {'type': 'test.message'})
+
+        # Channels of processes that have gone are refused
+        with self.assertRaises(ConnectionRefusedError):
+            self.run_async(sender.send('specific.gone!channel', {'type': 'test.message'}))
+
+    def test_group_send(self):
+        (first, second) = (self.layer(), self.layer())
+        channels = [self.run_async(first.new_channel()), self.run_async(second.new_channel())]
+        for (layer, channel) in zip((first, second), channels):
+            self.run_async(layer.group_add('group', channel))
+
+        self.run_async(first.group_send('group', {'type': 'test.message', 'value': 1}))
+        self.assertEqual(self.receive(first, channels[0]), {'type': 'test.message', 'value': 1})
+        self.assertEqual(self.receive(second, channels[1]), {'type': 'test.message', 'value': 1})
+
+        self.run_async(second.group_discard('group', channels[1]))
+        self.run_async(first.group_send('group', {'type': 'test.message', 'value': 2}))
+        self.assertEqual(self.receive(first, channels[0]), {'type': 'test.message', 'value': 2})
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'groups', 'group')), [channels[0]])
+
+    def test_expiry(self):
+        layer = self.layer(expiry=0.1, group_expiry=60)
+        channel = self.run_async(layer.new_channel())
+
+        # Receiving reads the socket once the reader is registered
+        self.run_async(layer.send(channel, {'type': 'test.message', 'value': 1}))
+        self.assertEqual(self.receive(layer, channel), {'type': 'test.message', 'value': 1})
+
+        self.run_async(layer.send(channel, {'type': 'test.message', 'value': 2}))
+        self.run_async(asyncio.sleep(0.2))
+        self.run_async(layer.send(channel, {'type': 'test.message', 'value': 3}))
+        self.assertEqual(self.receive(layer, channel), {'type': 'test.message', 'value': 3})
+
+        # Expired memberships are removed when sending to the group
+        self.run_async(layer.group_add('group', channel))
+        membership = os.path.join(self.directory, 'groups', 'group', channel)
+        os.utime(membership, (time.time() - 120, time.time() - 120))
+        self.run_async(layer.group_send('group', {'type': 'test.message'}))
+        self.assertFalse(os.path.exists(membership))
+
+    def test_flush_is_limited_to_the_process(self):
+        (first, second) = (self.layer(), self.layer())
+        channels = [self.run_async(first.new_channel()), self.run_async(second.new_channel())]
+        for (layer, channel) in zip((first, second), channels):
+            self.run_async(layer.group_add('group', channel))
+
+        self.run_async(first.flush())
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'groups', 'group')), [channels[1]])
+
+
+class RetentionTests(SensorKitMixin, TestCase):
+    """
+    Expired measurements and rollups are purged, following the deployment's
+    retention and the kits' retention policies.
+    """
+
+    #: The number of days with measurements
+    DAYS = 40
+
+    #: The number of measurements per day
+    MEASUREMENTS = 3
+
+    def setUp(self):
+        super().setUp()
+        self.kits = []
+        measurements = []
+        for index in range(2):
+            (kit, peripheral) = self.create_kit('k.retention-%d' % index, 'Retention kit %d' % index)
+            self.kits.append(kit)
+            measurements += [
+                self.measurement(self.now - datetime.timedelta(days=day, minutes=minute + 1), 1.0, kit=kit, peripheral=peripheral)
+                for day in range(self.DAYS)
+                for minute in range(self.MEASUREMENTS)
+            ]
+        rollups.insert_measurements(measurements)
+
+        # The second kit keeps its measurements for less time
+        models.KitRetentionPolicy.objects.create(kit=self.kits[1], raw_days=10)
+
+    def test_purge(self):
+        with override_settings(MEASUREMENT_RETENTION={'RAW': 30, 'MINUTE': 7}):
+            run = retention.purge(chunk_size=37, chunk_delay=0, now=self.now)
+
+        self.assertEqual(run.state, models.RetentionRun.FINISHED)
+        self.assertEqual(self.kits[0].measurements.count(), 30 * self.MEASUREMENTS)
+        self.assertEqual(self.kits[1].measurements.count(), 10 * self.MEASUREMENTS)
+        self.assertEqual(run.measurements_removed, (self.DAYS - 30 + self.DAYS - 10) * self.MEASUREMENTS)
+
+        minute_rollups = models.MeasurementRollup.objects.filter(resolution=models.MeasurementRollup.MINUTE)
+        self.assertFalse(minute_rollups.filter(bucket__lt=self.now - datetime.timedelta(days=7, minutes=1)).exists())
+        self.assertEqual(run.rollups_removed, 2 * (self.DAYS - 7) * self.MEASUREMENTS)
+
+        # Rollups of coarser resolutions are kept forever
+        self.assertTrue(models.MeasurementRollup.objects.filter(
+            resolution=models.MeasurementRollup.DAY,
+            bucket__lt=self.now - datetime.timedelta(days=self.DAYS - 1),
+        ).exists())
+
+    def test_raw_cutoff(self):
+        with override_settings(MEASUREMENT_RETENTION={'RAW': 30}):
+            self.assertEqual(retention.raw_cutoff(self.kits[0], now=self.now), self.now - datetime.timedelta(days=30))
+            self.assertEqual(retention.raw_cutoff(self.kits[1], now=self.now), self.now - datetime.timedelta(days=10))
+            self.assertEqual(retention.raw_cutoff(now=self.now), self.now - datetime.timedelta(days=10))
+        self.assertIsNone(retention.raw_cutoff(self.kits[0], now=self.now))
+
+    def test_rebuild_skips_purged_days(self):
+        with override_settings(MEASUREMENT_RETENTION={'RAW': 30}):
+            retention.purge(chunk_delay=0, now=self.now)
+            before = set(models.MeasurementRollup.objects.filter(resolution=models.MeasurementRollup.DAY).values_list('kit_id', 'bucket', 'count'))
+            rollups.rebuild()
+            after = set(models.MeasurementRollup.objects.filter(resolution=models.MeasurementRollup.DAY).values_list('kit_id', 'bucket', 'count'))
+        self.assertEqual(after, before)
+
+
+@mock.patch('backend.deletion.start')
+@override_settings(MEASUREMENT_RETENTION={'CHUNK_SIZE': 5, 'CHUNK_DELAY': 0})
+class DeletionTests(SensorKitMixin, TestCase):
+    """
+    Kits and their measurements are removed by jobs, run here in the calling
+    thread rather than in the background.
+    """
+
+    #: The number of measurements of the kit
+    MEASUREMENTS = 23
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.deletion', 'Deletion kit')
+        rollups.insert_measurements(self.measurements(range(self.MEASUREMENTS)))
+
+    def measurements(self, minutes):
+        return [self.measurement(self.now - datetime.timedelta(minutes=minute), minute) for minute in minutes]
+
+    def test_measurement_removal(self, start):
+        job = deletion.schedule_measurement_removal(self.kit)
+        self.assertTrue(start.called)
+
+        # Measurements stored after scheduling are kept
+        rollups.insert_measurements(self.measurements([-1]))
+
+        self.assertEqual(deletion.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.state, models.KitDeletionJob.FINISHED)
+        self.assertEqual((job.measurements_total, job.measurements_deleted, job.percentage()), (self.MEASUREMENTS, self.MEASUREMENTS, 100))
+        self.assertEqual(list(self.kit.measurements.values_list('value', flat=True)), [-1])
+        self.assertFalse(models.MeasurementRollup.objects.filter(kit=self.kit).exists())
+        self.assertEqual(deletion.run_pending(), 0)
+
+    def test_kit_removal(self, start):
+        job = deletion.schedule_kit_removal(self.kit)
+
+        # The kit is hidden right away
+        self.assertIsNone(models.Kit.kits.safe_get(self.kit.pk))
+
+        self.assertEqual(deletion.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.kit_id, job.kit_name), (models.KitDeletionJob.FINISHED, None, 'Deletion kit'))
+        self.assertEqual(job.measurements_deleted, self.MEASUREMENTS)
+        self.assertFalse(models.Kit.objects.filter(pk=self.kit.pk).exists())
+        self.assertFalse(models.Measurement.objects.exists())
+
+    def test_interrupted_jobs_are_resumed(self, start):
+        job = deletion.schedule_measurement_removal(self.kit)
+        models.KitDeletionJob.objects.filter(pk=job.pk).update(state=models.KitDeletionJob.RUNNING)
+
+        self.assertEqual(deletion.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.state, models.KitDeletionJob.FINISHED)
+        self.assertFalse(self.kit.measurements.exists())
+
+
+class ArchiveTests(SensorKitMixin, TransactionTestCase):
+    """
+    Old measurements are moved into archive blocks, and are still read along
+    with the measurements in the database. Files are removed once the removal
+    of their block is committed.
+    """
+
+    #: The number of old (hourly) measurements
+    OLD = 60
+
+    #: The number of recent measurements
+    RECENT = 3
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(MEASUREMENT_ARCHIVE={'DIRECTORY': self.directory, 'AFTER_DAYS': 30, 'BLOCK_DAYS': 1})
+        self.settings.enable()
+
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.archive', 'Archive kit')
+        self.old = self.now - datetime.timedelta(days=100)
+        rollups.insert_measurements(
+            [self.measurement(self.old + datetime.timedelta(hours=hour), hour) for hour in range(self.OLD)]
+            + [self.measurement(self.now - datetime.timedelta(hours=hour), 1000 + hour) for hour in range(self.RECENT)]
+        )
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def archived_values(self, **kwargs):
+        return [measurement.value for measurement in archive.series(self.kit, self.peripheral, self.quantity_type, **kwargs)]
+
+    def test_archive(self):
+        self.assertEqual(archive.archive(now=self.now), self.OLD)
+        self.assertEqual(self.kit.measurements.count(), self.RECENT)
+        self.assertEqual(sum(models.MeasurementArchiveBlock.objects.values_list('count', flat=True)), self.OLD)
+
+        self.assertEqual(self.archived_values(), list(range(self.OLD)))
+        self.assertEqual(self.archived_values(last=5), list(range(self.OLD - 5, self.OLD)))
+        self.assertEqual(archive.series(self.kit, self.peripheral, self.quantity_type)[5].date_time, self.old + datetime.timedelta(hours=5))
+
+        # Rollups are kept
+        self.assertEqual(sum(models.MeasurementRollup.objects.filter(resolution=models.MeasurementRollup.DAY).values_list('count', flat=True)), self.OLD + self.RECENT)
+
+    def test_reads_include_archived_measurements(self):
+        archive.archive(now=self.now)
+
+        recent = self.kit.recent_measurements(since=self.old - datetime.timedelta(days=1), max_measurements=5)
+        self.assertEqual([measurement.value for measurement in recent[self.peripheral][self.quantity_type]], [58, 59, 1002, 1001, 1000])
+
+        client = APIClient()
+        client.force_authenticate(self.kit)
+        url = '/api/measurements/?page_size=7'
+        values = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            values += [measurement['value'] for measurement in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(values, list(range(self.OLD)) + [1002, 1001, 1000])
+
+    def test_backfilled_measurements_are_merged(self):
+        archive.archive(now=self.now)
+
+        # Of measurements with the same date-time, the archived one is kept
+        models.Measurement.objects.bulk_create([
+            self.measurement(self.old + datetime.timedelta(hours=1), -1),
+            self.measurement(self.old + datetime.timedelta(minutes=30), -2),
+        ])
+        self.assertEqual(archive.archive(now=self.now), 2)
+        self.assertEqual(self.archived_values()[:3], [0, -2, 1])
+        self.assertEqual(len(self.archived_values()), self.OLD + 1)
+
+    def test_removed_blocks_remove_their_files(self):
+        archive.archive(now=self.now)
+        models.MeasurementArchiveBlock.objects.all().delete()
+        self.assertEqual(sum(len(files) for (_, _, files) in os.walk(self.directory)), 0)
+
+
+class DownsamplingTests(SimpleTestCase):
+    """
+    Series are downsampled by selecting real measurements.
+    """
+
+    def setUp(self):
+        self.times = numpy.arange(10000, dtype=numpy.float64)
+        self.values = numpy.sin(self.times / 300.0)
+        # A single peak
+        self.values[5123] = 50.0
+
+    def test_selections(self):
+        for method in downsampling.METHODS.values():
+            selected = method(self.times, self.values, 100)
+            self.assertLessEqual(len(selected), 100, method)
+            self.assertTrue((numpy.diff(selected) > 0).all(), method)
+            self.assertIn(5123, selected, method)
+
+    def test_lttb(self):
+        selected = downsampling.lttb(self.times, self.values, 100)
+        self.assertEqual(len(selected), 100)
+        self.assertEqual((selected[0], selected[-1]), (0, len(self.times) - 1))
+
+        self.assertEqual(list(downsampling.lttb(self.times[:5], self.values[:5], 10)), [0, 1, 2, 3, 4])
+        self.assertEqual(list(downsampling.lttb(self.times, self.values, 2)), [0, len(self.times) - 1])
+
+    def test_min_max(self):
+        selected = downsampling.min_max(self.times, self.values, 100)
+        self.assertIn(int(numpy.argmin(self.values)), selected)
+
+        # All points at the same time fall in a single bucket
+        self.assertEqual(len(downsampling.min_max(numpy.zeros(5), numpy.arange(5.0), 4)), 2)
+
+    def test_downsample(self):
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        measurements = [
+            models.Measurement(date_time=start + datetime.timedelta(minutes=minute), value=value)
+            for (minute, value) in enumerate(self.values[:1000])
+        ]
+        self.assertIs(downsampling.downsample(measurements, 1000), measurements)
+
+        selected = downsampling.downsample(measurements, 50, method='min_max')
+        self.assertLessEqual(len(selected), 50)
+        self.assertEqual(selected, sorted(selected, key=lambda measurement: measurement.date_time))
+
+
+class RecentMeasurementsAPITests(SensorKitMixin, TestCase):
+    """
+    The recent measurements of a kit are downsampled to a budget of points.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.recent-api', 'Recent measurements kit')
+        models.Measurement.objects.bulk_create([
+            self.measurement(self.now - datetime.timedelta(minutes=minute), minute)
+            for minute in range(1000)
+        ])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+        self.url = '/api/kits/%d/recent-measurements/' % self.kit.pk
+
+    def test_downsampled(self):
+        recent = self.kit.recent_measurements(points=50)
+        self.assertEqual(len(recent[self.peripheral][self.quantity_type]), 50)
+
+        for method in downsampling.METHODS:
+            response = self.client.get(self.url, {'points': 20, 'method': method})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()), 20)
+            self.assertIn(999, [measurement['value'] for measurement in response.json()])
+
+    def test_invalid_parameters(self):
+        for parameters in ({'points': 'x'}, {'points': 0}, {'method': 'average'}, {'since': 'yesterday'}):
+            self.assertEqual(self.client.get(self.url, parameters).status_code, 400, parameters)
+
+
+class SeriesAPITests(SensorKitMixin, TestCase):
+    """
+    Series are aggregated into buckets of time from the rollups.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.series', 'Series kit')
+
+        start = datetime.datetime(2022, 3, 1, tzinfo=datetime.timezone.utc)
+        rollups.insert_measurements([
+            self.measurement(start + datetime.timedelta(minutes=minute), float(minute))
+            for minute in range(300)
+        ])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+        self.parameters = {
+            'kit': self.kit.pk,
+            'peripheral': self.peripheral.pk,
+            'quantity_type': self.quantity_type.pk,
+            'from': '2022-03-01T00:00:00Z',
+            'to': '2022-03-01T05:00:00Z',
+            'width': 5400,
+            'aggregate': 'mean,min,max,count,last',
+        }
+
+    def get(self, **parameters):
+        return self.client.get('/api/series/', dict(self.parameters, **parameters))
+
+    def test_series(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200, response.content)
+
+        series = response.json()
+        self.assertEqual(series['width'], 5400)
+        self.assertEqual(series['count'], [90, 90, 90, 30])
+        self.assertEqual(series['min'], [0, 90, 180, 270])
+        self.assertEqual(series['max'], [89, 179, 269, 299])
+        self.assertEqual(series['last'], [89, 179, 269, 299])
+        self.assertEqual(series['mean'][0], 44.5)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(width=90).status_code, 400)
+        self.assertEqual(self.get(width=60, to='2022-03-31T00:00:00Z').status_code, 400)
+        self.assertEqual(self.get(aggregate='mean,avg').status_code, 400)
+        self.assertEqual(self.get(kit=self.kit.pk + 1).status_code, 404)
+        self.assertEqual(self.get(peripheral=self.peripheral.pk + 1).status_code, 404)
+
+
+class StreamingTests(SensorKitMixin, TestCase):
+    """
+    List endpoints stream their items when asked to.
+    """
+
+    def setUp(self):
+        super().setUp()
+        (self.kit, self.peripheral) = self.create_kit('k.streaming', 'Streaming kit')
+
+        # Measurements in reverse order of their values
+        rollups.insert_measurements([
+            self.measurement(self.now - datetime.timedelta(minutes=value), value)
+            for value in range(7)
+        ])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.kit)
+
+    def test_iterate(self):
+        queryset = models.Measurement.objects.all()
+        expected = [measurement.pk for measurement in queryset.order_by('date_time', 'pk')]
+        for chunk_size in (1, 2, 7, 100):
+            iterated = streaming.iterate(queryset, ('date_time', 'pk'), chunk_size=chunk_size)
+            self.assertEqual([measurement.pk for measurement in iterated], expected, chunk_size)
+
+    def test_json(self):
+        response = self.client.get('/api/measurements/', {'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        measurements = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual([measurement['value'] for measurement in measurements], [6, 5, 4, 3, 2, 1, 0])
+
+    def test_csv(self):
+        response = self.client.get('/api/measurements/', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+
+        lines = b''.join(response.streaming_content).decode().strip().splitlines()
+        self.assertEqual(len(lines), 8)
+        self.assertIn('value', lines[0].split(','))
+
+        response = self.client.get('/api/peripheral-definitions/', {'stream': 'csv'})
+        lines = b''.join(response.streaming_content).decode().strip().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Sensor', lines[1])
@@ -13,6 +13,8 @@ router.register(r'peripheral-definitions', views.PeripheralDefinitionViewSet, ba
 router.register(r'peripheral-configuration-definitions', views.PeripheralConfigurationDefinitionViewSet, base_name='peripheralconfigurationdefinition')
 router.register(r'peripherals', views.PeripheralViewSet, base_name='peripheral')
 router.register(r'measurements', views.MeasurementViewSet, base_name='measurement')
+router.register(r'latest-measurements', views.LatestMeasurementViewSet, base_name='latestmeasurement')
+router.register(r'series', views.SeriesViewSet, base_name='series')
 
 urlpatterns = [
     url(r'^api/auth-token-obtain/', rest_framework_jwt.views.obtain_jwt_token),
@@ -1,11 +1,78 @@
-from rest_framework.decorators import detail_route
-from rest_framework import viewsets, mixins, response
-
+import datetime
+import itertools
+import json
+
+from django.utils import dateparse, http, timezone
+from rest_framework.decorators import detail_route, list_route
+from rest_framework import viewsets, mixins, response, status, exceptions
+
+from backend import archive
+from backend import configuration
+from backend import downsampling
+from backend import ingest
+from backend import latest
 from backend import models
+from backend import pagination
+from backend import rollups
 from backend import serializers
+from backend import streaming
 from backend import permissions
 
 
+def query_id(request, name, required=False):
+    """
+    Get an id from the query parameters of a request.
+
+    :return: The id, or None if it is not given and not required.
+    """
+    value = request.query_params.get(name)
+    if value is None:
+        if required:
+            raise exceptions.ParseError("Expected `%s`." % name)
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        raise exceptions.ParseError("Expected `%s` to be an id." % name)
+
+
+def query_date_time(request, name, required=False):
+    """
+    Get an ISO 8601 date-time from the query parameters of a request. Naive
+    date-times are taken to be in UTC.
+
+    :return: The date-time, or None if it is not given and not required.
+    """
+    value = request.query_params.get(name)
+    if value is None and not required:
+        return None
+
+    try:
+        date_time = dateparse.parse_datetime(value or '')
+    except ValueError:
+        date_time = None
+    if date_time is None:
+        raise exceptions.ParseError("Expected `%s` to be an ISO 8601 date-time." % name)
+    if timezone.is_naive(date_time):
+        date_time = timezone.make_aware(date_time, datetime.timezone.utc)
+    return date_time
+
+
+def configuration_response(request, kit_configurations, data):
+    """
+    Respond with kit configuration data, or with 304 Not Modified if the
+    request's `If-None-Match` holds the ETag of the configurations.
+
+    :param kit_configurations: A list of `backend.models.KitConfiguration`
+    the data is of.
+    """
+    etag = configuration.etag(kit_configurations)
+    if etag in http.parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return response.Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return response.Response(data, headers={'ETag': etag})
+
+
 # Create your views here.
 class KitViewSet(viewsets.GenericViewSet,
                  mixins.ListModelMixin,
@@ -17,6 +84,17 @@ class KitViewSet(viewsets.GenericViewSet,
 
     retrieve:
     Return the given kit, if the user has access to it.
+
+    config:
+    Return the configuration of the given kit, if the user has access to it. The response
+    has an `ETag`; pass it in `If-None-Match` to get 304 Not Modified if the configuration
+    has not changed.
+
+    recent_measurements:
+    List the recent measurements of each active peripheral device quantity type of the
+    given kit, downsampled for charting. Pass `since` (an ISO 8601 date-time; defaults to
+    a day ago), `points` (the budget of points per series; defaults to 200) and `method`
+    (`lttb`, or `min_max` to keep all peaks).
     """
 
     def get_queryset(self):
@@ -27,28 +105,68 @@ class KitViewSet(viewsets.GenericViewSet,
         user = self.request.user
 
         if isinstance(user, models.Kit):
-            return models.Kit.objects.filter(pk=user.pk)
+            kits = models.Kit.objects.filter(pk=user.pk)
         else:
-            return models.Kit.kits.owned_by(user=user.pk)
+            kits = models.Kit.kits.owned_by(user=user.pk)
+
+        if self.action in ('list', 'retrieve'):
+            # Rendered by the serializer
+            kits = kits.prefetch_related('peripherals', 'experiment_set')
+        return kits
 
     serializer_class = serializers.HyperlinkedKitSerializer
 
     @detail_route()
     def config(self, request, pk=None):
         qs = self.get_queryset()
-        kit_query = qs.filter(pk=pk)
-        if not kit_query.exists():
+        kit_configurations = configuration.get(qs.filter(pk=pk))
+        if not kit_configurations:
             return response.Response({"detail": "Not found."}, status=404)
-        kit = kit_query.get()
-        return response.Response(kit.generate_config())
-
-
-class KitConfigViewSet(viewsets.ViewSet):
+        return configuration_response(request, kit_configurations, json.loads(kit_configurations[0].config))
+
+    #: The default and maximum budget of points per series of recent measurements
+    DOWNSAMPLING_POINTS = 200
+    MAX_DOWNSAMPLING_POINTS = 5000
+
+    @detail_route(url_path='recent-measurements')
+    def recent_measurements(self, request, pk=None):
+        kit = self.get_object()
+
+        since = query_date_time(request, 'since')
+        if since is None:
+            since = timezone.now() - datetime.timedelta(days=1)
+
+        try:
+            points = int(request.query_params.get('points', self.DOWNSAMPLING_POINTS))
+        except ValueError:
+            raise exceptions.ParseError("Expected `points` to be an integer.")
+        if not 1 <= points <= self.MAX_DOWNSAMPLING_POINTS:
+            raise exceptions.ParseError("Expected `points` to be between 1 and %d." % self.MAX_DOWNSAMPLING_POINTS)
+
+        method = request.query_params.get('method', 'lttb')
+        if method not in downsampling.METHODS:
+            raise exceptions.ParseError("Expected `method` to be one of: %s." % ", ".join(sorted(downsampling.METHODS)))
+
+        recent = kit.recent_measurements(since=since, points=points, method=method)
+        measurements = [
+            measurement
+            for by_quantity_type in recent.values()
+            for series in by_quantity_type.values()
+            for measurement in series
+        ]
+        return response.Response(serializers.MeasurementOutputSerializer(measurements, many=True).data)
+
+
+class KitConfigViewSet(streaming.StreamingListMixin,
+                       viewsets.ViewSet):
     """
     list:
     List the configurations of all kits the user has access to.
     A person user has access to all kits it owns, whereas a kit
-    user has access only to itself.
+    user has access only to itself. Pass `stream=1` (or `stream=csv`,
+    or accept `text/csv`) to stream the list. The response has an
+    `ETag`; pass it in `If-None-Match` to get 304 Not Modified if the
+    configurations have not changed.
     """
 
     def get_queryset(self):
@@ -65,7 +183,16 @@ class KitConfigViewSet(viewsets.ViewSet):
 
     def list(self, request, format=None):
         qs = self.get_queryset()
-        return response.Response([kit.generate_config() for kit in qs.all()])
+        stream_format = self.get_stream_format(request)
+        if stream_format is not None:
+            kit_configurations = configuration.of_kits(streaming.iterate(qs.select_related('configuration')))
+            return self.stream((json.loads(kit_configuration.config) for kit_configuration in kit_configurations), stream_format)
+        kit_configurations = configuration.get(qs)
+        return configuration_response(
+            request,
+            kit_configurations,
+            [json.loads(kit_configuration.config) for kit_configuration in kit_configurations],
+        )
 
 
 class ExperimentViewSet(viewsets.GenericViewSet,
@@ -94,12 +221,14 @@ class ExperimentViewSet(viewsets.GenericViewSet,
     serializer_class = serializers.HyperlinkedExperimentSerializer
 
 
-class PeripheralDefinitionViewSet(viewsets.GenericViewSet,
+class PeripheralDefinitionViewSet(streaming.StreamingListMixin,
+                                  viewsets.GenericViewSet,
                                   mixins.ListModelMixin,
                                   mixins.RetrieveModelMixin):
     """
     list:
-    List all peripheral device definitions.
+    List all peripheral device definitions. Pass `stream=1` (or `stream=csv`, or accept
+    `text/csv`) to stream the list.
 
     retrieve:
     Return the given peripheral device definition.
@@ -109,17 +238,19 @@ class PeripheralDefinitionViewSet(viewsets.GenericViewSet,
         """
         Get a queryset of all peripheral device definitions.
         """
-        return models.PeripheralDefinition.objects.all()
+        return models.PeripheralDefinition.objects.prefetch_related('peripheral_configuration_definitions')
 
     serializer_class = serializers.HyperlinkedPeripheralDefinitionSerializer
 
 
-class PeripheralConfigurationDefinitionViewSet(viewsets.GenericViewSet,
+class PeripheralConfigurationDefinitionViewSet(streaming.StreamingListMixin,
+                                               viewsets.GenericViewSet,
                                                mixins.ListModelMixin,
                                                mixins.RetrieveModelMixin):
     """
     list:
-    List all peripheral device configuration definitions.
+    List all peripheral device configuration definitions. Pass `stream=1` (or `stream=csv`,
+    or accept `text/csv`) to stream the list.
 
     retrieve:
     Return the given peripheral device configuration definition.
@@ -134,13 +265,15 @@ class PeripheralConfigurationDefinitionViewSet(viewsets.GenericViewSet,
     serializer_class = serializers.HyperlinkedPeripheralConfigurationDefinitionSerializer
 
 
-class PeripheralViewSet(viewsets.GenericViewSet,
+class PeripheralViewSet(streaming.StreamingListMixin,
+                        viewsets.GenericViewSet,
                         mixins.ListModelMixin,
                         mixins.RetrieveModelMixin):
     """
     list:
     List all peripheral devices the user has access to. A person user has access to peripheral devices
-    of all kits it owns. A kit user has access to its peripheral devices.
+    of all kits it owns. A kit user has access to its peripheral devices. Pass `stream=1` (or
+    `stream=csv`, or accept `text/csv`) to stream the list.
 
     retrieve:
     Return the given peripheral device, if the user has access to it.
@@ -150,30 +283,151 @@ class PeripheralViewSet(viewsets.GenericViewSet,
         """
         Get a queryset of all peripheral devices the user has access to.
         """
+        # The configurations of the peripheral devices are rendered by the
+        # serializer, along with their definitions
+        peripherals = models.Peripheral.objects.prefetch_related(
+            'peripheral_configurations__peripheral_configuration_definition'
+        )
+
         user = self.request.user
         if isinstance(user, models.Kit):
-            return models.Peripheral.objects.filter(kit=user.pk)
+            return peripherals.filter(kit=user.pk)
         else:
             kits = models.Kit.kits.owned_by(user.pk)
-            return models.Peripheral.objects.filter(kit__in=kits)
+            return peripherals.filter(kit__in=kits)
 
     serializer_class = serializers.HyperlinkedPeripheralSerializer
 
 
-class MeasurementViewSet(viewsets.GenericViewSet,
+class LatestMeasurementViewSet(viewsets.GenericViewSet,
+                               mixins.ListModelMixin):
+    """
+    list:
+    List the latest measurement of each peripheral device quantity type of all kits the
+    user has access to. A person user has access to measurements of all kits it owns. A kit
+    user has access to its measurements. Pass `kit` (a comma-separated list of kit ids) to
+    get the latest measurements of specific kits.
+    """
+
+    def get_queryset(self):
+        """
+        Get a queryset of the latest measurements of all (requested) kits the user has access to.
+        """
+        user = self.request.user
+        if isinstance(user, models.Kit):
+            kits = models.Kit.objects.filter(pk=user.pk)
+        else:
+            kits = models.Kit.kits.owned_by(user.pk)
+
+        kit_ids = self.request.query_params.get('kit')
+        if kit_ids:
+            try:
+                kits = kits.filter(pk__in=[int(kit_id) for kit_id in kit_ids.split(',')])
+            except ValueError:
+                raise exceptions.ParseError("Expected a comma-separated list of kit ids.")
+
+        return latest.get(kits)
+
+    serializer_class = serializers.LatestMeasurementSerializer
+
+
+class SeriesViewSet(viewsets.ViewSet):
+    """
+    list:
+    Aggregate the measurements of a peripheral device quantity type of a kit the user has
+    access to into buckets of time. Pass `kit`, `peripheral` and `quantity_type` (ids),
+    `from` and `to` (ISO 8601 date-times), `width` (the bucket width in seconds, a multiple
+    of 60; defaults to an hour) and `aggregate` (a comma-separated list of `mean`, `min`,
+    `max`, `count` and `last`; defaults to `mean`). The series is returned as arrays of
+    the bucket starts and of each aggregate, leaving out buckets without measurements.
+    """
+
+    #: The maximum number of buckets of a series
+    MAX_BUCKETS = 10000
+
+    def get_queryset(self):
+        """
+        Get a queryset of all kits the user has access to the measurements of.
+        """
+        user = self.request.user
+        if isinstance(user, models.Kit):
+            return models.Kit.objects.filter(pk=user.pk)
+        else:
+            return models.Kit.kits.owned_by(user.pk)
+
+    def list(self, request, format=None):
+        kit = self.get_queryset().filter(pk=query_id(request, 'kit', required=True)).first()
+        if kit is None:
+            raise exceptions.NotFound()
+        peripheral = kit.peripherals.filter(pk=query_id(request, 'peripheral', required=True)).first()
+        if peripheral is None:
+            raise exceptions.NotFound()
+        quantity_type = peripheral.peripheral_definition.quantity_types.filter(pk=query_id(request, 'quantity_type', required=True)).first()
+        if quantity_type is None:
+            raise exceptions.NotFound()
+
+        since = query_date_time(request, 'from', required=True)
+        until = query_date_time(request, 'to', required=True)
+
+        try:
+            width = int(request.query_params.get('width', models.MeasurementRollup.HOUR))
+        except ValueError:
+            raise exceptions.ParseError("Expected `width` to be a number of seconds.")
+        if width <= 0 or width % models.MeasurementRollup.MINUTE != 0:
+            raise exceptions.ParseError("Expected `width` to be a multiple of %d seconds." % models.MeasurementRollup.MINUTE)
+        if (until - since).total_seconds() / width > self.MAX_BUCKETS:
+            raise exceptions.ParseError("The series would have more than %d buckets." % self.MAX_BUCKETS)
+
+        aggregates = request.query_params.get('aggregate', 'mean').split(',')
+        for aggregate in aggregates:
+            if aggregate not in rollups.AGGREGATES:
+                raise exceptions.ParseError("Expected `aggregate` to be a comma-separated list of: %s." % ", ".join(rollups.AGGREGATES))
+
+        columns = rollups.bucketed_series(kit, peripheral, quantity_type, since, until, width, aggregates)
+        return response.Response(dict(
+            kit=kit.pk,
+            peripheral=peripheral.pk,
+            quantity_type=quantity_type.pk,
+            physical_quantity=quantity_type.physical_quantity,
+            physical_unit=quantity_type.physical_unit,
+            width=width,
+            **columns
+        ))
+
+
+class MeasurementViewSet(streaming.StreamingListMixin,
+                         viewsets.GenericViewSet,
                          mixins.ListModelMixin,
                          mixins.RetrieveModelMixin,
                          mixins.CreateModelMixin):
     """
     list:
     List all measurements the user has access to. A person user has access to measurements
-    of all kits it owns. A kit user has access to its measurements.
+    of all kits it owns. A kit user has access to its measurements. Archived measurements
+    are listed first, and have no `url` or `id`. Pass `kit`, `peripheral` and
+    `quantity_type` (ids), and `from` and `to` (ISO 8601 date-times) to filter the
+    measurements. Measurements are listed in pages, ordered by time; follow `next` to
+    get the next page. Pass `page_size` (at most 1000) to set the number of measurements
+    per page. Pass `stream=1` (or `stream=csv`, or accept `text/csv`) to stream all
+    measurements at once instead.
 
     retrieve:
     Return the given measurement, if the user has access to it.
 
     create:
-    Create a measurement. Only kit users can add measurements.
+    Create a measurement. Only kit users can add measurements. Measurements are
+    written behind; the measurement is accepted but might not be stored yet
+    when the response is sent. The response has status 202 (Accepted), and holds
+    the `peripheral`, `date_time` and `value` of the measurement, but no `url` or
+    `id`.
+
+    bulk:
+    Create measurements in bulk. Only kit users can add measurements. The body
+    is either a JSON array, or newline-delimited JSON (with content type
+    `application/x-ndjson`) of measurements. Each measurement is an object with
+    keys `peripheral` (the name of the peripheral device), `physical_quantity`,
+    `physical_unit`, `value` and `date_time`. Valid measurements are stored,
+    invalid measurements are reported by their index.
     """
 
     def get_queryset(self):
@@ -187,8 +441,106 @@ class MeasurementViewSet(viewsets.GenericViewSet,
             kits = models.Kit.kits.owned_by(user.pk)
             return models.Measurement.objects.filter(kit__in=kits)
 
+    def get_kits(self):
+        """
+        Get a queryset of all kits the user has access to the measurements of.
+        """
+        user = self.request.user
+        if isinstance(user, models.Kit):
+            return models.Kit.objects.filter(pk=user.pk)
+        else:
+            return models.Kit.kits.owned_by(user.pk)
+
+    def get_page_kits(self):
+        """
+        Get the ids of the kits of the (filtered) measurements, which are
+        paged separately (see `backend.pagination`).
+        """
+        kits = self.get_kits()
+        pk = query_id(self.request, 'kit')
+        if pk is not None:
+            kits = kits.filter(pk=pk)
+        return list(kits.values_list('pk', flat=True))
+
+    def get_archive_blocks(self):
+        """
+        Get a queryset of the archive blocks of the (filtered) measurements.
+        """
+        return self.filter_series(models.MeasurementArchiveBlock.objects.filter(kit__in=self.get_kits()))
+
+    def get_time_range(self):
+        """
+        Get the start and (exclusive) end of the requested time range.
+        """
+        return (query_date_time(self.request, 'from'), query_date_time(self.request, 'to'))
+
+    def filter_series(self, queryset):
+        """
+        Filter a queryset by the requested kit, peripheral device and quantity type.
+        """
+        for name in ('kit', 'peripheral', 'quantity_type'):
+            pk = query_id(self.request, name)
+            if pk is not None:
+                queryset = queryset.filter(**{name: pk})
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = self.filter_series(super().filter_queryset(queryset))
+        (since, until) = self.get_time_range()
+        if since is not None:
+            queryset = queryset.filter(date_time__gte=since)
+        if until is not None:
+            queryset = queryset.filter(date_time__lt=until)
+        return queryset
+
     serializer_class = serializers.HyperlinkedMeasurementSerializer
     permission_classes = [permissions.IsNotCreationOrIsAuthenticatedKit, ]
+    pagination_class = pagination.MeasurementCursorPagination
+    stream_ordering = ('date_time', 'pk')
+
+    def get_stream_items(self):
+        serializer = self.get_serializer()
+        (since, until) = self.get_time_range()
+        measurements = itertools.chain(
+            archive.read_blocks(self.get_archive_blocks(), since, until),
+            streaming.iterate(self.filter_queryset(self.get_queryset()), self.stream_ordering),
+        )
+        return (serializer.to_representation(measurement) for measurement in measurements)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        accepted = serializers.AcceptedMeasurementSerializer(serializer.instance, context=self.get_serializer_context())
+        return response.Response(accepted.data, status=status.HTTP_202_ACCEPTED)
 
     def perform_create(self, serializer):
-        serializer.save(kit=self.request.user)
+        measurement = models.Measurement(kit=self.request.user, **serializer.validated_data)
+        # Adds the measurement to the buffer, and updates the latest
+        # measurements unless it is a duplicate
+        ingest.store_measurements([("REDUCED", measurement)])
+        serializer.instance = measurement
+
+    #: The content types of newline-delimited JSON request bodies
+    NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson')
+
+    #: The number of measurements inserted at once by bulk creation
+    BULK_CHUNK_SIZE = 1000
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        resolver = ingest.MeasurementResolver(request.user)
+
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type in self.NDJSON_CONTENT_TYPES:
+            # Stream the body, rather than parsing it at once
+            rows = ingest.parse_ndjson(request.stream or [])
+        else:
+            rows = request.data
+            if not isinstance(rows, list):
+                raise exceptions.ParseError("Expected a list of measurements.")
+
+        result = ingest.bulk_store_rows(resolver, rows, chunk_size=self.BULK_CHUNK_SIZE)
+        if result['rejected'] and not result['created'] and not result['duplicates']:
+            return response.Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return response.Response(result, status=status.HTTP_201_CREATED)
@@ -0,0 +1,182 @@
+"""
+Module defining the compact binary wire format of measurement websocket
+frames. It is supported next to the JSON protocol: kits may publish
+measurements in binary frames, and subscribers may opt in to receive
+measurements in binary frames.
+
+All values are little-endian. A frame starts with a header, consisting of
+an opcode (uint8), a nonce (uint32) and the number of entries (uint16).
+The header is followed by the entries:
+
+- `PUBLISH` (kit to server) and `MEASUREMENTS` (server to subscriber)
+  frames hold measurement records, each consisting of the measurement type
+  (uint8, see `MEASUREMENT_TYPES`), the peripheral device id (uint32), the
+  quantity type id (uint32, 0 if none), the time as seconds since the Unix
+  epoch (float64) and the value (float64). Published records must have a
+  quantity type.
+- `PUBLISH_REPLY` (server to kit) frames hold the status (uint8) of each
+  published measurement, in the order of the records of the `PUBLISH` frame
+  with the same nonce: `STATUS_PUBLISHED`, `STATUS_ERROR` if the record is
+  invalid (or the frame could not be handled), or `STATUS_DUPLICATE` if the
+  measurement had already been published (see
+  `backend.models.Measurement`), in which case it is neither stored nor sent
+  to subscribers again.
+
+Kits may only send `PUBLISH` frames.
+
+The peripheral device and quantity type ids are part of the kit
+configuration.
+"""
+
+import datetime
+import struct
+
+#: Opcode of frames publishing measurements
+PUBLISH = 0x01
+
+#: Opcode of frames holding measurements sent to subscribers
+MEASUREMENTS = 0x02
+
+#: Opcode of frames replying to `PUBLISH` frames
+PUBLISH_REPLY = 0x81
+
+#: The measurement types, by their encoded value
+MEASUREMENT_TYPES = {
+    0: "REAL_TIME",
+    1: "REDUCED",
+}
+
+_MEASUREMENT_TYPE_VALUES = {measurement_type: value for (value, measurement_type) in MEASUREMENT_TYPES.items()}
+
+#: Reply status of published measurements: published, invalid, or already
+#: published before
+STATUS_PUBLISHED = 0
+STATUS_ERROR = 1
+STATUS_DUPLICATE = 2
+
+HEADER = struct.Struct('<BIH')
+RECORD = struct.Struct('<BIIdd')
+
+#: The maximum number of entries in a frame
+MAX_ENTRIES = 0xFFFF
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FrameError(ValueError):
+    """
+    Raised when a binary frame is malformed.
+    """
+    pass
+
+
+def timestamp(date_time):
+    """
+    Get the number of seconds since the Unix epoch of an aware datetime.
+    """
+    return (date_time - _EPOCH).total_seconds()
+
+
+def from_timestamp(seconds):
+    """
+    Get the aware (UTC) datetime of a number of seconds since the Unix epoch.
+    """
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def decode_header(data):
+    """
+    Decode the header of a frame.
+
+    :param data: The frame.
+    :return: A tuple of the opcode, nonce and number of entries.
+    :raises FrameError: If the frame is too short.
+    """
+    if len(data) < HEADER.size:
+        raise FrameError("Frame is shorter than its header")
+    return HEADER.unpack_from(data)
+
+
+def decode_measurements(data, opcode = MEASUREMENTS):
+    """
+    Decode a `MEASUREMENTS` (or `PUBLISH`) frame.
+
+    :param data: The frame.
+    :param opcode: The expected opcode of the frame.
+    :return: A tuple of the nonce and a list of records, each a tuple of the
+    measurement type (a string, or None if unknown), the peripheral device id,
+    the quantity type id (None if 0), the time in seconds since the Unix epoch
+    and the value.
+    :raises FrameError: If the frame is malformed.
+    """
+    (frame_opcode, nonce, count) = decode_header(data)
+    if frame_opcode != opcode:
+        raise FrameError("Unexpected opcode %#x" % frame_opcode)
+    if len(data) != HEADER.size + count * RECORD.size:
+        raise FrameError("Frame length does not match its number of records")
+
+    records = []
+    for (measurement_type, peripheral_id, quantity_type_id, seconds, value) in RECORD.iter_unpack(memoryview(data)[HEADER.size:]):
+        records.append((MEASUREMENT_TYPES.get(measurement_type), peripheral_id, quantity_type_id or None, seconds, value))
+
+    return (nonce, records)
+
+
+def encode_measurements(records, opcode = MEASUREMENTS, nonce = 0):
+    """
+    Encode a `MEASUREMENTS` (or `PUBLISH`) frame.
+
+    :param records: A list of records, each a tuple of the measurement type
+    (a string), the peripheral device id, the quantity type id (or None), the
+    time in seconds since the Unix epoch and the value.
+    """
+    if len(records) > MAX_ENTRIES:
+        raise FrameError("Too many records for a single frame")
+
+    frame = bytearray(HEADER.size + len(records) * RECORD.size)
+    HEADER.pack_into(frame, 0, opcode, nonce, len(records))
+
+    offset = HEADER.size
+    for (measurement_type, peripheral_id, quantity_type_id, seconds, value) in records:
+        RECORD.pack_into(frame, offset, _MEASUREMENT_TYPE_VALUES[measurement_type], peripheral_id, quantity_type_id or 0, seconds, value)
+        offset += RECORD.size
+
+    return bytes(frame)
+
+
+def join_measurements(frames):
+    """
+    Join `MEASUREMENTS` frames into a single frame.
+
+    :param frames: A list of `MEASUREMENTS` frames.
+    """
+    if len(frames) == 1:
+        return frames[0]
+
+    records = [frame[HEADER.size:] for frame in frames]
+    count = sum(len(data) // RECORD.size for data in records)
+    if count > MAX_ENTRIES:
+        raise FrameError("Too many records for a single frame")
+
+    return HEADER.pack(MEASUREMENTS, 0, count) + b''.join(records)
+
+
+def encode_publish_reply(nonce, statuses):
+    """
+    Encode a `PUBLISH_REPLY` frame.
+
+    :param nonce: The nonce of the `PUBLISH` frame replied to.
+    :param statuses: A list of statuses, one per published record.
+    """
+    return HEADER.pack(PUBLISH_REPLY, nonce, len(statuses)) + bytes(statuses)
+
+
+def measurement_record(measurement_type, measurement):
+    """
+    Get the record of a measurement, as accepted by `encode_measurements`.
+
+    :param measurement_type: The measurement type.
+    :param measurement: A measurement (with an aware date_time).
+    """
+    return (measurement_type, measurement.peripheral_id, measurement.quantity_type_id, timestamp(measurement.date_time), measurement.value)
+
@@ -10,6 +10,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import os
 import datetime
+import tempfile
 import server.secretsettings
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -66,12 +67,64 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'server.urls'
 ASGI_APPLICATION = 'backend.routing.application'
 
+# The channel layer is shared by all processes on this machine (see
+# backend.layers), such that multiple workers can be run per host
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'backend.layers.UnixSocketChannelLayer',
+        'CONFIG': {
+            # Shared by all processes; preferably on a memory-backed file system
+            'directory': os.path.join(tempfile.gettempdir(), 'astroplant-channels'),
+        },
     },
 }
 
+# The number of threads asynchronous websocket consumers use to access the database
+DATABASE_EXECUTOR_THREADS = 8
+
+# The minimum interval in milliseconds at which REAL_TIME measurements are sent
+# to a subscriber; newer measurements replace pending ones (see
+# backend.conflation). 0 disables conflation
+REAL_TIME_SUBSCRIPTION_INTERVAL = 250
+
+# Write-behind buffer of measurements (see backend.buffer)
+MEASUREMENT_BUFFER = {
+    # Flush after this many rows...
+    'MAX_ROWS': 500,
+    # ...or after this many milliseconds, whichever comes first
+    'MAX_DELAY': 1000,
+    # The maximum number of rows held in memory
+    'MAX_PENDING': 10000,
+}
+
+# The number of days measurements and rollups are kept, None to keep them
+# forever (see backend.retention). Kits can override these
+MEASUREMENT_RETENTION = {
+    'RAW': None,
+    'MINUTE': None,
+    'HOUR': None,
+    'DAY': None,
+    # The purger removes this many consecutive primary keys at once...
+    'CHUNK_SIZE': 5000,
+    # ...and pauses this many milliseconds in between
+    'CHUNK_DELAY': 100,
+}
+
+# Whether measurements are stored without their physical quantity and unit
+# strings, which are looked up from their (unregistered) quantity type instead
+# (see backend.models.Measurement). Convert existing measurements with the
+# compact_measurements management command after changing this
+COMPACT_MEASUREMENTS = False
+
+# Measurements older than AFTER_DAYS days are moved out of the database into
+# files of BLOCK_DAYS days per peripheral device quantity type, stored in
+# DIRECTORY (see backend.archive). AFTER_DAYS None disables archiving
+MEASUREMENT_ARCHIVE = {
+    'DIRECTORY': os.path.join(BASE_DIR, 'archive'),
+    'AFTER_DAYS': None,
+    'BLOCK_DAYS': 30,
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -1,11 +1,13 @@
 import datetime
+import itertools
 from django.shortcuts import render
 from django.contrib import messages
 from django.urls import reverse_lazy
 from django.core import exceptions
 from django.contrib.auth import login, decorators
 from django.contrib.auth import views as auth_views
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Prefetch, Q
 import django.http
 import django.urls.base
 from braces.views import AnonymousRequiredMixin, LoginRequiredMixin
@@ -13,6 +15,9 @@ from registration.backends.hmac import views as registration_views
 from dal import autocomplete
 
 import backend.models
+import backend.archive
+import backend.deletion
+import backend.latest
 import website.forms
 
 
@@ -35,21 +40,49 @@ def map(request):
 
 @decorators.login_required
 def dashboard(request):
-    context = {'kits': backend.models.Kit.kits.owned_by(user=request.user)}
+    # The current readings of all kits are fetched with a single query
+    kits = backend.models.Kit.kits.owned_by(user=request.user).prefetch_related(
+        Prefetch('latest_measurements', queryset=backend.models.LatestMeasurement.objects.select_related('peripheral', 'quantity_type'))
+    )
+    context = {'kits': kits}
 
     return render(request,'website/dashboard.html', context)
 
 
+#: The default and maximum number of days of measurements charted on the kit page
+CHART_DAYS = 1
+MAX_CHART_DAYS = 31
+
+#: The default and maximum number of points of each chart on the kit page
+CHART_POINTS = 200
+MAX_CHART_POINTS = 2000
+
+
+def _bounded_int(value, default, maximum):
+    try:
+        return min(max(int(value), 1), maximum)
+    except (TypeError, ValueError):
+        return default
+
+
 def kit(request, kit_id):
     kit = backend.models.Kit.kits.safe_get(kit_id)
 
+    # The charts cover a number of days, downsampled to a budget of points
+    days = _bounded_int(request.GET.get('days'), CHART_DAYS, MAX_CHART_DAYS)
+    points = _bounded_int(request.GET.get('points'), CHART_POINTS, MAX_CHART_POINTS)
+
     context = {
         'kit': kit,
         'can_view_kit_dashboard': request.user.has_perm('backend.view_kit_dashboard', kit)
     }
     # Catch for kit not existing at all
     if kit:
-       context['recent_measurements'] = kit.recent_measurements(max_measurements=50)
+       context['recent_measurements'] = kit.recent_measurements(
+           since=datetime.datetime.utcnow() - datetime.timedelta(days=days),
+           points=points,
+       )
+       context['latest_measurements'] = backend.latest.by_series(kit)
 
     return render(request, 'website/kit.html', context)
 
@@ -96,7 +129,7 @@ def kit_download(request, kit_id):
                 writer.writerow([key, val])
             zip.writestr("kit.csv", buffer.getvalue())
             
-            write_to_csv(zip, "measurements.csv", kit.measurements.all().values())
+            write_to_csv(zip, "measurements.csv", itertools.chain(backend.archive.values(kit), kit.measurements.all().expanded_values()))
             write_to_csv(zip, "peripherals.csv", kit.peripherals.all().values())
             write_to_csv(zip, "peripheral_definitions.csv", backend.models.PeripheralDefinition.objects.filter(peripheral__in=kit.peripherals.all()).all().values())
             
@@ -322,18 +355,20 @@ def kit_configure_peripherals_add_step2(request, kit_id, peripheral_definition_i
         peripheral_configuration_form_set = PeripheralConfigurationFormSet(request.POST, initial = [{} for peripheral_configuration_definition in peripheral_configuration_definitions])
 
         if peripheral_form.is_valid() and peripheral_configuration_form_set.is_valid():
-            peripheral = peripheral_form.save(commit=False)
-            peripheral.kit = kit
-            peripheral.peripheral_definition = peripheral_definition
-            peripheral.save()
-
-            # Save all peripheral device configurations with a non-blank value
-            for peripheral_configuration_definition, peripheral_configuration_form in zip(peripheral_configuration_definitions, peripheral_configuration_form_set.forms):
-                peripheral_configuration = peripheral_configuration_form.save(commit=False)
-                peripheral_configuration.peripheral = peripheral
-                peripheral_configuration.peripheral_configuration_definition = peripheral_configuration_definition
-                if peripheral_configuration.value:
-                    peripheral_configuration.save()
+            # Saved at once, such that the kit is sent the complete configuration
+            with transaction.atomic():
+                peripheral = peripheral_form.save(commit=False)
+                peripheral.kit = kit
+                peripheral.peripheral_definition = peripheral_definition
+                peripheral.save()
+
+                # Save all peripheral device configurations with a non-blank value
+                for peripheral_configuration_definition, peripheral_configuration_form in zip(peripheral_configuration_definitions, peripheral_configuration_form_set.forms):
+                    peripheral_configuration = peripheral_configuration_form.save(commit=False)
+                    peripheral_configuration.peripheral = peripheral
+                    peripheral_configuration.peripheral_configuration_definition = peripheral_configuration_definition
+                    if peripheral_configuration.value:
+                        peripheral_configuration.save()
 
             messages.add_message(request, messages.SUCCESS, 'The peripheral device has been added.')
             return django.http.HttpResponseRedirect(django.urls.base.reverse(viewname='website:kit_configure_peripherals', kwargs={
@@ -388,11 +423,11 @@ def kit_configure_danger_zone(request, kit_id):
             kit_ = form.save(commit=False)
             if kit_.name == kit.name:
                 if request.POST.get('action') == "remove_measurements":
-                    kit.measurements.all().delete()
-                    messages.add_message(request, messages.SUCCESS, 'All measurements have been removed from the kit.')
+                    backend.deletion.schedule_measurement_removal(kit)
+                    messages.add_message(request, messages.SUCCESS, 'The measurements are being removed from the kit. This may take a while.')
                 elif request.POST.get('action') == "remove_kit":
-                    kit.delete()
-                    messages.add_message(request, messages.SUCCESS, 'The kit has been removed.')
+                    backend.deletion.schedule_kit_removal(kit)
+                    messages.add_message(request, messages.SUCCESS, 'The kit has been removed. Its measurements are being removed in the background.')
                     return django.http.HttpResponseRedirect(django.urls.base.reverse(viewname='website:dashboard'))
                 else: 
                     messages.add_message(request, messages.ERROR, 'An error occured. Please try again.')
@@ -401,7 +436,9 @@ def kit_configure_danger_zone(request, kit_id):
                                          
     form = Form()
     
-    return render(request, 'website/kit_configure_danger_zone.html', {'kit': kit, 'form': form})
+    deletion_jobs = kit.deletion_jobs.all()[:5]
+
+    return render(request, 'website/kit_configure_danger_zone.html', {'kit': kit, 'form': form, 'deletion_jobs': deletion_jobs})
 
 @decorators.login_required
 def kit_add(request):
@@ -504,11 +541,13 @@ def peripheral_definition_configure(request, peripheral_definition_id):
         if not form.is_valid() or not form_set.is_valid():
             return render(request,'website/peripheral_definition_configure.html', {'peripheral_definition': peripheral_definition, 'form': form, 'form_set': form_set})
 
-        # Save the peripheral device definition
-        form.save()
+        # Saved at once, such that kits are sent their complete configurations
+        with transaction.atomic():
+            # Save the peripheral device definition
+            form.save()
 
-        # Save the peripheral device configuration definitions
-        form_set.save()
+            # Save the peripheral device configuration definitions
+            form_set.save()
 
         # Generate a new form set
         form_set = PeripheralConfigurationDefinitionFormSet(instance=peripheral_definition)